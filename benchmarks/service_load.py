@@ -0,0 +1,87 @@
+"""
+Load test of the search service (see modules/search_service.py).
+Some clients send the queries at the same time, each one on its own keep alive connection,
+then the throughput and the percentiles of the latencies are printed.
+Start the service, then run from the root of the repository:
+    python benchmarks/service_load.py [--port PORT] [--clients N] [--requests N] [--engine v1|v2|v3]
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import urlencode
+
+queries = ['data science', 'machine learning', 'advanced knowledge', 'business management', 'computer engineering',
+           'finance', 'health economics', 'physics', 'law', 'artificial intelligence', 'biology statistics', 'design']
+
+
+async def client(host: str, port: int, n_requests: int, engine: str, mode: str, latencies: list) -> int:
+    """
+    This function sends some queries on a single connection, saving the latency of each one
+    Args:
+        host (str): The address of the service
+        port (int): The port of the service
+        n_requests (int): The number of queries
+        engine (str): The search engine
+        mode (str): The mode of the queries
+        latencies (list): The list where the latencies (in seconds) are added
+    Returns:
+        int: The number of failed requests
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    errors = 0
+    try:
+        for _ in range(n_requests):
+            target = '/search?' + urlencode({'q': random.choice(queries), 'engine': engine, 'mode': mode})
+            start = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+            await writer.drain()
+
+            head = await reader.readuntil(b'\r\n\r\n')
+            lines = head.decode('latin-1').split('\r\n')
+            length = 0
+            for line in lines[1:]:
+                if line.lower().startswith('content-length:'):
+                    length = int(line.split(':', 1)[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+
+            if lines[0].split(' ')[1] != '200':
+                errors += 1
+    finally:
+        writer.close()
+    return errors
+
+
+async def run(args) -> int:
+    latencies = []
+    start = time.perf_counter()
+    per_client = [args.requests // args.clients + (i < args.requests % args.clients) for i in range(args.clients)]
+    errors = await asyncio.gather(*[client(args.host, args.port, n, args.engine, args.mode, latencies) for n in per_client])
+    seconds = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(p: float) -> float:
+        return latencies[min(int(p * len(latencies)), len(latencies) - 1)] * 1000
+
+    print(f'{len(latencies)} requests in {seconds:.2f} s ({len(latencies) / seconds:.1f} requests/s), {sum(errors)} errors')
+    print(f'latency p50 {percentile(0.5):.2f} ms  p95 {percentile(0.95):.2f} ms  p99 {percentile(0.99):.2f} ms  max {latencies[-1] * 1000:.2f} ms')
+    return 1 if sum(errors) > 0 else 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description = 'Load test of the search service')
+    parser.add_argument('--host', default = '127.0.0.1', help = 'Address of the service')
+    parser.add_argument('--port', type = int, default = 8000, help = 'Port of the service')
+    parser.add_argument('--clients', type = int, default = 16, help = 'Number of concurrent connections')
+    parser.add_argument('--requests', type = int, default = 2000, help = 'Total number of requests')
+    parser.add_argument('--engine', default = 'v2', help = 'Search engine (v1, v2 or v3)')
+    parser.add_argument('--mode', default = 'and', help = 'Mode of the queries (and, or, boolean, phrase)')
+    args = parser.parse_args()
+
+    return asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,55 @@
+"""
+Startup-time benchmark of the search engine modules.
+Each module is imported in a fresh Python interpreter (so nothing is already cached),
+the best time over some repetitions is compared with the budget.
+Run it from the root of the repository:
+    python benchmarks/startup_time.py [--budget SECONDS] [--repeat N]
+It exits with status 1 if at least one module is over the budget.
+"""
+import sys
+import time
+import argparse
+import subprocess
+
+modules = ['modules.engine_v1', 'modules.engine_v2', 'modules.engine_v3', 'modules.boolean_query']
+
+
+def import_time(module: str, repeat: int) -> float:
+    """
+    This function measures the time needed to start a new interpreter and import a module,
+    minus the time needed to start an empty interpreter
+    Args:
+        module (str): The name of the module
+        repeat (int): The number of repetitions
+    Returns:
+        float: The best import time in seconds
+    """
+    def best(code: str) -> float:
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', code], check = True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    return best(f'import {module}') - best('pass')
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description = 'Cold import time of the search engine modules')
+    parser.add_argument('--budget', type = float, default = 0.25, help = 'Maximum import time in seconds')
+    parser.add_argument('--repeat', type = int, default = 5, help = 'Number of repetitions for each module')
+    args = parser.parse_args()
+
+    over_budget = False
+    for module in modules:
+        seconds = import_time(module, args.repeat)
+        status = 'OK' if seconds <= args.budget else 'OVER BUDGET'
+        over_budget = over_budget or seconds > args.budget
+        print(f'{module:<25} {seconds * 1000:8.1f} ms  {status}')
+
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+import regex as re
+
+from . import engine_v1
+from . import postings
+
+# Grammar of the boolean queries (two consecutive terms without operator are in AND):
+#     expression := conjunction ('OR' conjunction)*
+#     conjunction := negation (['AND'] negation)*
+#     negation := 'NOT' negation | '(' expression ')' | word
+# The operators must be written in upper case, so that the lower case words "and", "or", "not"
+# are still treated as normal words. Each word is preprocessed with engine_v1.preprocess(),
+# so the same analyzer of the documents is used. The parsed query is a tree of tuples:
+#     ('term', word), ('and', (child1, child2, ...)), ('or', (child1, child2, ...)), ('not', child)
+
+
+def tokenize(query: str) -> list:
+    """
+    This function splits the query in parentheses, operators and words
+    Args:
+        query (str): The query
+    Returns:
+        list: The list of tokens
+    """
+    return re.findall(r"\(|\)|[^\s()]+", query)
+
+
+def parse(query: str) -> tuple:
+    """
+    This function parses a boolean query, e.g. "data AND (science OR engineering) NOT business"
+    Args:
+        query (str): The query
+    Returns:
+        tuple: The tree of the query (None if the query has no words after the preprocessing)
+    Raises:
+        ValueError: If the query is not well formed
+    """
+    tokens = tokenize(query)
+    position = 0
+
+    def peek():
+        return tokens[position] if position < len(tokens) else None
+
+    def expression():
+        nonlocal position
+        children = [conjunction()]
+        while peek() == 'OR':
+            position += 1
+            children.append(conjunction())
+        return combine('or', children)
+
+    def conjunction():
+        nonlocal position
+        children = [negation()]
+        while peek() is not None and peek() not in ('OR', ')'):
+            if peek() == 'AND':
+                position += 1
+            children.append(negation())
+        return combine('and', children)
+
+    def negation():
+        nonlocal position
+        token = peek()
+        if token is None or token in (')', 'AND', 'OR'):
+            raise ValueError(f"Unexpected {token or 'end of the query'} in the query: {query}")
+        position += 1
+
+        if token == 'NOT':
+            child = negation()
+            return ('not', child) if child is not None else None
+
+        if token == '(':
+            child = expression()
+            if peek() != ')':
+                raise ValueError(f"Missing closing parenthesis in the query: {query}")
+            position += 1
+            return child
+
+        # A single token can produce more words (or none, e.g. if it is a stopword)
+        words = engine_v1.preprocess(token)
+        return combine('and', [('term', word) for word in words])
+
+    tree = expression()
+    if peek() is not None:
+        raise ValueError(f"Unexpected {peek()} in the query: {query}")
+
+    return tree
+
+
+def combine(operator: str, children: list) -> tuple:
+    """
+    This function combines the children with an operator, removing the empty children
+    (e.g. stopwords) and avoiding the operators with a single child
+    Args:
+        operator (str): The operator ('and' or 'or')
+        children (list): The trees of the children
+    Returns:
+        tuple: The combined tree (None if there are no children)
+    """
+    children = tuple(child for child in children if child is not None)
+    if len(children) == 0:
+        return None
+    if len(children) == 1:
+        return children[0]
+    return (operator, children)
+
+
+def positive_words(tree: tuple) -> list:
+    """
+    This function returns the words of the query that are not negated,
+    i.e. the ones that can be used to rank the documents
+    Args:
+        tree (tuple): The tree of the query
+    Returns:
+        list: The list of words
+    """
+    if tree is None or tree[0] == 'not':
+        return []
+    if tree[0] == 'term':
+        return [tree[1]]
+    return [word for child in tree[1] for word in positive_words(child)]
+
+
+def words(tree: tuple) -> list:
+    """
+    This function returns all the words of the query, also the negated ones
+    Args:
+        tree (tuple): The tree of the query
+    Returns:
+        list: The list of words
+    """
+    if tree is None:
+        return []
+    if tree[0] == 'term':
+        return [tree[1]]
+    if tree[0] == 'not':
+        return words(tree[1])
+    return [word for child in tree[1] for word in words(child)]
+
+
+class EmptyCursor:
+    """
+    Cursor of an empty posting list
+
+    All the cursors iterate over a sorted list of document ids, only forward, through
+    the method seek(target) which moves the cursor to the first document >= target and
+    returns it (None if there are no more documents). Seeking a target not greater than
+    the current document does not move the cursor
+    """
+
+    def seek(self, target: int) -> int:
+        return None
+
+
+class ListCursor:
+    """
+    Cursor of a sorted list of document ids (e.g. a posting list)
+    It moves forward with a galloping search, so it can skip most of the list
+    """
+
+    def __init__(self, lst):
+        self.lst = lst
+        self.position = 0
+
+    def seek(self, target: int) -> int:
+        self.position = postings.gallop(self.lst, target, self.position)
+        return self.lst[self.position] if self.position < len(self.lst) else None
+
+
+class AndCursor:
+    """
+    Cursor of the documents that are in all the positive cursors and in none of the negative
+    ones. The cursors are moved forward alternately until they all agree on a document
+    """
+
+    def __init__(self, positives: list, negatives: list):
+        self.positives = positives
+        self.negatives = negatives
+        self.current = None
+
+    def seek(self, target: int) -> int:
+        if self.current is not None and target <= self.current:
+            return self.current
+
+        candidate = target
+        while True:
+            agreed = True
+            for cursor in self.positives:
+                doc_id = cursor.seek(candidate)
+                if doc_id is None:
+                    self.current = None
+                    self.positives = [EmptyCursor()]
+                    return None
+                if doc_id > candidate:
+                    candidate = doc_id
+                    agreed = False
+            if not agreed:
+                continue
+
+            # All the positive cursors are on the candidate, now we check the negative ones
+            if any(cursor.seek(candidate) == candidate for cursor in self.negatives):
+                candidate += 1
+                continue
+
+            self.current = candidate
+            return candidate
+
+
+class OrCursor:
+    """
+    Cursor of the documents that are in at least one of the cursors
+    """
+
+    def __init__(self, cursors: list):
+        self.cursors = cursors
+        self.current = None
+
+    def seek(self, target: int) -> int:
+        if self.current is not None and target <= self.current:
+            return self.current
+
+        doc_ids = [doc_id for doc_id in (cursor.seek(target) for cursor in self.cursors) if doc_id is not None]
+        self.current = min(doc_ids) if len(doc_ids) > 0 else None
+        if self.current is None:
+            self.cursors = []
+        return self.current
+
+
+def universe() -> list:
+    """
+    This function returns the sorted ids of all the documents, needed to evaluate
+    the negations that are not in AND with a positive condition
+    Returns:
+        list: The sorted ids of all the documents (None if the dataset has not been loaded yet)
+    """
+    df = engine_v1.get_dataset()
+    if df is None:
+        return None
+    index = df.index
+    if index.is_monotonic_increasing:
+        return index.values
+    return sorted(index)
+
+
+def build_cursor(tree: tuple, inverted_index: dict, vocabulary: dict, all_ids: list = None):
+    """
+    This function builds the cursor of the documents that satisfy a (sub)query
+    Args:
+        tree (tuple): The tree of the query
+        inverted_index (dict): The sorted document ids of each term_id
+        vocabulary (dict): The vocabulary
+        all_ids (list): The sorted ids of all the documents (if None, see universe())
+    Returns:
+        The cursor
+    """
+    if tree is None:
+        return EmptyCursor()
+
+    operator = tree[0]
+
+    if operator == 'term':
+        term_id = vocabulary.get(tree[1].lower(), None)
+        lst = inverted_index.get(term_id, None) if term_id is not None else None
+        return ListCursor(lst) if lst is not None else EmptyCursor()
+
+    if operator == 'or':
+        return OrCursor([build_cursor(child, inverted_index, vocabulary, all_ids) for child in tree[1]])
+
+    # The negations are evaluated together with the positive conditions in AND with them
+    children = tree[1] if operator == 'and' else (tree,)
+    positives = [build_cursor(child, inverted_index, vocabulary, all_ids) for child in children if child[0] != 'not']
+    negatives = [build_cursor(child[1], inverted_index, vocabulary, all_ids) for child in children if child[0] == 'not']
+    if len(positives) == 0:
+        if all_ids is None:
+            all_ids = universe()
+        if all_ids is None:
+            raise LookupError("The dataset has not been loaded yet")
+        positives = [ListCursor(all_ids)]
+
+    return AndCursor(positives, negatives)
+
+
+def iterate(cursor):
+    """
+    This function iterates over all the documents of a cursor
+    Args:
+        cursor: The cursor
+    Returns:
+        generator: The sorted document ids
+    """
+    doc_id = cursor.seek(-1)
+    while doc_id is not None:
+        yield int(doc_id)
+        doc_id = cursor.seek(doc_id + 1)
+
+
+def get_document_ids(tree: tuple, inverted_index: dict = None, vocabulary: dict = None, all_ids: list = None) -> list:
+    """
+    This function returns the sorted ids of the documents that satisfy a parsed query.
+    The posting lists are combined lazily through the cursors, so only the final
+    result is materialized
+    Args:
+        tree (tuple): The tree of the query (see parse())
+        inverted_index (dict): The sorted document ids of each term_id
+            (if None, the inverted index of the engine_v1 module)
+        vocabulary (dict): The term_id of each word (if None, the vocabulary of the engine_v1 module)
+        all_ids (list): The sorted ids of all the documents, needed by the negations without
+            a positive condition (if None, the documents of the dataset of the engine_v1 module)
+    Returns:
+        list: The sorted ids of the documents (None if the index does not exists)
+    """
+    if inverted_index is None or vocabulary is None:
+        vocabulary = engine_v1.get_vocabulary()
+        inverted_index = engine_v1.get_inverted_index()
+    if vocabulary is None or inverted_index is None:
+        return None
+
+    try:
+        return postings.to_array(iterate(build_cursor(tree, inverted_index, vocabulary, all_ids)))
+    except LookupError:
+        # The negations without a positive condition need all the documents of the dataset
+        return None
+
+
+def search(query: str):
+    """
+    This function returns the documents that satisfy a boolean query,
+    e.g. "data AND (science OR engineering) NOT business"
+    Args:
+        query (str): The query
+    Returns:
+        pd.DataFrame: The dataframe with the results (None if the index does not exists)
+    Raises:
+        ValueError: If the query is not well formed
+    """
+    tree = parse(query)
+    df = engine_v1.get_dataset()
+    if df is None:
+        return None
+
+    # The parsed query is used in the key, so equivalent queries share the same result
+    key = (tree, ('boolean',), engine_v1.index_generation())
+    found, positions = engine_v1.result_cache.get(key)
+    if not found:
+        document_ids = get_document_ids(tree)
+        if document_ids is None:
+            return None
+        positions = engine_v1.get_positions(document_ids)
+        engine_v1.result_cache.put(key, positions)
+
+    return df.iloc[positions]
@@ -0,0 +1,411 @@
+from __future__ import annotations
+
+import os
+import time
+import random
+import threading
+from urllib.parse import quote, urljoin, urlsplit
+from email.utils import parsedate_to_datetime
+
+from . import create_folders
+from .frontier import Frontier
+
+# Concurrent crawler of the listing pages and of the course pages (the concurrent version of
+# scrape_urls() and download_html()).
+# The pages are downloaded by a pool of threads, each one with its own requests.Session, so the
+# connections to the server are kept alive and reused instead of opening a new one for each page.
+# The requests to each host are limited by a token bucket: at most requests_per_second requests each
+# second on average, with bursts of at most burst requests. When the server answers 429 (Too Many Requests)
+# or 503 the request is retried after the time in the Retry-After header (or after an exponential
+# backoff if there is no header), and the whole host is paused for that time, up to max_retries times.
+# The course pages are saved as in the notebook: in the subfolders of parent_folder (see create_folders())
+# with links_per_folder pages each, with the URL encoded as the name of the file.
+# The state of the pages is saved in a frontier (see the frontier module), so that a crawl can be resumed.
+# requests and bs4 are imported only inside the functions, so that importing the module is fast
+
+site_url = 'https://www.findamasters.com'
+base_url = 'https://www.findamasters.com/masters-degrees/msc-degrees'
+
+# The status codes of the answers that are retried
+retry_status = {429, 500, 502, 503, 504}
+
+# The statistics of the last crawl (see crawl())
+last_stats = {}
+
+
+class TokenBucket:
+    """
+    Rate limiter of the requests to a host: the bucket contains at most burst tokens, it is refilled
+    with rate tokens each second, and each request takes a token (waiting for it if the bucket is empty)
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Args:
+            rate (float): The number of tokens added each second
+            burst (int): The maximum number of tokens
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.last_update = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        This function takes a token, waiting until one is available
+        Returns:
+            float: The time waited in seconds
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last_update) * self.rate)
+                self.last_update = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                # The time until the end of the pause or until the next token
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """
+        This function stops the requests to the host for some seconds (e.g. after a 429 answer)
+        and empties the bucket, so that the requests restart at the normal rate
+        Args:
+            seconds (float): The duration of the pause
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+
+def page_url(base_url: str, page_num: int) -> str:
+    """
+    This function returns the URL of a listing page (as in scrape_urls())
+    Args:
+        base_url (str): The URL of the first listing page
+        page_num (int): The number of the page (from 1)
+    Returns:
+        str: The URL
+    """
+    # The first page doesn't end in '/?PG={page_num}'
+    return f"{base_url}/" if page_num == 1 else f"{base_url}/?PG={page_num}"
+
+
+def parse_course_urls(html: str, url: str) -> list:
+    """
+    This function extracts the links of the courses from a listing page
+    Args:
+        html (str): The HTML of the listing page
+        url (str): The URL of the listing page, used to resolve the relative links
+    Returns:
+        list: The URLs of the courses, in the order of the page
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+    return [urljoin(url, element['href']) for element in soup.find_all('a', {'class': 'courseLink'}) if element.get('href')]
+
+
+def course_path(url: str, index: int, parent_folder: str, subfolder_prefix: str, links_per_folder: int) -> str:
+    """
+    This function returns the file where a course page is saved (as in scrape_urls() and download_html())
+    Args:
+        url (str): The URL of the course
+        index (int): The position of the course in the list of all the courses (from 1)
+        parent_folder (str): The folder with the subfolders
+        subfolder_prefix (str): The prefix of the names of the subfolders
+        links_per_folder (int): The number of pages in each subfolder
+    Returns:
+        str: The path of the file
+    """
+    subfolder_index = (index - 1) // links_per_folder + 1
+    folder_path = create_folders.create_folders(parent_folder, subfolder_prefix, subfolder_index)
+    return os.path.join(folder_path, f"{quote(url, safe='')}.html")
+
+
+def retry_after(value: str) -> float:
+    """
+    This function converts the Retry-After header into seconds
+    Args:
+        value (str): The header, in seconds or as an HTTP date
+    Returns:
+        float: The seconds to wait (None if the header is missing or not valid)
+    """
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Crawler:
+    """
+    Downloader of pages with a pool of keep-alive connections, a token bucket for each host,
+    and retries with exponential backoff. The methods can be called by more threads at the same time
+    """
+
+    def __init__(self, requests_per_second: float = 2.0, burst: int = 4, workers: int = 8, max_retries: int = 5,
+                 backoff: float = 1.0, max_backoff: float = 120.0, timeout: float = 30, user_agent: str = None):
+        """
+        Args:
+            requests_per_second (float): The maximum rate of the requests to each host
+            burst (int): The maximum number of consecutive requests to a host without waiting
+            workers (int): The number of threads (and of connections kept alive for each host)
+            max_retries (int): The maximum number of retries of a page
+            backoff (float): The wait before the first retry, doubled at each retry (if there is no Retry-After header)
+            max_backoff (float): The maximum wait before a retry
+            timeout (float): The timeout of each request in seconds
+            user_agent (str): The user agent sent to the server (if None, the one of requests)
+        """
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.user_agent = user_agent
+        self.buckets = {}
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'bytes': 0, 'waited': 0.0}
+
+    def session(self):
+        """
+        This function returns the session of the current thread, created the first time
+        Returns:
+            requests.Session: The session
+        """
+        import requests
+
+        if getattr(self.local, 'session', None) is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections = 4, pool_maxsize = self.workers)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if self.user_agent is not None:
+                session.headers['User-Agent'] = self.user_agent
+            self.local.session = session
+        return self.local.session
+
+    def bucket(self, url: str) -> TokenBucket:
+        """
+        This function returns the token bucket of the host of a URL
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+            return self.buckets[host]
+
+    def count(self, name: str, value = 1):
+        """
+        This function updates a statistic of the crawl
+        """
+        with self.lock:
+            self.stats[name] += value
+
+    def fetch(self, url: str) -> str:
+        """
+        This function downloads a page, retrying after the 429 and 5xx answers and the network errors.
+        Any other error of the request (e.g. a redirect loop) is a failure of the page
+        Args:
+            url (str): The URL of the page
+        Returns:
+            str: The HTML of the page (None if the download fails)
+        """
+        import requests
+
+        bucket = self.bucket(url)
+        for attempt in range(self.max_retries + 1):
+            self.count('waited', bucket.acquire())
+            self.count('requests')
+            wait = None
+            try:
+                response = self.session().get(url, timeout = self.timeout)
+                if response.status_code not in retry_status:
+                    response.raise_for_status()
+                    self.count('bytes', len(response.content))
+                    return response.text
+                wait = retry_after(response.headers.get('Retry-After'))
+                error = f"Status code: {response.status_code}"
+            except requests.exceptions.HTTPError as e:
+                # The other errors (e.g. 404) are not retried
+                print(f"Failed to download {url}. Error: {e}")
+                break
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+                # The network errors are retried
+                error = str(e)
+            except requests.exceptions.RequestException as e:
+                # The other errors of the request (e.g. a redirect loop or an invalid URL) are not retried,
+                # and the page is recorded as failed without stopping the crawl
+                print(f"Failed to download {url}. Error: {e}")
+                break
+
+            if attempt == self.max_retries:
+                print(f"Failed to download {url}. Error: {error}")
+                break
+            # Exponential backoff with a random jitter, so that the threads do not retry all together
+            if wait is None:
+                wait = self.backoff * 2 ** attempt * (1 + random.random() / 2)
+            wait = min(wait, self.max_backoff)
+            print(f"Rate limited ({error}). Retrying {url} in {wait:.1f} s")
+            self.count('retries')
+            # The pause stops all the requests to the host, not only the ones of this thread
+            bucket.pause(wait)
+
+        self.count('failures')
+        return None
+
+
+def save_page(html: str, file_path: str):
+    """
+    This function saves a page in a file, writing a temporary file first,
+    so that an interrupted crawl never leaves a truncated page
+    Args:
+        html (str): The HTML of the page
+        file_path (str): The path of the file
+    """
+    with open(file_path + '.tmp', "w", encoding = "utf-8") as file:
+        file.write(html)
+    os.replace(file_path + '.tmp', file_path)
+
+
+def crawl(base_url: str = base_url, num_pages: int = 400, parent_folder: str = 'HTML_folders',
+          subfolder_prefix: str = 'page_', links_per_folder: int = 15, page_size: int = 15,
+          crawler: Crawler = None, frontier = None, max_attempts: int = 3) -> list:
+    """
+    This function downloads the listing pages and the course pages at the same time:
+    the links of each listing page are downloaded as soon as the page has been parsed.
+    The position of a course in the list is (page_num - 1) * page_size + its position in the page,
+    so the subfolders are the same of scrape_urls() even if the pages are downloaded in a different order.
+    The state of each page is saved in the frontier (see the frontier module): with a persistent frontier
+    an interrupted crawl can be resumed by calling the function again with the same arguments,
+    and only the pages not fetched yet (or failed less than max_attempts times) are requested.
+    The course pages already saved in their file are not requested again.
+    The statistics of the crawl are saved in last_stats (see report())
+    Args:
+        base_url (str): The URL of the first listing page
+        num_pages (int): The number of listing pages
+        parent_folder (str): The folder with the subfolders of the course pages
+        subfolder_prefix (str): The prefix of the names of the subfolders
+        links_per_folder (int): The number of course pages in each subfolder
+        page_size (int): The number of courses in each listing page
+        crawler (Crawler): The crawler (if None, a Crawler with the default parameters)
+        frontier (Frontier or str): The frontier, or the path of its database
+            (if None, a frontier in memory, so the crawl can not be resumed)
+        max_attempts (int): The maximum number of attempts of a page, over all the crawls
+    Returns:
+        list: The URLs of the courses (without duplicates), in the order of the listing pages
+    """
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    global last_stats
+
+    if crawler is None:
+        crawler = Crawler()
+    opened = not isinstance(frontier, Frontier)
+    if opened:
+        frontier = Frontier(frontier if frontier is not None else ':memory:')
+    start_time = time.monotonic()
+    page_nums = list(range(1, num_pages + 1))
+    frontier.add_pages({page_num: page_url(base_url, page_num) for page_num in page_nums})
+    stats = {'pages': 0, 'courses': 0, 'skipped': 0}
+
+    def fetch_listing(page_num, url):
+        html = crawler.fetch(url)
+        if html is None:
+            frontier.page_failed(page_num)
+            return page_num, None
+        # The page is marked as fetched together with its new links
+        return page_num, frontier.page_fetched(page_num, parse_course_urls(html, url))
+
+    def path_of(url, page_num, position):
+        return course_path(url, (page_num - 1) * page_size + position + 1, parent_folder, subfolder_prefix, links_per_folder)
+
+    def fetch_course(url, page_num, position):
+        file_path = path_of(url, page_num, position)
+        # The pages are saved atomically, so a file left by an interrupted crawl is complete
+        if os.path.exists(file_path):
+            frontier.course_fetched(url, file_path)
+            return url, 'skipped'
+        html = crawler.fetch(url)
+        if html is None:
+            frontier.course_failed(url)
+            return url, None
+        save_page(html, file_path)
+        frontier.course_fetched(url, file_path)
+        return url, 'courses'
+
+    def relocate(url):
+        # A course linked by more listing pages belongs to the first one, which can be fetched
+        # after the course page has been saved: its file is moved to the subfolder of its position.
+        # The files are moved only by the main thread, so two moves of the same file never overlap
+        course = frontier.course(url)
+        if course is None or course['state'] != 'fetched' or course['path'] is None:
+            return
+        file_path = path_of(url, course['page_num'], course['position'])
+        if file_path != course['path'] and os.path.exists(course['path']):
+            os.replace(course['path'], file_path)
+            frontier.set_path(url, file_path)
+
+    with ThreadPoolExecutor(max_workers = crawler.workers) as executor:
+        listings = {executor.submit(fetch_listing, page_num, url) for page_num, url in frontier.pending_pages(page_nums, max_attempts)}
+        # The course pages found by the previous crawls and not downloaded yet
+        courses = {executor.submit(fetch_course, *row) for row in frontier.pending_courses(page_nums, max_attempts)}
+        while listings or courses:
+            done, _ = wait(listings | courses, return_when = FIRST_COMPLETED)
+            for future in done:
+                if future in listings:
+                    listings.remove(future)
+                    page_num, links = future.result()
+                    if links is None:
+                        continue
+                    added, moved = links
+                    stats['pages'] += 1
+                    print(f"Scraped page {page_num}")
+                    for url, position in added:
+                        courses.add(executor.submit(fetch_course, url, page_num, position))
+                    for url in moved:
+                        relocate(url)
+                else:
+                    courses.remove(future)
+                    url, result = future.result()
+                    if result is not None:
+                        stats[result] += 1
+                        relocate(url)
+
+    seconds = time.monotonic() - start_time
+    last_stats = dict(crawler.stats, **stats, seconds = seconds, frontier = frontier.counts(),
+                      pages_per_second = (stats['pages'] + stats['courses']) / seconds if seconds > 0 else 0.0)
+    print(report(last_stats))
+    courses_url = frontier.course_urls(page_nums)
+    if opened:
+        frontier.close()
+    return courses_url
+
+
+def report(stats: dict = None) -> str:
+    """
+    This function returns a summary of the throughput of a crawl
+    Args:
+        stats (dict): The statistics of the crawl (if None, last_stats)
+    Returns:
+        str: The summary
+    """
+    if stats is None:
+        stats = last_stats
+    return (f"Crawled {stats['pages']} listing pages and {stats['courses']} course pages in {stats['seconds']:.1f} s "
+            f"({stats['pages_per_second']:.2f} pages/s, {stats['bytes'] / max(stats['seconds'], 1e-9) / 1024:.1f} KiB/s): "
+            f"{stats['requests']} requests, {stats['retries']} retries, {stats['failures']} failures, "
+            f"{stats['waited']:.1f} s waited for the rate limit, {stats['skipped']} pages already saved")
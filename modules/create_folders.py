@@ -9,8 +9,7 @@ def create_folders(parent_folder, subfolder_prefix, subfolder_index):
     folder_name = f"{subfolder_prefix}{subfolder_index}"
     folder_path = os.path.join(parent_folder, folder_name)
 
-    # Create the subfolder if it doesn't exist
-    if not os.path.exists(folder_path):
-        os.makedirs(folder_path)
+    # Create the subfolder if it doesn't exist (exist_ok, so that more threads can call it at the same time)
+    os.makedirs(folder_path, exist_ok=True)
 
     return folder_path
\ No newline at end of file
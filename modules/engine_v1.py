@@ -1,24 +1,46 @@
-import pandas as pd
+from __future__ import annotations
+
 import json
-import nltk
-from nltk.corpus import stopwords
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
 import regex as re
 
-# Setting the NLTK environment to work with English language
-nltk.download("stopwords", quiet=True)
-nltk.download("punkt", quiet=True)
-stops = set(stopwords.words('english'))
-porterStemmer = nltk.PorterStemmer()
+from . import file_cache
+from . import facets
+from . import index_builder
+from . import postings
+from . import token_store
+from .query_cache import QueryCache
+
+# The heavy modules (pandas and nltk) are imported only when they are needed,
+# so that importing this module is fast and does not need the network.
+# The NLTK resources are loaded lazily by get_stopwords(), get_tokenizer() and get_stemmer()
+stops = None
+tokenizer = None
+porterStemmer = None
+
+# Bundled copy of the NLTK english stopwords, used when the NLTK data is not installed
+path_bundled_stopwords = os.path.join(os.path.dirname(__file__), 'resources', 'stopwords_english.txt')
+
+# The regex used to remove the punctuation (see preprocess())
+punctuation_pattern = r"[^a-zA-Z0-9\s\-]|((?<=[a-zA-Z\W])\-(?=[^a-zA-Z]))|((?<=[^a-zA-Z])\-(?=[a-zA-Z\W]))"
 
 path_vocabulary = 'data/vocabulary.json'
 path_vocabulary_inverted = 'data/vocabulary_inverted.json'
 path_inverted_index = 'data/inverted_index.json'
+path_positional_index = 'data/positional_index.json'
+
+df_original = None
 
-df_original = pd.DataFrame()
+# Cache of the results of the queries (see the query_cache module)
+result_cache = QueryCache()
 
 def create_vocabulary(df: pd.DataFrame) -> dict:
     """
     This function creates a volcabulary from the description column of the dataset
+    (the preprocessed one, 'prep_description', which is computed if it is missing)
     It creates a single list with all the words in the description column, then it
     sort them and remove duplicates. Finally it creates a dictionary with the words as keys
     and as value a progressive integer starting from 0
@@ -31,7 +53,7 @@ def create_vocabulary(df: pd.DataFrame) -> dict:
     vocabulary_inverted = {}
     
     global df_original
-    df_original = df.copy()
+    df_original = prepare_dataset(df)
     
     s = df_original['prep_description']    
 
@@ -46,27 +68,64 @@ def create_vocabulary(df: pd.DataFrame) -> dict:
         vocabulary[word] = i
         vocabulary_inverted[i] = word
 
-    # Saving the vocabulary dictionary into a json file
-    with open(path_vocabulary, "w") as f:
+    # Saving the vocabulary dictionary into a json file (written in a temporary file
+    # that then replaces the old one, so the running queries never read a partial file)
+    with open(path_vocabulary + '.tmp', "w") as f:
         json.dump(vocabulary, f)
+    os.replace(path_vocabulary + '.tmp', path_vocabulary)
+    # Keeping the vocabulary in memory, so that it is not read again from the file
+    file_cache.store(path_vocabulary, vocabulary)
+    # The results computed with the previous vocabulary are no more valid
+    result_cache.clear()
     # Saving the vocabulary inverted dictionary into a json file
-    with open(path_vocabulary_inverted, "w") as f:
+    with open(path_vocabulary_inverted + '.tmp', "w") as f:
         json.dump(vocabulary_inverted, f)
+    os.replace(path_vocabulary_inverted + '.tmp', path_vocabulary_inverted)
 
     return vocabulary
 
 
+def prepare_dataset(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function returns the dataset with the preprocessed description (the 'prep_description' column).
+    If the description has not been preprocessed yet we use the token store, so that only
+    the new or changed descriptions are analyzed, and the column is added to a copy of the dataset
+    Args:
+        df (pd.DataFrame): The dataset
+    Returns:
+        pd.DataFrame: The dataset with the 'prep_description' column (df itself if it already has it)
+    """
+    if 'prep_description' in df.columns:
+        return df
+    df = df.copy()
+    df['prep_description'] = token_store.analyze(df['description'], 'description')
+    return df
+
+
+def get_dataset() -> pd.DataFrame:
+    """
+    This function returns the dataset of the engine, loaded by create_vocabulary()
+    (the indexes on disk are not enough to show the documents found by the queries)
+    Returns:
+        pd.DataFrame: The dataset (None if it has not been loaded yet)
+    """
+    global df_original
+    if df_original is None:
+        print("Vocabulary has not been computed yet")
+    return df_original
+
+
 def get_vocabulary() -> dict:
     """
     This function loads the vocabulary from the vocabulary.json file
+    The file is read only the first time (or when it changes on disk),
+    then the vocabulary is served from memory
     If the vocabulary file doe not exists it returns None
     Returns:
         dict: The vocabulary
     """
     try:
-        with open(path_vocabulary, "r") as f:
-            vocabulary = json.load(f)
-        return vocabulary
+        return file_cache.load(path_vocabulary, json.load)
     except Exception as e:
         return None
 
@@ -74,14 +133,14 @@ def get_vocabulary() -> dict:
 def get_vocabulary_inverted() -> dict:
     """
     This function loads the vocabulary_inverted from the vocabulary_inverted .json file
+    The file is read only the first time (or when it changes on disk),
+    then the vocabulary is served from memory
     If the vocabulary file does not exists it returns None
     Returns:
         dict: The vocabulary
     """
     try:
-        with open(path_vocabulary_inverted, "r") as f:
-            vocabulary = json.load(f)
-        return vocabulary
+        return file_cache.load(path_vocabulary_inverted, json.load)
     except Exception as e:
         return None
 
@@ -117,78 +176,145 @@ def get_word_from_id(term_id: int) -> str:
     return vocabulary_inverted.get(str(term_id), None)
 
 
-def create_inverted_index() -> dict:
+def create_inverted_index(documents = None, max_postings: int = None, positional: bool = False) -> dict:
     """
     This function creates an inverted index from the description column of the dataset
-    It creates a dictionary where the keys are the term_id and the values are the list of
+    It creates a dictionary where the keys are the term_id and the values are the sorted list of
     the indexes of the courses desccription that contains the term
+    The documents are read only once and, if the postings do not fit in the memory budget,
+    they are spilled to disk and merged at the end (see the index_builder module)
+    If positional is True, in the same pass it also creates the positional index
+    (see get_positional_index()), used by the phrase queries
+    Args:
+        documents (iterable): The pairs (index, list of words) of the courses
+            (if None the 'prep_description' column of the dataset is used)
+        max_postings (int): The maximum number of postings kept in memory during the build
+        positional (bool): If True the positional index is also created
     Returns:
-        dict: The inverted index (None if the vocabulary does not exists)
+        dict: The inverted index (None if the vocabulary or the dataset does not exists)
     """
     vocabulary = get_vocabulary()
     if vocabulary is None:
         return None
 
-    inverted_index = {}
-
-    def invert_description(index, lst_words):
-        """
-        This function is used to invert the description of a single course
-        and to append the result in the inverted_index dictionary
-        Args:
-            index (int): The index of the course description
-            lst_words (list): The list of words in the course description
-        Returns:
-            None
-        """
-        
-        # We need to access the inverted_index dictionary, so we need to declare it as nonlocal
-        nonlocal inverted_index
-        
-        for word in lst_words:
-            # Get the term_id of the word
-            term_id = get_term_id(word)
-            
+    if documents is None:
+        df = get_dataset()
+        if df is None:
+            return None
+        documents = zip(df.index, df['prep_description'])
+
+    positional_index = {}
+    if positional:
+        documents = record_positions(documents, vocabulary, positional_index)
+
+    # Building the inverted index and saving it into a json file
+    index_builder.build_inverted_index(documents, vocabulary, path_inverted_index, max_postings)
+
+    if positional:
+        # Saving the positional index into a json file (written in a temporary file
+        # that then replaces the old one, so the running queries never read a partial file)
+        with open(path_positional_index + '.tmp', "w") as f:
+            json.dump(positional_index, f)
+        os.replace(path_positional_index + '.tmp', path_positional_index)
+    # The results computed with the previous index are no more valid
+    result_cache.clear()
+
+    return get_inverted_index()
+
+
+def record_positions(documents, vocabulary: dict, positional_index: dict):
+    """
+    This function passes through the documents unchanged, while recording in the
+    positional_index dictionary the positions of each term in each document
+    in the format {term_id: {document_id: [position1, position2, ...]}}
+    The positions are the ones in the list of preprocessed words (i.e. without stopwords)
+    Args:
+        documents (iterable): The pairs (index, list of words) of the courses
+        vocabulary (dict): The vocabulary
+        positional_index (dict): The dictionary where the positions are recorded
+    Returns:
+        generator: The same pairs (index, list of words)
+    """
+    for doc_id, lst_words in documents:
+        for position, word in enumerate(lst_words):
+            term_id = vocabulary.get(word.lower(), None)
             if term_id is not None:
-                # If the term_id is not in the dictionary we add that key
-                if term_id not in inverted_index:
-                    inverted_index[term_id] = []
-                # We append the index of the course to the list of the term_id
-                inverted_index[term_id].append(index)
-
-                # Finally removing duplicates
-                inverted_index[term_id] = list(set(inverted_index[term_id]))
-                
+                positional_index.setdefault(term_id, {}).setdefault(int(doc_id), []).append(position)
+
+        yield doc_id, lst_words
+
+
+def get_positional_index() -> dict:
+    """
+    This function loads the positional index from the positional_index.json file
+    The file is read only the first time (or when it changes on disk)
+    If the positional index file does not exists it returns None
+    Returns:
+        dict: The positional index, as {term_id: {document_id: array of positions}}
+    """
+    try:
+        return file_cache.load(path_positional_index, load_positional_index)
+    except Exception as e:
         return None
 
-    global df_original
-    df_original.apply(lambda row: invert_description(row.name, row['prep_description']), axis = 1)
 
-    # Saving the inverted index dictionary into a json file
-    with open(path_inverted_index, "w") as f:
-        json.dump(inverted_index, f)
+def load_positional_index(f) -> dict:
+    """
+    This function reads the positional index from an opened json file
+    Args:
+        f (file): The opened json file
+    Returns:
+        dict: The positional index
+    """
+    positional_index = json.load(f)
 
-    return inverted_index
+    # Converting the keys from string to int, since we have to use them as integers
+    return {int(term_id): {int(doc_id): postings.to_array(positions) for doc_id, positions in docs.items()}
+            for term_id, docs in positional_index.items()}
 
 
 def get_inverted_index() -> dict:
     """
     This function loads the inverted index from the inverted_index.json file
+    The file is read only the first time (or when it changes on disk),
+    then the inverted index is served from memory
+    The posting lists are kept as sorted arrays of integers
     If the inverted index file doe not exists it returns None
     Returns:
         dict: The inverted index
     """
     try:
-        with open(path_inverted_index, "r") as f:
-            inverted_index = json.load(f)
-            
-        # Converting the keys from string to int, since we have to use them as integers
-        inverted_index = {int(key): value for key, value in inverted_index.items()}
-        return inverted_index
+        return file_cache.load(path_inverted_index, load_postings)
     except Exception as e:
         return None
 
 
+def load_postings(f) -> dict:
+    """
+    This function reads the inverted index of the engine from an opened json file,
+    converting each posting list into a sorted array of integers
+    Args:
+        f (file): The opened json file
+    Returns:
+        dict: The inverted index
+    """
+    return {term_id: postings.to_array(lst) for term_id, lst in load_inverted_index(f).items()}
+
+
+def load_inverted_index(f) -> dict:
+    """
+    This function reads an inverted index from an opened json file
+    Args:
+        f (file): The opened json file
+    Returns:
+        dict: The inverted index
+    """
+    inverted_index = json.load(f)
+
+    # Converting the keys from string to int, since we have to use them as integers
+    return {int(key): value for key, value in inverted_index.items()}
+
+
 def preprocess(text: str) -> list:
     """
     This function preprocess the text of the query. It applies the following operations:
@@ -208,74 +334,346 @@ def preprocess(text: str) -> list:
     # - the second and the third eliminate the dashes that are not between two letters
     # Some examples: eye- --> eye, -eye --> eye, eye-catching --> eye-catching
 
-    text = re.sub(r"[^a-zA-Z0-9\s\-]|((?<=[a-zA-Z\W])\-(?=[^a-zA-Z]))|((?<=[^a-zA-Z])\-(?=[a-zA-Z\W]))", "", text)
+    text = re.sub(punctuation_pattern, "", text)
 
-    # TOKENIZATION using the word_tokenize() function of NLTK
-    text = nltk.word_tokenize(text)
+    # TOKENIZATION using the word tokenizer of NLTK
+    text = get_tokenizer()(text)
 
     # REMOVING STOPWORDS using the stopwords list of NLTK
-    global stops
+    stops = get_stopwords()
     text = [x for x in text if x not in stops]
 
-    # STEMMING using the PorterStemmer of NLTK
-    global porterStemmer
-    text = [porterStemmer.stem(x) for x in text]
+    # STEMMING using the PorterStemmer of NLTK (through the memoized stem() function)
+    text = [stem(x) for x in text]
 
     return text
 
+
+@functools.lru_cache(maxsize = 100_000)
+def stem(word: str) -> str:
+    """
+    This function returns the (Porter) stem of a word. The stems of the most recent words
+    are remembered, so the stemmer runs only once for each distinct word
+    Args:
+        word (str): The word
+    Returns:
+        str: The stem of the word
+    """
+    return get_stemmer().stem(word)
+
+
+def get_stopwords() -> set:
+    """
+    This function loads (only the first time) the NLTK list of english stopwords.
+    If the NLTK data is not installed it uses the bundled copy of the list,
+    so it never needs to download anything
+    Returns:
+        set: The stopwords
+    """
+    global stops
+    if stops is None:
+        try:
+            from nltk.corpus import stopwords
+            stops = set(stopwords.words('english'))
+        except (ImportError, LookupError):
+            with open(path_bundled_stopwords, "r", encoding = "utf-8") as f:
+                stops = set(line.strip() for line in f if line.strip())
+    return stops
+
+
+def get_tokenizer():
+    """
+    This function loads (only the first time) the word tokenizer of NLTK.
+    nltk.word_tokenize() needs the punkt data only to split the sentences, but the punctuation
+    has already been removed by preprocess(), so without the data we use directly the word
+    tokenizer applied by word_tokenize() to each sentence, which gives the same words
+    Returns:
+        function: The function that splits a text in words
+    """
+    global tokenizer
+    if tokenizer is None:
+        import nltk
+        try:
+            nltk.data.find('tokenizers/punkt')
+            tokenizer = nltk.word_tokenize
+        except LookupError:
+            tokenizer = nltk.tokenize.NLTKWordTokenizer().tokenize
+    return tokenizer
+
+
+def get_stemmer():
+    """
+    This function creates (only the first time) the Porter stemmer of NLTK
+    Returns:
+        PorterStemmer: The stemmer
+    """
+    global porterStemmer
+    if porterStemmer is None:
+        from nltk.stem.porter import PorterStemmer
+        porterStemmer = PorterStemmer()
+    return porterStemmer
+
+
+def analyzer_config() -> dict:
+    """
+    This function returns the configuration of the analyzer used by preprocess().
+    If the configuration changes, the tokens previously saved by the token_store module
+    are not used anymore
+    Returns:
+        dict: The configuration of the analyzer
+    """
+    return {
+        'lowercase': True,
+        'punctuation_pattern': punctuation_pattern,
+        'tokenizer': 'nltk.word_tokenize',
+        'stopwords': sorted(get_stopwords()),
+        'stemmer': 'nltk.PorterStemmer',
+    }
+
+
+def preprocess_batch(texts, n_jobs: int = 1, chunksize: int = 1000):
+    """
+    This function preprocess a whole column of texts, returning for each text the same
+    words of preprocess(). The missing values (e.g. NaN) are treated as empty strings.
+    With n_jobs > 1 the texts are split in chunks processed in parallel by a pool of processes
+    Args:
+        texts (iterable): The texts (e.g. the 'description' column of the dataset)
+        n_jobs (int): The number of processes (None to use all the cores)
+        chunksize (int): The number of texts processed together by a process
+    Returns:
+        The lists of words, as a pd.Series with the same index if texts is a pd.Series,
+        otherwise as a list
+    """
+    import pandas as pd
+
+    index = texts.index if isinstance(texts, pd.Series) else None
+    texts = [text if isinstance(text, str) else '' for text in texts]
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+
+    if n_jobs <= 1 or len(texts) <= chunksize:
+        result = preprocess_chunk(texts)
+    else:
+        chunks = [texts[i:i + chunksize] for i in range(0, len(texts), chunksize)]
+        with ProcessPoolExecutor(max_workers = n_jobs) as executor:
+            result = [words for chunk in executor.map(preprocess_chunk, chunks) for words in chunk]
+
+    if index is not None:
+        return pd.Series(result, index = index, dtype = object)
+    return result
+
+
+def preprocess_chunk(texts: list) -> list:
+    """
+    This function preprocess a list of texts in the current process
+    Args:
+        texts (list): The texts
+    Returns:
+        list: The lists of words
+    """
+    return [preprocess(text) for text in texts]
+
+@functools.lru_cache(maxsize = 4096)
+def analyze_query(query: str) -> tuple:
+    """
+    This function preprocess the text of the query (see preprocess()), remembering the
+    result for the most recent queries, so that popular queries are analyzed only once
+    Args:
+        query (str): The text of the query
+    Returns:
+        tuple: The words after the preprocessing
+    """
+    return tuple(preprocess(query))
+
+
+def index_generation() -> tuple:
+    """
+    This function returns the generation of the index, i.e. the signature of its files.
+    It changes every time the index is rebuilt, so it is used in the keys of the result cache
+    Returns:
+        tuple: The generation of the index
+    """
+    return (file_cache.file_signature(path_vocabulary), file_cache.file_signature(path_inverted_index))
+
+
 # First version of the search engine
-def search(query: str) -> pd.DataFrame:
+def search(query: str, filters: dict = None) -> pd.DataFrame:
     """
     First version of the search engine
     This function returns the list of the documents that contains 
     all the list of words in the query with the AND logic
+    If filters are given only the documents with the selected values of the facets are returned
+    (see the facets module)
+    The results of the most recent queries are kept in the result_cache
     Args:
         query (str): The query
+        filters (dict): The accepted value (or list of values) of each facet, or the range of the fees
+            and of the duration, or an area, e.g. {'country': 'Italy', 'feesEUR': '<= 10000 €', 'near': (45.46, 9.19, 50)}
+            (see facets.filter_bitmap())
     Returns:
         pd.DataFrame: The dataframe with the results
     """
+    df = get_dataset()
+    if df is None:
+        return None
+
+    # Preprocessing the query
+    words = analyze_query(query)
+
+    key = (words, None, index_generation())
+    if filters:
+        key += (facets.filter_key(filters), facets.generation())
+    found, positions = result_cache.get(key)
+    if not found:
+        document_ids = get_document_ids(words)
+        if document_ids is None:
+            return None
+        if filters:
+            document_ids = facets.filter_ids(filters, document_ids)
+            if document_ids is None:
+                print("Facet index has not been computed yet")
+                return None
+        positions = get_positions(document_ids)
+        result_cache.put(key, positions)
+
+    # Returning the documents that match the query
+    return df.iloc[positions]
+
+
+def phrase_search(query: str, slop: int = 0) -> pd.DataFrame:
+    """
+    This function returns the documents that contains the words of the query as a phrase,
+    i.e. in the same order and adjacent (ignoring the stopwords). With slop > 0 it becomes
+    a proximity query: between two consecutive words of the query there can be at most
+    slop other words. The check uses the positional index, so the descriptions are not
+    tokenized again (see create_inverted_index() with positional = True)
+    Args:
+        query (str): The query
+        slop (int): The maximum number of words allowed between two consecutive words of the query
+    Returns:
+        pd.DataFrame: The dataframe with the results (None if the positional index does not exists)
+    """
+    df = get_dataset()
+    if df is None:
+        return None
+
+    words = analyze_query(query)
+
+    key = (words, ('phrase', slop), index_generation() + (file_cache.file_signature(path_positional_index),))
+    found, positions = result_cache.get(key)
+    if not found:
+        document_ids = get_phrase_document_ids(words, slop)
+        if document_ids is None:
+            return None
+        positions = get_positions(document_ids)
+        result_cache.put(key, positions)
+
+    return df.iloc[positions]
+
+
+def get_phrase_document_ids(words: list, slop: int = 0) -> list:
+    """
+    This function returns the sorted ids of the documents that contains the (preprocessed)
+    words as a phrase, with at most slop words between two consecutive words
+    Args:
+        words (list): The preprocessed words of the query
+        slop (int): The maximum number of words allowed between two consecutive words
+    Returns:
+        list: The sorted ids of the documents (None if the positional index does not exists)
+    """
+    vocabulary = get_vocabulary()
+    positional_index = get_positional_index()
+    if vocabulary is None or positional_index is None:
+        return None
+
+    if len(words) == 0:
+        return []
+
+    term_ids = [vocabulary.get(word.lower(), None) for word in words]
+    # If a word is not in the vocabulary no document can contain the phrase
+    if any(term_id is None or term_id not in positional_index for term_id in term_ids):
+        return []
+
+    # The candidates are the documents that contain all the words
+    candidates = get_document_ids(words)
+
+    return [doc_id for doc_id in candidates
+            if contains_phrase([positional_index[term_id][doc_id] for term_id in term_ids], slop)]
+
+
+def contains_phrase(lst_positions: list, slop: int = 0) -> bool:
+    """
+    This function checks if there is an occurrence of the phrase in a document, given
+    the sorted positions of each word of the phrase in the document.
+    For each position of the first word, it looks for the first following position
+    of the next word, and it checks that it is not too far
+    Args:
+        lst_positions (list): The sorted positions of each word of the phrase
+        slop (int): The maximum number of words allowed between two consecutive words
+    Returns:
+        bool: True if the phrase is in the document
+    """
+    for start in lst_positions[0]:
+        previous = start
+        for positions in lst_positions[1:]:
+            i = bisect_right(positions, previous)
+            if i == len(positions) or positions[i] > previous + 1 + slop:
+                break
+            previous = positions[i]
+        else:
+            return True
+
+    return False
+
+
+def get_document_ids(words: list) -> list:
+    """
+    This function returns the sorted ids of the documents that contains
+    all the words (already preprocessed) with the AND logic.
+    The words that are not in the vocabulary are ignored
+    Args:
+        words (list): The preprocessed words of the query
+    Returns:
+        list: The sorted ids of the documents, as an array of integers
+            (None if the index does not exists)
+    """
     vocabulary = get_vocabulary()
     if vocabulary is None:
         return None
-    
+
     inverted_index = get_inverted_index()
     if inverted_index is None:
         return None
-    
-    # Preprocessing the query
-    words = preprocess(query)
-    
-    # We use a set because it's easy to apply the AND logic
-    # because it correspond to the intersection of the sets
-    document_ids = {}
-    
-    # We also use a boolean variable, because we do not need
-    # to do any intersection operation if we are querying the first word
-    # of the list
-    is_first_word = True
-    
+
+    lst_postings = []
     for word in words:
         # For each word in the query we get the term_id
-        term_id = get_term_id(word.lower())
+        term_id = vocabulary.get(word.lower(), None)
         if term_id is not None:
-            # Then we get the list of the course indexes that contains the term_id
+            # Then we get the sorted list of the course indexes that contains the term_id
+            # If it is None it means that the word is not in the index, so we pass to the next word
             tmp_ids = inverted_index.get(term_id, None)
-            
-            # If the tmp_ids is None it means that the word is not in the vocabulary
-            # so we can pass to the next word
-            
-            if is_first_word and tmp_ids is not None:
-                # If it's the first word we just add the list of the course indexes
-                # to the set
-                document_ids = set(tmp_ids)
-                is_first_word = False
-                
-            elif not is_first_word and tmp_ids is not None:
-                # If it's not the first word we do the intersection between the queries
-                # results. If the intersection is empty then also the final result will be
-                # empty, so we can stop the computation and return an empty list
-                document_ids = document_ids.intersection(set(tmp_ids))
-                
-    # Returning the documents that match the query
-    global df_original
-    return df_original[df_original.index.isin(document_ids)]
\ No newline at end of file
+            if tmp_ids is not None:
+                lst_postings.append(tmp_ids)
+
+    # The AND logic corresponds to the intersection of the posting lists.
+    # They are intersected from the shortest to the longest, stopping as soon as
+    # the intermediate result is empty
+    return postings.intersect_all(lst_postings)
+
+
+def get_positions(document_ids) -> list:
+    """
+    This function converts the ids of the documents into their positions (row numbers)
+    in the dataset, so that the results can be selected without scanning the whole dataframe
+    Args:
+        document_ids (list): The ids of the documents
+    Returns:
+        list: The sorted positions of the documents in the dataset (None if the dataset has not been loaded yet)
+    """
+    df = get_dataset()
+    if df is None:
+        return None
+    positions = df.index.get_indexer(list(document_ids))
+    return sorted(position for position in positions if position >= 0)
@@ -1,99 +1,187 @@
-import pandas as pd
-import numpy as np
+from __future__ import annotations
+
 import json
-import heapq
-from sklearn.feature_extraction.text import TfidfVectorizer
 
 # Import the previous engine
 from . import engine_v1
+from . import index_store
+from . import sparse_matrix
+from . import scoring
+from . import postings_file
+from . import token_store
+from . import boolean_query
+from . import facets
+from .query_cache import QueryCache
+
+# pandas, numpy and scikit-learn are imported only inside the functions that use them,
+# so that importing this module is fast
+df_original = None
+
+# Cache of the results of the queries (see the query_cache module)
+result_cache = QueryCache()
+
+# Each build saves the files of the engine in a new version directory, published only
+# when all the files are ready (see the index_store module). These are the names of the files
+# inside the version directory, each engine has its own directories
+engine_name = 'v3'
+path_courses_matrix_new_score = "courses_matrix_new_score.npz"
+path_postings_new_score = 'inverted_index_new_score.bin'
+path_max_impacts_new_score = 'max_impacts_new_score.json'
+path_vocabulary = 'vocabulary.json'
+path_norms = 'norms.csv'
+
+# The parameters of the BM25F score (see compute_score()): the weight of each field,
+# the strength of the length normalization of each field and the saturation of the frequencies
+field_weights = {'courseName': 3.0, 'universityName': 1.5, 'facultyName': 1.0, 'description': 1.0}
+field_b = {'courseName': 0.3, 'universityName': 0.0, 'facultyName': 0.3, 'description': 0.75}
+k1 = 1.2
 
-df_original = pd.DataFrame()
 
-path_courses_matrix_new_score = "data/courses_matrix_new_score.csv"
-path_inverted_index_new_score = 'data/inverted_index_new_score.json'
-path_norms = 'data/norms.csv'
+def analyze_fields(df: pd.DataFrame) -> dict:
+    """
+    This function returns the preprocessed words of each field of the BM25F score for each document.
+    The description has already been preprocessed by the engine_v1 module, the other fields
+    are analyzed through the token store, so they are preprocessed only once
+    Args:
+        df (pd.DataFrame): The documents (with the 'prep_description' column)
+    Returns:
+        dict: {field: array with the list of the words of each document}
+    """
+    return {field: df['prep_description'].values if field == 'description' else token_store.analyze(df[field], field).values
+            for field in field_weights}
 
 
-def compute_score() -> pd.DataFrame:
+def create_vocabulary(fields_words: dict) -> dict:
     """
-    Computes the score for each word in the in each document (i.e. course),
-    with the formula 
-        Score = TF_{courseName} + (1 + log(TF_{description})) * IDF_{description}
-    Return the correspondent dataframe
+    This function creates the vocabulary of the index from the words of all the fields of the
+    BM25F score (not only the description as the vocabulary of the engine_v1 module), so the words
+    that appear only in the names of the courses, universities or faculties can be searched.
+    As in the engine_v1 module the words are sorted and numbered from 0
+    Args:
+        fields_words (dict): The words of each field of each document (see analyze_fields())
     Returns:
-        new_score: The score dataframe
+        dict: The vocabulary
     """
-    # First of all we get the vocabulary using the engine_v1 module
-    vocabulary = engine_v1.get_vocabulary()
+    lst_words = sorted({word.lower() for lst_words in fields_words.values() for words in lst_words for word in words})
+    return {word: i for i, word in enumerate(lst_words)}
+
+
+def compute_score(version: str, fields_words: dict = None):
+    """
+    Computes the BM25F score of each word in each document (i.e. course), combining the fields
+    courseName, universityName, facultyName and description. The frequencies of a word in the
+    fields are normalized by the length of the field and summed with the weight of the field:
+        TF = sum_{field} weight_{field} * TF_{field} / (1 - b_{field} + b_{field} * length_{field} / average length_{field})
+    and then saturated:
+        Score = TF * (k1 + 1) / (TF + k1)
+    The IDF is applied to the words of the query (see scoring.query_weights()), so the
+    cosine similarity with documents of norm 1 ranks the documents by their BM25F score.
+    All the (document, word) pairs of all the fields are collected in a single pass over the
+    analyzed words and summed into one sparse matrix, without building a matrix for each field.
+    The matrix is saved, together with the ids of the documents, in the file courses_matrix_new_score.npz
+    Args:
+        version (str): The version directory where the files are saved (see the index_store module)
+        fields_words (dict): The words of each field of each document (if None, see analyze_fields())
+    Returns:
+        new_score: The sparse documents x vocabulary score matrix (CSR format)
+    """
+    import numpy as np
+    from scipy.sparse import coo_matrix
+
+    # The vocabulary of all the fields, saved with the version
+    vocabulary = get_vocabulary(version)
     if vocabulary is None:
         return None
     
     # Load the dataset
     global df_original
     df = df_original
+    if fields_words is None:
+        fields_words = analyze_fields(df)
     
-    # Create a Scikit-learn TfidfVectorizer object
-    # With the Sublinear option we apply the formula 1 + log(tf) instead of tf
-    # In this way we penalise the words that appear a lot of times in a document
-    tfidf_vec = TfidfVectorizer(input='content', lowercase = False, tokenizer = lambda text: text, vocabulary = vocabulary, sublinear_tf = True)
-    
-    # Transforming the 'prep_description' column into a log-tf-idf matrix
-    # and converting it into a dataframe
-    results = tfidf_vec.fit_transform(df['prep_description'])
-    result_dense = results.todense()
-    tf_idf = pd.DataFrame(result_dense.tolist(), index = df.index, columns=list(vocabulary.keys()).sort())
-    
-    # Then compute the tf of the 'courseName' column
-    tfidf_vec2 = TfidfVectorizer(input='content', lowercase = False, tokenizer = lambda text: text, vocabulary = vocabulary, use_idf = False)
-    results2 = tfidf_vec2.fit_transform(df['courseName'].apply(engine_v1.preprocess))
-    result_dense2 = results2.todense()
-    tf_idf2 = pd.DataFrame(result_dense2.tolist(), index = df.index, columns=list(vocabulary.keys()).sort())
-        
-    # Sum the score of the 'courseName' and the score of the 'description'
-    new_score = tf_idf + tf_idf2    
-    
+    lst_rows, lst_columns, lst_values = [], [], []
+    for field, weight in field_weights.items():
+        lst_words = fields_words[field]
+
+        # The length normalization of the field in each document
+        lengths = np.array([len(words) for words in lst_words], dtype = np.float64)
+        average_length = lengths.mean() if len(lengths) > 0 and lengths.mean() > 0 else 1.0
+        normalization = 1 - field_b[field] + field_b[field] * lengths / average_length
+
+        # One element for each occurrence of a word, the duplicates are summed below
+        term_ids = [[vocabulary[word] for word in map(str.lower, words)] for words in lst_words]
+        counts = np.array([len(ids) for ids in term_ids], dtype = np.int64)
+        rows = np.repeat(np.arange(len(df)), counts)
+        lst_rows.append(rows)
+        lst_columns.append(np.fromiter((term_id for ids in term_ids for term_id in ids), dtype = np.int64, count = int(counts.sum())))
+        lst_values.append(weight / normalization[rows])
+
+    # The conversion to CSR sums the occurrences of the same word in the same document (over all the fields)
+    new_score = coo_matrix((np.concatenate(lst_values), (np.concatenate(lst_rows), np.concatenate(lst_columns))),
+                           shape = (len(df), len(vocabulary))).tocsr()
+    new_score.data = new_score.data * (k1 + 1) / (new_score.data + k1)
         
-    # Save the score dataframe in the file courses_matrix_new_score.csv
-    with open(path_courses_matrix_new_score, "w") as f:
-        new_score.to_csv(f)
+    # Save the score matrix in the file courses_matrix_new_score.npz
+    sparse_matrix.save(index_store.path(engine_name, path_courses_matrix_new_score, version), new_score, df.index)
         
-    # Here we compute the l2 norms for each document
-    new_score['norm'] = np.linalg.norm(new_score.values, axis = 1)
-         
-    # We also save in the file norms.csv the norm of each document
-    with open(path_norms, "w") as f:
-        new_score['norm'].to_csv(f)
+    # The length of the documents is already normalized by the score, so all the norms are 1
+    sparse_matrix.save_norms(index_store.path(engine_name, path_norms, version), document_norms(new_score), df.index)
     
     return new_score
 
 
-def get_score() -> pd.DataFrame:
+def document_norms(new_score):
+    """
+    This function returns the norms of the documents used by the cosine similarity.
+    They are all 1, so the similarity is the BM25F score divided by the norm of the query
+    Args:
+        new_score (scipy.sparse matrix): The documents x vocabulary score matrix
+    Returns:
+        np.ndarray: The norm of each document (row)
+    """
+    import numpy as np
+
+    return np.ones(new_score.shape[0])
+
+
+def scoring_config() -> dict:
+    """
+    This function returns the parameters of the score, saved in the manifest of each version
+    Returns:
+        dict: The parameters of the BM25F score
     """
-    This function loads the score dataframe from the courses_matrix_new_score.csv file
+    return {'model': 'bm25f', 'k1': k1, 'field_weights': dict(field_weights), 'field_b': dict(field_b)}
+
+
+def get_score(version: str = None) -> tuple:
+    """
+    This function loads the sparse score matrix from the courses_matrix_new_score.npz file
+    The file is read only the first time (or when it changes on disk)
     Args:
-        df (pd.DataFrame): The dataframe containing the columns 'index' and 'description'
+        version (str): The version (if None, the version in use)
     Returns:
-        df_score: The score dataframe
+        tuple: The score matrix (CSR format) and the ids of the documents of its rows
     """
     try:
-        with open(path_courses_matrix_new_score, "r") as f:
-            df_score = pd.read_csv(f, index_col = 'index')
-        return df_score
+        return index_store.load(engine_name, path_courses_matrix_new_score, sparse_matrix.load, version, mode = "rb")
     except Exception as e:
         print("Tf-Idf index has not been computed yet")
         return None
 
 
-def get_norms() -> pd.DataFrame:
+def get_norms(version: str = None) -> pd.DataFrame:
     """
     This function loads the norms dataframe from the norms.csv file
+    The file is read only the first time (or when it changes on disk)
+    Args:
+        version (str): The version (if None, the version in use)
     Returns:
         norms: The norms dataframe
     """
+    import pandas as pd
+
     try:
-        with open(path_norms, "r") as f:
-            norms = pd.read_csv(f, index_col = 'index')
-        return norms
+        return index_store.load(engine_name, path_norms, lambda f: pd.read_csv(f, index_col = 'index'), version)
     except Exception as e:
         print("Norms have not been computed yet")
         return None
@@ -108,164 +196,373 @@ def create_inverted_index(df: pd.DataFrame) -> dict:
       term_id_2:[(document2, score_{term,document1}), (document6, score_{term,document6}), ...],
         ...
     }
-    The dictionary is also saved in the file inverted_index_new_score.json for a faster access to it.
+    The index is saved in the compact binary postings file inverted_index_new_score.bin (see the postings_file module).
     Args:
         df (pd.DataFrame): The document dataframe
     Returns:
         dict: The inverted score index
     """
-    
-    # Saving the original dataframe
+    # Saving the original dataframe, with the preprocessed description (see engine_v1.prepare_dataset())
     global df_original
-    df_original = df.copy()
-
-    inverted_index = {}
+    df_original = engine_v1.prepare_dataset(df)
     
-    # Since we use the engine_v1 module we must start the Search Engine (v1)
-    vocabulary = engine_v1.create_vocabulary(df)
-    
-    # Import the vocabulary
-    vocabulary = engine_v1.get_vocabulary()
-    if vocabulary is None:
-        return None
-    
-    # First of all get the tf-idf index score 
-    df_score = compute_score()
-
-    # Then we compute the inverted index
-    for word, term_id in vocabulary.items():
-                
-        # Retrive the list of tuples where tf_idf > 0
-        # to_records() is a pandas function that returns a list of tuples from a dataframe
-        # tuple_list = pd.DataFrame(tf_idf[tf_idf[word] > 0][word]).to_records(index = True).tolist()
-        tuple_list = pd.DataFrame(df_score[df_score[term_id] > 0][term_id]).to_records(index = True).tolist()
-        
-        # We add the list of tuples to the inverted index dictionary
-        inverted_index[term_id] = tuple_list    
+    # The vocabulary of the columns of the matrix contains the words of all the fields of the score.
+    # It is saved with the version, so the queries keep using it even if the documents change
+    fields_words = analyze_fields(df_original)
+    vocabulary = create_vocabulary(fields_words)
+
+    # All the files are saved in a new version directory
+    version = index_store.create_version(engine_name)
+    with open(index_store.path(engine_name, path_vocabulary, version), "w") as f:
+        json.dump(vocabulary, f)
+
+    # First of all get the sparse score matrix
+    new_score = compute_score(version, fields_words)
+
+    # Then we compute the inverted index, reading the posting list of each word
+    # directly from the columns of the sparse matrix
+    inverted_index = sparse_matrix.inverted_index(new_score, df_original.index, vocabulary)
+
+    # Together with the posting lists we save the maximum impact of each word,
+    # used to skip the documents in the ranked OR queries
+    # The bounds must hold both for the exact weights and for the quantized ones of the postings file
+    norms = document_norms(new_score)
+    max_impacts = sparse_matrix.max_impacts(new_score, norms, vocabulary)
+    max_impacts_quantized = sparse_matrix.max_impacts(postings_file.dequantized(new_score), norms, vocabulary)
+    max_impacts = {term_id: max(value, max_impacts_quantized[term_id]) for term_id, value in max_impacts.items()}
+    with open(index_store.path(engine_name, path_max_impacts_new_score, version), "w") as f:
+        json.dump(max_impacts, f)
         
-    # Finally we save the inverted index dictionary in the file inverted_index_new_score.json
-    with open(path_inverted_index_new_score, "w") as f:
-        json.dump(inverted_index, f)
+    # Finally we save the inverted index in the compact binary format read by get_inverted_index()
+    # (see the postings_file module)
+    postings_file.write(index_store.path(engine_name, path_postings_new_score, version), scoring.to_arrays(inverted_index))
+
+    # Finally the new version replaces the one in use (atomically)
+    index_store.publish(engine_name, version, len(df_original), scoring_config())
+    # The results computed with the previous index are no more valid
+    result_cache.clear()
         
     return inverted_index
 
 
-def get_inverted_index() -> dict:
+def get_vocabulary(version: str = None) -> dict:
+    """
+    This function loads the vocabulary used to build a version of the index,
+    i.e. the mapping from the words to the columns of the matrix
+    Args:
+        version (str): The version (if None, the version in use)
+    Returns:
+        dict: The vocabulary (None if the index has not been computed yet)
+    """
+    try:
+        return index_store.load(engine_name, path_vocabulary, json.load, version)
+    except Exception as e:
+        return None
+
+
+def get_inverted_index(version: str = None) -> dict:
     """
-    This function loads the inverted index from the inverted_index_new_score.json file
+    This function loads the inverted index from the binary postings file inverted_index_new_score.bin,
+    which is memory mapped: each posting list is decoded only when a query uses it, as a pair
+    of numpy arrays (document ids, scores) sorted by document id (see the postings_file module)
+    The file is read only the first time
     If the inverted index file does not exists it returns None
+    Args:
+        version (str): The version (if None, the version in use)
     Returns:
         dict: The inverted index
     """
     try:
-        with open(path_inverted_index_new_score, "r") as f:
-            inverted_index = json.load(f)
-            
-        # Converting the keys from string to int, since we have to use them as integers
-        inverted_index = {int(key): value for key, value in inverted_index.items()}
-        return inverted_index
+        return index_store.load(engine_name, path_postings_new_score, postings_file.load, version, mode = "rb")
     except Exception as e:
         return None
 
 
+def get_document_ids(words: list, version: str = None) -> list:
+    """
+    This function returns the sorted ids of the documents that contain all the words
+    (already preprocessed) with the AND logic, in any of the fields of the score.
+    The posting lists are the ones of this index (not the ones of the description of the engine_v1 module),
+    since a document has a score for a word if and only if one of its fields contains the word.
+    The words that are not in the vocabulary are ignored
+    Args:
+        words (list): The preprocessed words of the query
+        version (str): The version (if None, the version in use)
+    Returns:
+        np.ndarray: The sorted ids of the documents (None if the index does not exists)
+    """
+    import numpy as np
+
+    vocabulary = get_vocabulary(version)
+    inverted_index = get_inverted_index(version)
+    if vocabulary is None or inverted_index is None:
+        return None
+
+    term_ids = {vocabulary[word.lower()] for word in words if word.lower() in vocabulary}
+    # The posting lists are intersected from the shortest to the longest
+    lst_postings = sorted((inverted_index[term_id][0] for term_id in term_ids), key = len)
+    if len(lst_postings) == 0:
+        return np.zeros(0, dtype = np.int64)
+    result = np.asarray(lst_postings[0], dtype = np.int64)
+    for doc_ids in lst_postings[1:]:
+        if len(result) == 0:
+            break
+        result = np.intersect1d(result, doc_ids, assume_unique = True)
+    return result
+
+
+def get_boolean_document_ids(tree: tuple, version: str = None) -> list:
+    """
+    This function returns the sorted ids of the documents that satisfy a parsed boolean query
+    (see boolean_query.get_document_ids()), with the posting lists of all the fields of this index
+    Args:
+        tree (tuple): The tree of the query
+        version (str): The version (if None, the version in use)
+    Returns:
+        list: The sorted ids of the documents (None if the index does not exists)
+    """
+    vocabulary = get_vocabulary(version)
+    inverted_index = get_inverted_index(version)
+    norms = get_norms(version)
+    if vocabulary is None or inverted_index is None or norms is None:
+        return None
+
+    # Only the posting lists of the words of the query are decoded, and the negations
+    # without a positive condition are evaluated on the documents of the version
+    term_ids = {vocabulary[word.lower()] for word in boolean_query.words(tree) if word.lower() in vocabulary}
+    return boolean_query.get_document_ids(tree, {term_id: inverted_index[term_id][0] for term_id in term_ids}, vocabulary,
+                                          document_ids(norms))
+
+
+def document_ids(norms) -> list:
+    """
+    This function returns the sorted ids of all the documents of a version, from its norms
+    Args:
+        norms (pd.DataFrame): The norms of the version (see get_norms())
+    Returns:
+        np.ndarray: The sorted ids of the documents
+    """
+    import numpy as np
+
+    return np.sort(norms.index.to_numpy(dtype = np.int64))
+
+
 # Second version of the search engine
-def search(query: str, k: int = 10) -> list:
+def search(query: str, k: int = 10, boolean: bool = False, disjunctive: bool = False, filters: dict = None) -> list:
     """
     For each document we compute the cosine similarity with the query
-    using the score 
-        TF_{courseName} + (1 + log(TF_{description})) * IDF_{description}
-    previously evaluated. It returns a Heap with the k most similar documents and 
+    using the BM25F score over the fields courseName, universityName, facultyName
+    and description previously evaluated (see compute_score()). It returns a Heap with the k most similar documents and 
     the relative similarity score
+    The results of the most recent queries are kept in the result_cache
+    If boolean is True the query can contain the operators AND, OR, NOT and parentheses
+    (see the boolean_query module): the documents that satisfy it are ranked using
+    the words that are not negated
+    If disjunctive is True the candidates are all the documents that contain at least
+    one word of the query (ranked OR), instead of all the words, and the documents that
+    can not enter the k most similar are skipped (see scoring.max_score_top_k())
+    If filters are given only the documents with the selected values of the facets are ranked
+    (see the facets module)
     Args:  
-        words (list): The list of words in the query
+        query (str): The query
         k (int): The number of most similar documents to return
+        boolean (bool): If True the query is parsed as a boolean query
+        disjunctive (bool): If True the query is evaluated as a ranked OR (ignored for boolean queries)
+        filters (dict): The accepted value (or list of values) of each facet, or the range of the fees
+            and of the duration, or an area, e.g. {'country': 'Italy', 'feesEUR': '<= 10000 €', 'near': (45.46, 9.19, 50)}
+            (see facets.filter_bitmap())
     Returns:
         list: The list of the k most similar documents and the relative similarity score
     """
     
-    # Preprocess the query
-    words = engine_v1.preprocess(query)
-    
-    # Get only the documents that contain all the words in the query
-    # recycling the code from the search function of the engine_v1 module
-    df_result = engine_v1.search(query)
-    
-    # Read the inverted index from the file inverted_index_new_score.json
-    inverted_index = get_inverted_index() 
-    if inverted_index is None:
+    # All the files of the query are read from the same version, even if a new one is published meanwhile
+    version = index_store.current_version(engine_name)
+
+    if boolean:
+        # The parsed query is used in the key, so equivalent queries share the same result
+        tree = boolean_query.parse(query)
+        key = (tree, k, index_generation(version))
+    else:
+        # Preprocess the query
+        words = engine_v1.analyze_query(query)
+        key = (words, (k, 'or' if disjunctive else 'and'), index_generation(version))
+    if filters:
+        key += (facets.filter_key(filters), facets.generation())
+
+    found, heap = result_cache.get(key)
+    if not found:
+        if boolean:
+            document_ids = get_boolean_document_ids(tree, version)
+            heap = rank(boolean_query.positive_words(tree), k, document_ids, version = version, filters = filters) if document_ids is not None else None
+        else:
+            heap = rank(list(words), k, disjunctive = disjunctive, version = version, filters = filters)
+        if heap is None:
+            return None
+        result_cache.put(key, heap)
+
+    # Returning a copy of the heap, since the caller can pop its elements
+    return list(heap)
+
+
+def search_many(queries: list, k: int = 10, disjunctive: bool = False, n_jobs: int = 1, block_size: int = 256) -> list:
+    """
+    This function runs a batch of queries, returning for each one the same heap of search().
+    The index is loaded once, all the queries are preprocessed together and then scored
+    together against the score matrix with sparse matrix products (see scoring.batch_top_k()),
+    (with the same quantized weights of the postings file read by search()),
+    which is much faster than calling search() for each query
+    Args:
+        queries (list): The queries
+        k (int): The number of most similar documents to return for each query
+        disjunctive (bool): If True the queries are evaluated as ranked OR, otherwise
+            only the documents that contain all the words of the query are ranked
+        n_jobs (int): The number of processes used to preprocess the queries and
+            of threads used to score them (None to use all the cores)
+        block_size (int): The number of queries scored together
+    Returns:
+        list: For each query the list of the k most similar documents and the relative similarity score
+            (None for the queries without words in the vocabulary), or None if the index does not exists
+    """
+    # The documents found are read from the dataset, loaded by create_inverted_index()
+    global df_original
+    if df_original is None:
         print("Inverted index has not been computed yet")
         return None
-    
-    # Read the l2 norms of the cdocuments from the file norms.csv
-    norms = get_norms()
+
+    version = index_store.current_version(engine_name)
+    vocabulary = get_vocabulary(version)
+    inverted_index = get_inverted_index(version)
+    loaded = get_score(version)
+    if vocabulary is None or inverted_index is None or loaded is None:
+        print("Inverted index has not been computed yet")
+        return None
+    matrix, doc_ids = loaded
+    # The weights of the postings file used by search() are quantized (see the postings_file module),
+    # so the matrix is scored with the same quantized weights, to rank the documents in the same way
+    matrix = postings_file.scoring_matrix(matrix, inverted_index)
+
+    # The AND logic needs the documents that contain each word, i.e. the ones with a score for the word
+    incidence = None
+    if not disjunctive:
+        incidence = matrix.copy()
+        incidence.data[:] = 1
+
+    # Preprocess all the queries and build the queries x vocabulary matrix
+    lst_words = engine_v1.preprocess_batch(list(queries), n_jobs = n_jobs)
+    query_matrix = scoring.query_matrix(lst_words, inverted_index, matrix.shape[1], matrix.shape[0], vocabulary)
+
+    # The documents are divided by the norms saved with the version, as in rank()
+    norms = get_norms(version)
     if norms is None:
-        print("Norms have not been computed yet")
         return None
-    
+    lst_results = scoring.batch_top_k(query_matrix, matrix, doc_ids, k, incidence, block_size, n_jobs,
+                                      scoring.lookup_norms(norms, doc_ids))
+
+    # Finally we retrieve only the rows of the k most similar documents of each query
+    return scoring.build_heaps(df_original, lst_results)
+
+
+def get_max_impacts(version: str = None) -> dict:
+    """
+    This function loads the maximum impact of each word from the max_impacts_new_score.json file
+    The file is read only the first time (or when it changes on disk)
+    If the file does not exists it returns None
+    Args:
+        version (str): The version (if None, the version in use)
+    Returns:
+        dict: The maximum impact (score / norm of the document) of each term_id
+    """
+    try:
+        return index_store.load(engine_name, path_max_impacts_new_score, scoring.load_max_impacts, version)
+    except Exception as e:
+        return None
+
+
+def index_generation(version: str = None) -> tuple:
+    """
+    This function returns the generation of the index, i.e. its version (all the files
+    used by the queries are in the version directory).
+    It changes every time the index is rebuilt, so it is used in the keys of the result cache
+    Args:
+        version (str): The version (if None, the version in use)
+    Returns:
+        tuple: The generation of the index
+    """
+    if version is None:
+        version = index_store.current_version(engine_name)
+    return (engine_name, version)
+
+
+def rank(words: list, k: int = 10, document_ids: list = None, disjunctive: bool = False, version: str = None, filters: dict = None) -> list:
+    """
+    This function computes the cosine similarity between the (preprocessed) query
+    and the candidate documents, and returns the heap of the k most similar
+    Args:
+        words (list): The list of preprocessed words in the query
+        k (int): The number of most similar documents to return
+        document_ids (list): The ids of the candidate documents
+            (if None, the documents that contain all the words of the query)
+        disjunctive (bool): If True (and document_ids is None) the candidates are the documents
+            that contain at least one word of the query, evaluated with the MaxScore pruning
+        version (str): The version of the index (if None, the version in use)
+        filters (dict): The accepted values of the facets of the candidate documents (see facets.filter_bitmap())
+    Returns:
+        list: The list of the k most similar documents and the relative similarity score
+    """
+    # The documents found are read from the dataset, loaded by create_inverted_index()
     global df_original
+    if df_original is None:
+        print("Inverted index has not been computed yet")
+        return None
+
+    if version is None:
+        version = index_store.current_version(engine_name)
+
+    if document_ids is None and not disjunctive:
+        # Get only the ids of the documents that contain all the words in the query, in any field
+        document_ids = get_document_ids(words, version)
+        if document_ids is None:
+            print("Inverted index has not been computed yet")
+            return None
+
+    if filters:
+        # Only the candidates with the selected values of the facets are kept, intersecting the bitmaps.
+        # For the ranked OR the candidates become all the filtered documents: the ones
+        # without any word of the query have similarity 0 and are discarded by the scoring
+        document_ids = facets.filter_ids(filters, document_ids)
+        if document_ids is None:
+            print("Facet index has not been computed yet")
+            return None
     
-    # Find the term_id for every word in the query
-    query_words_ids = [(engine_v1.get_term_id(word.lower()), word) for word in words if engine_v1.get_term_id(word.lower()) is not None]
-    
-    # Update the preprocessed query to drop the None values i.e. words not in the vocabulary
-    words = [tupl[1] for tupl in query_words_ids]
-    # Converting the list of tuples to a list of only the tmer_id integers
-    query_words_ids = [tupl[0] for tupl in query_words_ids]
+    # Read the inverted index (the file is read only the first time)
+    inverted_index = get_inverted_index(version)
+    vocabulary = get_vocabulary(version)
+    if inverted_index is None or vocabulary is None:
+        print("Inverted index has not been computed yet")
+        return None
     
-    # From the term_id access the inverted_index and find the list of tuples (doc_id, score)
-    # for each word in the query      
-    # We only consider the documents that are in the df_result dataframe, which means that
-    # they contain all the words in the query
-    query_inverted_indexes = {int(word_id): inverted_index[int(word_id)] for word_id in query_words_ids}
-    tmp_dict = {}
-    for key, value_list in query_inverted_indexes.items():
-        tmp_lst = [item for item in value_list if item[0] in df_result.index]
-        tmp_dict[key] = tmp_lst
-    query_inverted_indexes = tmp_dict
+    # Read the l2 norms of the documents
+    norms = get_norms(version)
+    if norms is None:
+        print("Norms have not been computed yet")
+        return None
     
+    # Compute the cosine similarity only for the candidate documents, with vectorized
+    # operations on the posting lists of the words of the query, and select the k best ones
+    if document_ids is None:
+        # Ranked OR: the upper bounds of the scores are used to skip the documents
+        max_impacts = get_max_impacts(version)
+        if max_impacts is None:
+            print("Maximum impacts have not been computed yet")
+            return None
+        results = scoring.max_score_top_k(words, inverted_index, norms, max_impacts, k, vocabulary)
+    else:
+        results = scoring.cosine_top_k(words, inverted_index, norms, k, document_ids, vocabulary)
+
     # If none of the words in the query are in the vocabulary return None
-    # otherwise at least one word is in the vocabulary
-    if len(query_inverted_indexes) == 0:
+    if results is None:
         return None
     
-    # Now we create a dataframe containing only the documents with id in the query_inverted_indexes list
-    # and the columns are the words in the query
-    df_tmp = pd.DataFrame(0, columns = [engine_v1.get_word_from_id(word_id) for word_id in query_words_ids], index = [lst[0] for lst in query_inverted_indexes[query_words_ids[0]]])
-    for word_id, lst_tuple in query_inverted_indexes.items():
-        for lst in lst_tuple:
-            df_tmp.loc[lst[0], engine_v1.get_word_from_id(word_id)] = lst[1]    
-    # Fill nan's with 0
-    df_tmp.fillna(0, inplace = True)
-    
-    # Evaluate the query tf-idf score 'manually' without using the function tfidf_vectorizer.transform() of sklearn
-    doc_frequencies = [(df_tmp[engine_v1.get_word_from_id(word_id)] != 0).sum() for word_id in query_words_ids]
-    N = df_original.shape[0]
-    # The 1s are added to avoid division by 0
-    query_tf_idf = [1+np.log((N+1) / (1+doc_freq)) for doc_freq in doc_frequencies]
-    query_norm = np.linalg.norm(query_tf_idf)
-            
-    # Retrive the norm of each document from the norms.csv file
-    df_tmp['norm'] = norms.loc[df_tmp.index]
-        
-    # Evaluate the cosine similarity between the query and each document
-    # and save it in the column 'Similarity'
-    df_tmp['Similarity'] = df_tmp.apply(lambda row: np.dot(row[words], query_tf_idf) / (row['norm'] * query_norm), axis = 1)
-        
-    # Retriving the the k most similar documents from the original dataframe
-    # and sorting them using the nlargest() function of the pandas library
-    df_results = df_original.copy()
-    df_results['Similarity'] = df_tmp['Similarity']
-    df_results['Similarity'].fillna(0, inplace = True)
-    df_results = df_results[df_results['Similarity'] > 0]
-    df_results = df_results.nlargest(k, 'Similarity')
-        
-    # Finally we create a heap structure to store the k most similary documents
-    # to the query and we return its
-    heap = []
-    for id, row in df_results.iterrows():
-        # Adding the element to the heap
-        # Since we have a min heap we need to add the negative similarity score
-        # to get the max heap
-        heapq.heappush(heap, (-float(row['Similarity']), [id] + row.values.tolist()))
-    
-    return heap
\ No newline at end of file
+    # Finally we retrieve only the rows of the k most similar documents
+    # and we create a heap structure to store them
+    return scoring.build_heap(df_original, results)
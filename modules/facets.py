@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import os
+import json
+import zlib
+import base64
+
+from . import file_cache
+from . import range_index
+from . import spatial_index
+
+# Facet index of the categorical columns of the dataset (the ones extracted by the extract_msc_page module).
+# For each value of each facet it stores the bitmap of the documents with that value: a Python
+# integer where the bit i is set if the document with id i has the value. The filters are
+# evaluated with the operators & (AND) and | (OR) on the integers, and the facet counts are the
+# number of bits set in the intersection with the result set, so the document table is never scanned.
+# On disk each bitmap is compressed with zlib (the bitmaps of the rare values are mostly zeros)
+# The filters can also contain ranges of the numeric fields of the range_index module (fees and duration)
+# and areas of the spatial_index module (the courses near a point or inside a box)
+# numpy is imported only inside the functions, so that importing the module is fast
+
+path_facets = 'data/facets.json'
+
+# The columns indexed as facets
+facet_fields = ['country', 'city', 'isItFullTime', 'modality', 'administration']
+
+
+def to_bitmap(doc_ids) -> int:
+    """
+    This function converts a list of document ids into a bitmap
+    Args:
+        doc_ids (array): The ids of the documents (non negative integers)
+    Returns:
+        int: The bitmap, with the bit i set for each document id i
+    """
+    import numpy as np
+
+    doc_ids = np.asarray(doc_ids, dtype = np.int64)
+    if len(doc_ids) == 0:
+        return 0
+    bits = np.zeros(int(doc_ids.max()) + 1, dtype = np.uint8)
+    bits[doc_ids] = 1
+    return int.from_bytes(np.packbits(bits, bitorder = 'little').tobytes(), 'little')
+
+
+def to_ids(bitmap: int):
+    """
+    This function converts a bitmap into the sorted list of its document ids
+    Args:
+        bitmap (int): The bitmap
+    Returns:
+        np.ndarray: The sorted ids of the documents
+    """
+    import numpy as np
+
+    if bitmap == 0:
+        return np.zeros(0, dtype = np.int64)
+    buffer = np.frombuffer(bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little'), dtype = np.uint8)
+    return np.flatnonzero(np.unpackbits(buffer, bitorder = 'little')).astype(np.int64)
+
+
+def compress(bitmap: int) -> str:
+    """
+    This function compresses a bitmap into a string that can be saved in a json file
+    Args:
+        bitmap (int): The bitmap
+    Returns:
+        str: The bitmap compressed with zlib and encoded in base64
+    """
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    return base64.b64encode(zlib.compress(data, 9)).decode('ascii')
+
+
+def decompress(text: str) -> int:
+    """
+    This function converts back a bitmap compressed by compress()
+    Args:
+        text (str): The compressed bitmap
+    Returns:
+        int: The bitmap
+    """
+    return int.from_bytes(zlib.decompress(base64.b64decode(text)), 'little')
+
+
+def normalize(value) -> str:
+    """
+    This function returns the key of a facet value, so that the filters are not case sensitive
+    Args:
+        value: The value
+    Returns:
+        str: The key (None for the missing values)
+    """
+    if not isinstance(value, str):
+        return None
+    value = ' '.join(value.split())
+    return value.casefold() if len(value) > 0 else None
+
+
+def build(df: pd.DataFrame, fields: list = None) -> dict:
+    """
+    This function creates the facet index of the dataset and saves it in the file facets.json
+    in the format
+    {
+        'documents': compressed bitmap of all the documents,
+        'fields': {field: {value: [original value, compressed bitmap], ...}, ...}
+    }
+    The missing values are not indexed
+    Args:
+        df (pd.DataFrame): The dataset, indexed by document id
+        fields (list): The columns to index (if None, facet_fields)
+    Returns:
+        dict: The facet index, as returned by get_facets()
+    """
+    import numpy as np
+
+    if fields is None:
+        fields = [field for field in facet_fields if field in df.columns]
+
+    doc_ids = np.asarray(df.index, dtype = np.int64)
+    content = {'documents': compress(to_bitmap(doc_ids)), 'fields': {}}
+    for field in fields:
+        values = df[field].values
+        keys = [normalize(value) for value in values]
+        # Grouping the ids of the documents by value, keeping the first spelling of each value
+        groups = {}
+        for doc_id, key, value in zip(doc_ids, keys, values):
+            if key is None:
+                continue
+            if key not in groups:
+                groups[key] = (' '.join(value.split()), [])
+            groups[key][1].append(doc_id)
+        content['fields'][field] = {key: [value, compress(to_bitmap(ids))] for key, (value, ids) in groups.items()}
+
+    os.makedirs(os.path.dirname(path_facets), exist_ok = True)
+    with open(path_facets + '.tmp', "w") as f:
+        json.dump(content, f)
+    os.replace(path_facets + '.tmp', path_facets)
+
+    # Keeping the index in memory, so that it is not read again from the file
+    facets = load_facets(content)
+    file_cache.store(path_facets, facets)
+    return facets
+
+
+def load_facets(content: dict) -> dict:
+    """
+    This function decompresses the bitmaps of the content of the facets.json file
+    Args:
+        content (dict): The content of the file
+    Returns:
+        dict: The facet index
+            {'documents': bitmap, 'fields': {field: {key: (value, bitmap), ...}, ...}}
+    """
+    return {
+        'documents': decompress(content['documents']),
+        'fields': {field: {key: (value, decompress(bitmap)) for key, (value, bitmap) in values.items()}
+                   for field, values in content['fields'].items()},
+    }
+
+
+def get_facets() -> dict:
+    """
+    This function loads the facet index from the facets.json file
+    The file is read only the first time (or when it changes on disk)
+    If the file does not exists it returns None
+    Returns:
+        dict: The facet index (see load_facets())
+    """
+    try:
+        return file_cache.load(path_facets, lambda f: load_facets(json.load(f)))
+    except Exception as e:
+        return None
+
+
+def generation() -> tuple:
+    """
+    This function returns the generation of the facet index (and of the range and spatial indexes),
+    used in the keys of the result caches
+    Returns:
+        tuple: The signatures of the facets.json, range_index.npz and spatial_index.npz files
+    """
+    return (file_cache.file_signature(path_facets),) + range_index.generation() + spatial_index.generation()
+
+
+def filter_key(filters: dict) -> tuple:
+    """
+    This function returns a hashable version of the filters, used in the keys of the result caches
+    Args:
+        filters (dict): The filters (see filter_bitmap())
+    Returns:
+        tuple: The sorted pairs (field, sorted keys of the values or bounds of the range)
+    """
+    key = []
+    for field, values in sorted(filters.items()):
+        if field in range_index.range_fields:
+            key.append((field, range_index.as_range(field, values)))
+            continue
+        if field in spatial_index.spatial_fields:
+            key.append((field, spatial_index.as_area(field, values)))
+            continue
+        if isinstance(values, str):
+            values = [values]
+        key.append((field, tuple(sorted(set(normalize(value) for value in values) - {None}))))
+    return tuple(key)
+
+
+def filter_bitmap(filters: dict) -> int:
+    """
+    This function returns the bitmap of the documents that satisfy the filters:
+    the values of the same field are in OR, the different fields are in AND, e.g.
+        {'country': ['Italy', 'France'], 'isItFullTime': 'Full time', 'feesEUR': '5000-10000 €'}
+    are the full time courses in Italy or in France with fees between 5000 and 10000 EUR.
+    The ranges of the fields of the range_index module are given as text (see range_index.parse_range())
+    or as pairs (low, high), the areas of the spatial_index module as {'near': (latitude, longitude, radius_km)}
+    or {'bbox': (south, west, north, east)} (see spatial_index.as_area())
+    Args:
+        filters (dict): The accepted value (or list of values, or range) of each field
+    Returns:
+        int: The bitmap (None if the facet index has not been computed yet)
+    Raises:
+        ValueError: If a field is not in the facet index or a range is not valid
+    """
+    facets = get_facets()
+    if facets is None:
+        return None
+
+    bitmap = facets['documents']
+    for field, keys in filter_key(filters):
+        if field in range_index.range_fields:
+            # The documents in the range are found with two binary searches on the sorted values
+            doc_ids = range_index.range_ids(field, *keys)
+            if doc_ids is None:
+                return None
+            bitmap &= to_bitmap(doc_ids)
+            continue
+        if field in spatial_index.spatial_fields:
+            # Only the courses in the cells of the grid around the area are checked
+            doc_ids = spatial_index.filter_ids(field, keys)
+            if doc_ids is None:
+                return None
+            bitmap &= to_bitmap(doc_ids)
+            continue
+        if field not in facets['fields']:
+            raise ValueError(f"Unknown facet {field}")
+        values = facets['fields'][field]
+        field_bitmap = 0
+        for key in keys:
+            if key in values:
+                field_bitmap |= values[key][1]
+        bitmap &= field_bitmap
+    return bitmap
+
+
+def filter_ids(filters: dict, doc_ids = None):
+    """
+    This function returns the candidate documents of a search engine that satisfy the filters
+    Args:
+        filters (dict): The filters (see filter_bitmap())
+        doc_ids (array): The sorted ids of the candidate documents
+            (if None, all the documents that satisfy the filters)
+    Returns:
+        np.ndarray: The sorted ids of the documents (None if the facet (or range, or spatial) index has not been computed yet)
+    """
+    bitmap = filter_bitmap(filters)
+    if bitmap is None:
+        return None
+    if doc_ids is not None:
+        bitmap &= to_bitmap(doc_ids)
+    return to_ids(bitmap)
+
+
+def counts(doc_ids = None, fields: list = None) -> dict:
+    """
+    This function returns the number of documents of the result set with each value of each facet
+    Args:
+        doc_ids (array or int): The ids (or the bitmap) of the documents of the result set
+            (if None, all the documents)
+        fields (list): The facets to count (if None, all the facets)
+    Returns:
+        dict: {field: {value: count, ...}, ...}, with the values sorted by decreasing count
+            and without the values with count 0 (None if the facet index has not been computed yet)
+    """
+    facets = get_facets()
+    if facets is None:
+        return None
+
+    if doc_ids is None:
+        bitmap = facets['documents']
+    elif isinstance(doc_ids, int):
+        bitmap = doc_ids
+    else:
+        bitmap = to_bitmap(doc_ids)
+
+    result = {}
+    for field in fields if fields is not None else facets['fields']:
+        values = facets['fields'].get(field, {})
+        field_counts = [(value, (value_bitmap & bitmap).bit_count()) for value, value_bitmap in values.values()]
+        result[field] = dict(sorted([item for item in field_counts if item[1] > 0], key = lambda item: (-item[1], item[0])))
+    return result
@@ -0,0 +1,118 @@
+import os
+import threading
+
+# In-memory cache of the files loaded by the search engines
+# The keys are the paths of the files and the values are tuples (signature, content)
+# where the signature identifies the version of the file on disk
+_cache = {}
+
+# The cache can be used by more threads at the same time (e.g. by the search_service module):
+# the lock protects the dictionary, while a lock for each path makes sure that a file
+# requested by more threads at the same time is read from disk only once
+_lock = threading.Lock()
+_path_locks = {}
+
+
+def file_signature(path: str) -> tuple:
+    """
+    This function returns the signature of a file, i.e. its last modification time
+    (in nanoseconds) and its size. Two different versions of the same file
+    almost surely have different signatures
+    Args:
+        path (str): The path of the file
+    Returns:
+        tuple: The signature of the file (None if the file does not exists)
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def load(path: str, loader, mode: str = "r"):
+    """
+    This function returns the content of a file, reading it from disk only the first time
+    or when the file has been modified after the last reading.
+    In all the other cases the content is served from memory
+    Args:
+        path (str): The path of the file
+        loader (function): The function that takes the opened file and returns its content
+        mode (str): The mode used to open the file
+    Returns:
+        The content of the file, as returned by the loader
+    Raises:
+        OSError: If the file does not exists or can not be read
+    """
+    signature = file_signature(path)
+    if signature is None:
+        # The file has been removed, so we also drop the cached content
+        with _lock:
+            _cache.pop(path, None)
+        raise FileNotFoundError(path)
+
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == signature:
+        return cached[1]
+
+    with _lock:
+        path_lock = _path_locks.setdefault(path, threading.Lock())
+
+    with path_lock:
+        # Another thread could have read the file while we were waiting
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        with open(path, mode) as f:
+            content = loader(f)
+        with _lock:
+            _cache[path] = (signature, content)
+
+    return content
+
+
+def store(path: str, content) -> None:
+    """
+    This function saves in the cache the content of a file that has just been written,
+    so that the next call to load() does not need to read it again from disk
+    Args:
+        path (str): The path of the file
+        content: The content of the file, as the loader would have returned it
+    Returns:
+        None
+    """
+    signature = file_signature(path)
+    if signature is not None:
+        with _lock:
+            _cache[path] = (signature, content)
+
+
+def invalidate(path: str = None) -> None:
+    """
+    This function removes a file (or all the files if path is None) from the cache
+    Args:
+        path (str): The path of the file
+    Returns:
+        None
+    """
+    with _lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(path, None)
+
+
+def invalidate_missing(directory: str) -> None:
+    """
+    This function removes from the cache the files of a directory (and of its subdirectories)
+    that no longer exist on disk, e.g. the files of the old versions of an index
+    Args:
+        directory (str): The path of the directory
+    Returns:
+        None
+    """
+    prefix = os.path.join(directory, '')
+    with _lock:
+        for path in [path for path in _cache if path.startswith(prefix) and not os.path.exists(path)]:
+            del _cache[path]
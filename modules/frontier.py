@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import os
+import time
+import sqlite3
+import threading
+
+# Persistent frontier of the crawl (see the crawler module): the listing pages and the course pages
+# to download, saved in a SQLite database with their state:
+#   pending  the page has not been downloaded yet
+#   fetched  the page has been downloaded (and, for a listing page, its links have been added)
+#   failed   the last download failed; the page is retried by the next crawls up to max_attempts times
+# Each change is committed immediately, so an interrupted crawl (e.g. a crash after hours) can be
+# resumed exactly where it stopped: the pages already fetched are not requested again.
+# The links of a listing page are added in the same transaction that marks the page as fetched,
+# and the URLs of the courses are the primary key of their table, so a course linked by more
+# listing pages is downloaded only once, at the position of its first listing page in the order of the pages.
+
+path_frontier = 'data/frontier.sqlite'
+
+states = ['pending', 'fetched', 'failed']
+
+
+class Frontier:
+    """
+    The frontier of a crawl, saved in a SQLite database. The methods can be called by more threads at the same time
+    """
+
+    def __init__(self, path: str = path_frontier):
+        """
+        Args:
+            path (str): The file of the database (':memory:' for a frontier that is not saved)
+        """
+        if path != ':memory:' and os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread = False)
+        if path != ':memory:':
+            # With the write-ahead log each commit is durable without rewriting the database
+            self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS pages (page_num INTEGER PRIMARY KEY, url TEXT NOT NULL, "
+                              "state TEXT NOT NULL, attempts INTEGER NOT NULL, updated REAL NOT NULL)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS courses (url TEXT PRIMARY KEY, page_num INTEGER NOT NULL, "
+                              "position INTEGER NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL, "
+                              "path TEXT, updated REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS courses_state ON courses (state)")
+
+    def close(self):
+        """
+        This function closes the database
+        """
+        with self.lock:
+            self.conn.close()
+
+    def add_pages(self, pages: dict):
+        """
+        This function adds the listing pages that are not in the frontier yet
+        Args:
+            pages (dict): {page_num: url}
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO pages (page_num, url, state, attempts, updated) VALUES (?, ?, 'pending', 0, ?)",
+                                  [(page_num, url, now) for page_num, url in pages.items()])
+
+    def pending_pages(self, page_nums: list, max_attempts: int = 3) -> list:
+        """
+        This function returns the listing pages to download: the pending ones and the failed ones
+        with less than max_attempts attempts
+        Args:
+            page_nums (list): The numbers of the pages of the crawl
+            max_attempts (int): The maximum number of attempts of a page
+        Returns:
+            list: The pairs (page_num, url), sorted by page number
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT page_num, url FROM pages WHERE (state = 'pending' OR (state = 'failed' AND attempts < ?)) "
+                                     "ORDER BY page_num", (max_attempts,)).fetchall()
+        page_nums = set(page_nums)
+        return [(page_num, url) for page_num, url in rows if page_num in page_nums]
+
+    def page_fetched(self, page_num: int, links: list) -> tuple:
+        """
+        This function marks a listing page as fetched and adds its links, in the same transaction.
+        The links already in the frontier (from other pages) are not added again, they only move
+        to this page if it comes before their page
+        Args:
+            page_num (int): The number of the page
+            links (list): The URLs of the courses of the page
+        Returns:
+            tuple: The pairs (url, position) of the new links and the URLs of the links moved to this page
+        """
+        now = time.time()
+        added, moved = [], []
+        with self.lock, self.conn:
+            for position, url in enumerate(links):
+                cursor = self.conn.execute("INSERT OR IGNORE INTO courses (url, page_num, position, state, attempts, path, updated) "
+                                           "VALUES (?, ?, ?, 'pending', 0, NULL, ?)", (url, page_num, position, now))
+                if cursor.rowcount > 0:
+                    added.append((url, position))
+                    continue
+                # The listing pages are fetched in any order, so a link keeps the first position
+                # in the order of the pages, not the one of the first page fetched
+                cursor = self.conn.execute("UPDATE courses SET page_num = ?, position = ? WHERE url = ? AND (page_num > ? OR (page_num = ? AND position > ?))",
+                                           (page_num, position, url, page_num, page_num, position))
+                if cursor.rowcount > 0:
+                    moved.append(url)
+            self.conn.execute("UPDATE pages SET state = 'fetched', attempts = attempts + 1, updated = ? WHERE page_num = ?", (now, page_num))
+        return added, moved
+
+    def page_failed(self, page_num: int):
+        """
+        This function marks a listing page as failed
+        """
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE pages SET state = 'failed', attempts = attempts + 1, updated = ? WHERE page_num = ?", (time.time(), page_num))
+
+    def pending_courses(self, page_nums: list, max_attempts: int = 3) -> list:
+        """
+        This function returns the course pages to download: the pending ones and the failed ones
+        with less than max_attempts attempts
+        Args:
+            page_nums (list): The numbers of the listing pages of the crawl
+            max_attempts (int): The maximum number of attempts of a page
+        Returns:
+            list: The triples (url, page_num, position), in the order of the listing pages
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT url, page_num, position FROM courses WHERE state = 'pending' OR (state = 'failed' AND attempts < ?) "
+                                     "ORDER BY page_num, position", (max_attempts,)).fetchall()
+        page_nums = set(page_nums)
+        return [row for row in rows if row[1] in page_nums]
+
+    def course_fetched(self, url: str, path: str = None):
+        """
+        This function marks a course page as fetched
+        Args:
+            url (str): The URL of the course
+            path (str): The file where the page has been saved
+        """
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE courses SET state = 'fetched', attempts = attempts + 1, path = ?, updated = ? WHERE url = ?", (path, time.time(), url))
+
+    def course_failed(self, url: str):
+        """
+        This function marks a course page as failed
+        """
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE courses SET state = 'failed', attempts = attempts + 1, updated = ? WHERE url = ?", (time.time(), url))
+
+    def course(self, url: str) -> dict:
+        """
+        This function returns the state of a course page
+        Args:
+            url (str): The URL of the course
+        Returns:
+            dict: The page_num, position, state, attempts and path of the course (None if it is not in the frontier)
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT page_num, position, state, attempts, path FROM courses WHERE url = ?", (url,)).fetchone()
+        return dict(zip(['page_num', 'position', 'state', 'attempts', 'path'], row)) if row is not None else None
+
+    def set_path(self, url: str, path: str):
+        """
+        This function records the file where a course page has been moved
+        """
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE courses SET path = ?, updated = ? WHERE url = ?", (path, time.time(), url))
+
+    def course_urls(self, page_nums: list = None) -> list:
+        """
+        This function returns the URLs of the courses found in the listing pages (without duplicates)
+        Args:
+            page_nums (list): The numbers of the listing pages (if None, all the pages)
+        Returns:
+            list: The URLs, in the order of the listing pages
+        """
+        with self.lock:
+            rows = self.conn.execute("SELECT url, page_num FROM courses ORDER BY page_num, position").fetchall()
+        if page_nums is not None:
+            page_nums = set(page_nums)
+            rows = [row for row in rows if row[1] in page_nums]
+        return [url for url, _ in rows]
+
+    def counts(self) -> dict:
+        """
+        This function returns the number of listing pages and of course pages in each state
+        Returns:
+            dict: {'pages': {state: count, ...}, 'courses': {state: count, ...}}
+        """
+        result = {}
+        with self.lock:
+            for table in ['pages', 'courses']:
+                rows = dict(self.conn.execute(f"SELECT state, COUNT(*) FROM {table} GROUP BY state").fetchall())
+                result[table] = {state: rows.get(state, 0) for state in states}
+        return result
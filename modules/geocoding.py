@@ -0,0 +1,390 @@
+from __future__ import annotations
+
+import time
+import sqlite3
+
+# Geocoding of the addresses of the courses (universityName,city,country) for the map of the results.
+# Many courses share the same university and city, so the addresses are deduplicated and each
+# distinct address is resolved only once, from a persistent local cache (a SQLite database).
+# Only the addresses that are not in the cache are sent to the provider (e.g. OpenCage through geopy),
+# in batches and with a limit on the rate and on the number of requests; the results (also the
+# addresses that the provider can not find) are saved in the cache after each batch.
+# The addresses that can not be resolved take the coordinates of their city (or country) from
+# the fallback table of the places, filled with the addresses already geocoded or loaded with add_places().
+# pandas and geopy are imported only inside the functions that use them
+
+path_geocoding_cache = 'data/geocoding.sqlite'
+
+# SQLite limits the number of parameters of a query, so the lookups are done in batches
+lookup_batch_size = 500
+
+# The statistics of the last call to geocode()
+last_stats = {}
+
+
+class QuotaExceeded(Exception):
+    """
+    Exception raised by a provider when it can not send more requests (e.g. the daily quota of the
+    service is over). It contains the results of the addresses geocoded before the end of the quota
+    """
+
+    def __init__(self, results: dict = None):
+        super().__init__("The quota of the geocoding provider is over")
+        self.results = results if results is not None else {}
+
+
+def connect() -> sqlite3.Connection:
+    """
+    This function opens the geocoding cache (a SQLite database), creating its tables if needed:
+    - addresses: the coordinates of each address (NULL if the provider could not find it)
+    - places: the coordinates of the cities ('city,country') and of the countries, used as fallback
+    Returns:
+        sqlite3.Connection: The connection to the database
+    """
+    conn = sqlite3.connect(path_geocoding_cache)
+    conn.execute("CREATE TABLE IF NOT EXISTS addresses (key TEXT PRIMARY KEY, address TEXT NOT NULL, "
+                 "latitude REAL, longitude REAL, source TEXT NOT NULL, updated REAL NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS places (key TEXT PRIMARY KEY, latitude REAL NOT NULL, "
+                 "longitude REAL NOT NULL, n INTEGER NOT NULL)")
+    return conn
+
+
+def normalize(address: str) -> str:
+    """
+    This function returns the key of an address in the cache: the parts separated by commas
+    are stripped, with the spaces collapsed and in lower case, so the same address written
+    in slightly different ways is geocoded only once
+    Args:
+        address (str): The address
+    Returns:
+        str: The key of the address
+    """
+    return ','.join(' '.join(part.split()).casefold() for part in str(address).split(','))
+
+
+def fallback_keys(key: str) -> list:
+    """
+    This function returns the keys of the places of an address, from the most to the least precise:
+    the city ('city,country') and the country, i.e. the last two parts and the last part of the address
+    Args:
+        key (str): The key of the address
+    Returns:
+        list: The keys of the places
+    """
+    parts = key.split(',')
+    keys = []
+    if len(parts) >= 2:
+        keys.append(','.join(parts[-2:]))
+    keys.append(parts[-1])
+    return keys
+
+
+def make_addresses(df: pd.DataFrame, columns: list = None) -> pd.Series:
+    """
+    This function builds the address of each course joining the columns with commas, as in the notebook
+    Args:
+        df (pd.DataFrame): The courses
+        columns (list): The columns of the address (if None, universityName, city and country)
+    Returns:
+        pd.Series: The addresses, with the same index of df
+    """
+    if columns is None:
+        columns = ['universityName', 'city', 'country']
+    return df[columns].astype(str).agg(','.join, axis = 1)
+
+
+def lookup(conn: sqlite3.Connection, table: str, keys: list) -> dict:
+    """
+    This function reads the coordinates of some keys from a table of the cache
+    Args:
+        conn (sqlite3.Connection): The connection to the cache
+        table (str): 'addresses' or 'places'
+        keys (list): The keys
+    Returns:
+        dict: {key: (latitude, longitude)} for the keys in the table (the coordinates are None
+            for the addresses that the provider could not find)
+    """
+    found = {}
+    for i in range(0, len(keys), lookup_batch_size):
+        batch = keys[i:i + lookup_batch_size]
+        placeholders = ','.join('?' * len(batch))
+        rows = conn.execute(f"SELECT key, latitude, longitude FROM {table} WHERE key IN ({placeholders})", batch)
+        found.update({key: (latitude, longitude) for key, latitude, longitude in rows})
+    return found
+
+
+def add_places(places: dict) -> None:
+    """
+    This function loads coordinates in the fallback table of the places, e.g. from a gazetteer of the cities
+    Args:
+        places (dict): {'city,country' or 'country': (latitude, longitude)}
+    Returns:
+        None
+    """
+    conn = connect()
+    try:
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO places (key, latitude, longitude, n) VALUES (?, ?, ?, 1)",
+                             [(normalize(key), float(latitude), float(longitude)) for key, (latitude, longitude) in places.items()])
+    finally:
+        conn.close()
+
+
+def save(conn: sqlite3.Connection, results: dict, addresses: dict, source: str) -> None:
+    """
+    This function saves the results of the provider in the cache. The coordinates of the found
+    addresses are also averaged into the coordinates of their city and country in the places table
+    (only once for each address, also when it is saved again)
+    Args:
+        conn (sqlite3.Connection): The connection to the cache
+        results (dict): {key: (latitude, longitude) or None}
+        addresses (dict): The original address of each key
+        source (str): The name of the provider
+    Returns:
+        None
+    """
+    now = time.time()
+    # The addresses that already have coordinates in the cache are already in the means of their places
+    known = {key for key, point in lookup(conn, 'addresses', list(results)).items() if point[0] is not None}
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO addresses (key, address, latitude, longitude, source, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                         [(key, addresses[key], *(point if point is not None else (None, None)), source, now)
+                          for key, point in results.items()])
+        for key, point in results.items():
+            if point is None or key in known:
+                continue
+            for place in fallback_keys(key):
+                # Running mean of the coordinates of the addresses of the place
+                conn.execute("INSERT INTO places (key, latitude, longitude, n) VALUES (?, ?, ?, 1) "
+                             "ON CONFLICT(key) DO UPDATE SET latitude = latitude + (excluded.latitude - latitude) / (n + 1), "
+                             "longitude = longitude + (excluded.longitude - longitude) / (n + 1), n = n + 1",
+                             (place, point[0], point[1]))
+
+
+def geocode(addresses, provider = None, level: str = 'address', batch_size: int = 50, retry_misses: bool = False) -> pd.DataFrame:
+    """
+    This function returns the coordinates of a list of addresses.
+    Each distinct address is looked up in the cache and only the missing ones are sent to the
+    provider, in batches of batch_size (saved in the cache after each batch, so an interrupted
+    run does not lose the requests already done). The addresses whose request fails (e.g. a timeout)
+    are not saved, so the next calls send them again, and when the quota of the provider is over
+    (QuotaExceeded) the remaining addresses are not sent. The addresses that are still not resolved
+    take the coordinates of their city or country from the places table
+    Args:
+        addresses (pd.Series or list): The addresses ('universityName,city,country', see make_addresses())
+        provider: The object that geocodes the missing addresses (see StubProvider and GeopyProvider),
+            if None only the cache and the fallback table are used (offline)
+        level (str): 'address' to geocode the full addresses, or 'city' to geocode only
+            the cities ('city,country'), which needs much less requests
+        batch_size (int): The number of addresses sent to the provider before saving them
+        retry_misses (bool): If True the addresses that the provider could not find before are sent again
+    Returns:
+        pd.DataFrame: The columns 'latitude', 'longitude' and 'source' ('cache', the name of the provider,
+            'city', 'country' or None if the address could not be resolved), with the same index of addresses
+    """
+    import pandas as pd
+
+    if not isinstance(addresses, pd.Series):
+        addresses = pd.Series(list(addresses))
+
+    keys = [normalize(address) for address in addresses.values]
+    if level == 'city':
+        keys = [fallback_keys(key)[0] for key in keys]
+    # The original address of each distinct key
+    unique = {}
+    for key, address in zip(keys, addresses.values):
+        unique.setdefault(key, ','.join(str(address).split(',')[-2:]) if level == 'city' else str(address))
+
+    conn = connect()
+    try:
+        points = {}
+        sources = {}
+        cached = lookup(conn, 'addresses', list(unique))
+        for key, point in cached.items():
+            if point[0] is not None:
+                points[key] = point
+                sources[key] = 'cache'
+
+        # Only the true misses are sent to the provider
+        missing = [key for key in unique if key not in points and (retry_misses or key not in cached)]
+        n_requests = 0
+        n_failed = 0
+        if provider is not None:
+            for i in range(0, len(missing), batch_size):
+                batch = missing[i:i + batch_size]
+                # The provider returns only the addresses that it could geocode: the ones whose request
+                # failed (e.g. a timeout) are not saved, so they are sent again by the next calls.
+                # At the end of its quota it raises QuotaExceeded with the results obtained before
+                quota_exceeded = False
+                try:
+                    results = provider.geocode([unique[key] for key in batch])
+                except QuotaExceeded as e:
+                    results = e.results
+                    quota_exceeded = True
+                results = {key: results[unique[key]] for key in batch if unique[key] in results}
+                n_requests += len(results)
+                save(conn, results, unique, provider.name)
+                for key, point in results.items():
+                    if point is not None:
+                        points[key] = point
+                        sources[key] = provider.name
+                if quota_exceeded:
+                    print("The quota of the geocoding provider is over, the other addresses are not geocoded")
+                    break
+                n_failed += len(batch) - len(results)
+
+        # Fallback to the coordinates of the city or of the country
+        unresolved = [key for key in unique if key not in points]
+        places = lookup(conn, 'places', list({place for key in unresolved for place in fallback_keys(key)}))
+        for key in unresolved:
+            keys_of_places = fallback_keys(key)
+            for place, kind in zip(keys_of_places, ['city', 'country'][-len(keys_of_places):]):
+                if place in places:
+                    points[key] = places[place]
+                    sources[key] = kind
+                    break
+    finally:
+        conn.close()
+
+    global last_stats
+    last_stats = {
+        'addresses': len(keys),
+        'unique': len(unique),
+        'cache_hits': sum(source == 'cache' for source in sources.values()),
+        'provider_requests': n_requests,
+        'provider_failures': n_failed,
+        'fallbacks': sum(source in ('city', 'country') for source in sources.values()),
+        'unresolved': len(unique) - len(points),
+    }
+
+    return pd.DataFrame({
+        'latitude': [points.get(key, (None, None))[0] for key in keys],
+        'longitude': [points.get(key, (None, None))[1] for key in keys],
+        'source': [sources.get(key) for key in keys],
+    }, index = addresses.index)
+
+
+def geocode_courses(df: pd.DataFrame, provider = None, level: str = 'address', columns: list = None) -> pd.DataFrame:
+    """
+    This function adds the columns 'address', 'latitude', 'longitude' and 'geocoding_source'
+    to a dataframe of courses (e.g. the results of a query), see geocode()
+    Args:
+        df (pd.DataFrame): The courses
+        provider: The provider for the addresses that are not in the cache (None to work offline)
+        level (str): 'address' or 'city'
+        columns (list): The columns of the address (if None, universityName, city and country)
+    Returns:
+        pd.DataFrame: A copy of df with the new columns
+    """
+    df = df.copy()
+    df['address'] = make_addresses(df, columns)
+    points = geocode(df['address'], provider, level)
+    df['latitude'] = points['latitude']
+    df['longitude'] = points['longitude']
+    df['geocoding_source'] = points['source']
+    return df
+
+
+class StubProvider:
+    """
+    Local provider that reads the coordinates from a dictionary, for the tests and to work offline.
+    It can also simulate the failed requests and the end of the quota of a real service
+    """
+    name = 'stub'
+
+    def __init__(self, table: dict, max_requests: int = None, failing: list = ()):
+        """
+        Args:
+            table (dict): {address: (latitude, longitude)}, the addresses are normalized
+            max_requests (int): The maximum number of requests (if None, no limit)
+            failing (list): The addresses whose request fails (as a timeout)
+        """
+        self.table = {normalize(address): point for address, point in table.items()}
+        self.max_requests = max_requests
+        self.failing = {normalize(address) for address in failing}
+        self.requests = 0
+
+    def geocode(self, addresses: list) -> dict:
+        """
+        This function geocodes a batch of addresses
+        Args:
+            addresses (list): The addresses
+        Returns:
+            dict: {address: (latitude, longitude) or None if it is not found}, without the failed requests
+        Raises:
+            QuotaExceeded: If the quota is over
+        """
+        results = {}
+        for address in addresses:
+            if self.max_requests is not None and self.requests >= self.max_requests:
+                raise QuotaExceeded(results)
+            self.requests += 1
+            if normalize(address) in self.failing:
+                continue
+            results[address] = self.table.get(normalize(address))
+        return results
+
+
+class GeopyProvider:
+    """
+    Provider that geocodes the addresses with one of the services supported by geopy (e.g. OpenCage),
+    sending at most requests_per_second requests each second and at most max_requests requests
+    (e.g. the daily quota of the service) for each object
+    """
+
+    def __init__(self, service: str = 'opencage', api_key: str = None, requests_per_second: float = 1.0,
+                 max_requests: int = 2500, timeout: float = 20, user_agent: str = 'ADM_HW3'):
+        """
+        Args:
+            service (str): The name of the geopy geocoder (e.g. 'opencage' or 'nominatim')
+            api_key (str): The key of the service (if needed)
+            requests_per_second (float): The maximum rate of the requests
+            max_requests (int): The maximum number of requests
+            timeout (float): The timeout of each request in seconds
+            user_agent (str): The user agent sent to the service
+        """
+        from geopy.geocoders import get_geocoder_for_service
+
+        options = {'timeout': timeout, 'user_agent': user_agent}
+        if api_key is not None:
+            options['api_key'] = api_key
+        self.geocoder = get_geocoder_for_service(service)(**options)
+        self.name = service
+        self.min_interval = 1 / requests_per_second
+        self.max_requests = max_requests
+        self.requests = 0
+        self.last_request = 0.0
+
+    def geocode(self, addresses: list) -> dict:
+        """
+        This function geocodes a batch of addresses, one request at a time.
+        The addresses whose request fails (e.g. timeout) are not in the result,
+        so they are not saved in the cache and can be retried later
+        Args:
+            addresses (list): The addresses
+        Returns:
+            dict: {address: (latitude, longitude) or None if the service does not find it}
+        Raises:
+            QuotaExceeded: If the quota is over (max_requests or the quota of the service),
+                with the results of the addresses geocoded before
+        """
+        from geopy.exc import GeocoderQuotaExceeded
+
+        results = {}
+        for address in addresses:
+            if self.requests >= self.max_requests:
+                raise QuotaExceeded(results)
+            wait = self.last_request + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.last_request = time.monotonic()
+            self.requests += 1
+            try:
+                location = self.geocoder.geocode(address)
+            except GeocoderQuotaExceeded:
+                raise QuotaExceeded(results)
+            except Exception as e:
+                print(f"Geocoding of {address} failed: {e}")
+                continue
+            results[address] = (location.latitude, location.longitude) if location is not None else None
+        return results
@@ -0,0 +1,193 @@
+import os
+import json
+import heapq
+import tempfile
+
+# Maximum number of postings (i.e. pairs term_id, document) kept in memory while building
+# the inverted index. When this number is reached the postings collected so far are sorted
+# and written to disk in a temporary file (a "run"), and at the end all the runs are merged
+max_postings_in_memory = 5_000_000
+
+
+def build_inverted_index(documents, vocabulary: dict, path: str, max_postings: int = None, tmp_dir: str = None) -> int:
+    """
+    This function builds the inverted index in a single pass over the documents,
+    following the SPIMI (Single-Pass In-Memory Indexing) algorithm:
+    - the postings of the documents are collected in memory, one list for each term
+    - when the memory budget is exceeded the lists are sorted and written to disk as a run
+    - finally all the runs are merged, term by term, directly into the output json file
+    The posting lists of the output are sorted and without duplicates.
+    Since the documents are only iterated, they can be streamed from anywhere
+    without loading the whole corpus in memory
+    Args:
+        documents (iterable): The documents as pairs (document_id, list of words)
+        vocabulary (dict): The vocabulary, i.e. the mapping from words to term_id
+        path (str): The path of the json file where the inverted index is saved
+        max_postings (int): The maximum number of postings kept in memory
+        tmp_dir (str): The folder of the temporary files (the system one if None)
+    Returns:
+        int: The number of terms in the inverted index
+    """
+    if max_postings is None:
+        max_postings = max_postings_in_memory
+
+    runs = []
+    block = {}
+    n_postings = 0
+
+    try:
+        for doc_id, lst_words in documents:
+            doc_id = int(doc_id)
+
+            for word in lst_words:
+                term_id = vocabulary.get(word.lower(), None)
+                if term_id is None:
+                    continue
+
+                postings = block.get(term_id)
+                if postings is None:
+                    block[term_id] = [doc_id]
+                    n_postings += 1
+                # Since all the words of a document are processed together, a repeated
+                # word can only be a duplicate of the last posting of the list
+                elif postings[-1] != doc_id:
+                    postings.append(doc_id)
+                    n_postings += 1
+
+            # If the memory budget is exceeded we write the block on disk
+            if n_postings >= max_postings:
+                runs.append(write_run(block, tmp_dir))
+                block = {}
+                n_postings = 0
+
+        if len(runs) == 0:
+            # The whole index fits in memory, so there is nothing to merge
+            terms = ((term_id, sort_postings(block[term_id])) for term_id in sorted(block))
+            return write_inverted_index(path, terms)
+
+        if len(block) > 0:
+            runs.append(write_run(block, tmp_dir))
+        block = {}
+
+        return write_inverted_index(path, merge_runs(runs))
+
+    finally:
+        for run in runs:
+            try:
+                os.remove(run)
+            except OSError:
+                pass
+
+
+def sort_postings(postings: list) -> list:
+    """
+    This function sorts a posting list and removes the duplicates.
+    If the documents have been processed in order the list is already sorted,
+    and both the operations take linear time
+    Args:
+        postings (list): The list of document ids
+    Returns:
+        list: The sorted list without duplicates
+    """
+    postings.sort()
+
+    result = []
+    for doc_id in postings:
+        if len(result) == 0 or result[-1] != doc_id:
+            result.append(doc_id)
+    return result
+
+
+def write_run(block: dict, tmp_dir: str = None) -> str:
+    """
+    This function writes a block of postings in a temporary file, one term for each line
+    in the format [term_id, [doc_id1, doc_id2, ...]] and sorted by term_id
+    Args:
+        block (dict): The postings of the block, as term_id -> list of document ids
+        tmp_dir (str): The folder of the temporary file (the system one if None)
+    Returns:
+        str: The path of the temporary file
+    """
+    fd, run_path = tempfile.mkstemp(prefix="inverted_index_run_", suffix=".jsonl", dir=tmp_dir)
+    with os.fdopen(fd, "w") as f:
+        for term_id in sorted(block):
+            f.write(json.dumps([term_id, sort_postings(block[term_id])]) + "\n")
+    return run_path
+
+
+def read_run(run_path: str):
+    """
+    This function reads, one term at a time, a run written by write_run()
+    Args:
+        run_path (str): The path of the run
+    Returns:
+        generator: The pairs (term_id, posting list)
+    """
+    with open(run_path, "r") as f:
+        for line in f:
+            term_id, postings = json.loads(line)
+            yield term_id, postings
+
+
+def merge_runs(runs: list):
+    """
+    This function merges the runs, keeping in memory only the current term of each run
+    Args:
+        runs (list): The paths of the runs
+    Returns:
+        generator: The pairs (term_id, posting list) sorted by term_id
+    """
+    current_term = None
+    current_postings = []
+
+    for term_id, postings in heapq.merge(*[read_run(run) for run in runs], key = lambda item: item[0]):
+        if term_id != current_term:
+            if current_term is not None:
+                yield current_term, current_postings
+            current_term = term_id
+            current_postings = []
+
+        # heapq.merge() returns the lists of the same term in the order of the runs, and the runs
+        # are written in the order of the documents, so usually the list only continues the current one
+        # and it is appended (dropping the document split between two runs, if any)
+        if len(current_postings) == 0 or postings[0] > current_postings[-1]:
+            current_postings.extend(postings)
+        elif postings[0] == current_postings[-1]:
+            current_postings.extend(postings[1:])
+        else:
+            # The documents were not given in order: both the lists are sorted, so we merge them removing the duplicates
+            merged = []
+            for doc_id in heapq.merge(current_postings, postings):
+                if len(merged) == 0 or merged[-1] != doc_id:
+                    merged.append(doc_id)
+            current_postings = merged
+
+    if current_term is not None:
+        yield current_term, current_postings
+
+
+def write_inverted_index(path: str, terms) -> int:
+    """
+    This function writes the inverted index in a json file one term at a time,
+    so that the whole index is never kept in memory.
+    The format is the same of json.dump() on the inverted index dictionary
+    Args:
+        path (str): The path of the json file
+        terms (iterable): The pairs (term_id, posting list) of the index
+    The index is written in a temporary file that then replaces the old one,
+    so the queries running meanwhile never read a partial file
+    Returns:
+        int: The number of terms written
+    """
+    n_terms = 0
+    tmp_path = path + '.tmp'
+    with open(tmp_path, "w") as f:
+        f.write("{")
+        for term_id, postings in terms:
+            if n_terms > 0:
+                f.write(", ")
+            f.write(json.dumps(str(term_id)) + ": " + json.dumps(postings))
+            n_terms += 1
+        f.write("}")
+    os.replace(tmp_path, path)
+    return n_terms
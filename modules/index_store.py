@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+from . import engine_v1
+from . import file_cache
+
+# Versioned storage of the files of the ranked search engines (engine_v2 and engine_v3).
+# Each build writes all its files in a new directory, never touching the files of the version
+# in use, and then it is published by replacing the CURRENT file of the engine (an atomic operation):
+#     data/indexes/v2/CURRENT                            the name of the version in use
+#     data/indexes/v2/1700000000000000000/manifest.json  the description of the version
+#     data/indexes/v2/1700000000000000000/...            the files of the version
+# The manifest contains the engine, the configuration of the analyzer (and of the score), the number
+# of documents and the size and sha256 checksum of each file. A query reads CURRENT once and then reads all
+# the files of that version, so it never mixes files of different builds; the running processes
+# see a new version at their next query, without restarting. The most recent old versions are
+# kept, so the queries that are still reading them can end
+
+path_indexes = 'data/indexes'
+name_current = 'CURRENT'
+name_manifest = 'manifest.json'
+
+# The number of old versions kept after a new version is published
+keep_versions = 2
+
+# The last version in use seen by this process for each engine
+seen_versions = {}
+
+
+def engine_directory(engine: str) -> str:
+    """
+    This function returns the directory with the versions of an engine
+    Args:
+        engine (str): The name of the engine (e.g. 'v2')
+    Returns:
+        str: The path of the directory
+    """
+    return os.path.join(path_indexes, engine)
+
+
+def version_directory(engine: str, version: str) -> str:
+    """
+    This function returns the directory of a version of an engine
+    Args:
+        engine (str): The name of the engine
+        version (str): The name of the version
+    Returns:
+        str: The path of the directory
+    """
+    return os.path.join(engine_directory(engine), version)
+
+
+def create_version(engine: str) -> str:
+    """
+    This function creates the directory of a new version, where a build writes its files.
+    The version is not used by the queries until it is published
+    Args:
+        engine (str): The name of the engine
+    Returns:
+        str: The name of the new version (increasing with the time of creation)
+    """
+    while True:
+        version = str(time.time_ns())
+        try:
+            os.makedirs(version_directory(engine, version))
+            return version
+        except FileExistsError:
+            pass
+
+
+def current_version(engine: str) -> str:
+    """
+    This function returns the version in use of an engine (the file CURRENT is read only when it changes)
+    Args:
+        engine (str): The name of the engine
+    Returns:
+        str: The name of the version (None if no version has been published)
+    """
+    try:
+        version = file_cache.load(os.path.join(engine_directory(engine), name_current), lambda f: f.read().strip())
+    except Exception as e:
+        return None
+
+    if seen_versions.get(engine) != version:
+        # A new version has been published (maybe by another process): the files
+        # of the versions that have been removed are dropped from the memory
+        seen_versions[engine] = version
+        file_cache.invalidate_missing(engine_directory(engine))
+    return version
+
+
+def path(engine: str, name: str, version: str = None) -> str:
+    """
+    This function returns the path of a file of a version
+    Args:
+        engine (str): The name of the engine
+        name (str): The name of the file
+        version (str): The name of the version (if None, the version in use)
+    Returns:
+        str: The path of the file (None if no version has been published)
+    """
+    if version is None:
+        version = current_version(engine)
+        if version is None:
+            return None
+    return os.path.join(version_directory(engine, version), name)
+
+
+def checksum(file_path: str) -> str:
+    """
+    This function computes the sha256 checksum of a file, reading it in blocks
+    Args:
+        file_path (str): The path of the file
+    Returns:
+        str: The checksum
+    """
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def publish(engine: str, version: str, n_documents: int, scoring: dict = None) -> dict:
+    """
+    This function writes the manifest of a version and makes it the version in use,
+    replacing the file CURRENT atomically. Then the oldest versions are removed
+    Args:
+        engine (str): The name of the engine
+        version (str): The name of the version
+        n_documents (int): The number of documents of the version
+        scoring (dict): The parameters of the score of the engine (if any)
+    Returns:
+        dict: The manifest
+    """
+    directory = version_directory(engine, version)
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        if name != name_manifest:
+            file_path = os.path.join(directory, name)
+            files[name] = {'size': os.path.getsize(file_path), 'sha256': checksum(file_path)}
+
+    manifest = {
+        'engine': engine,
+        'version': version,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'analyzer': engine_v1.analyzer_config(),
+        'n_documents': int(n_documents),
+        'files': files,
+    }
+    if scoring is not None:
+        manifest['scoring'] = scoring
+    write_atomic(os.path.join(directory, name_manifest), json.dumps(manifest, indent = 2))
+
+    # The pointer to the version in use is replaced in a single step
+    write_atomic(os.path.join(engine_directory(engine), name_current), version)
+
+    prune(engine)
+    return manifest
+
+
+def write_atomic(file_path: str, text: str) -> None:
+    """
+    This function writes a text file in a temporary file that then replaces the old one
+    Args:
+        file_path (str): The path of the file
+        text (str): The content
+    Returns:
+        None
+    """
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, "w") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, file_path)
+
+
+def list_versions(engine: str) -> list:
+    """
+    This function returns the published versions of an engine (the ones with a manifest)
+    Args:
+        engine (str): The name of the engine
+    Returns:
+        list: The names of the versions, from the oldest to the newest
+    """
+    directory = engine_directory(engine)
+    if not os.path.isdir(directory):
+        return []
+    versions = [name for name in os.listdir(directory)
+                if os.path.isfile(os.path.join(directory, name, name_manifest))]
+    return sorted(versions, key = int)
+
+
+def prune(engine: str) -> None:
+    """
+    This function removes the old versions of an engine, keeping the version in use and the
+    keep_versions most recent ones before it. The versions newer than the one in use
+    (e.g. builds that are still running) are never removed
+    Args:
+        engine (str): The name of the engine
+    Returns:
+        None
+    """
+    current = current_version(engine)
+    if current is None:
+        return
+    older = [version for version in list_versions(engine) if int(version) < int(current)]
+    for version in older[:max(len(older) - keep_versions, 0)]:
+        directory = version_directory(engine, version)
+        for name in os.listdir(directory):
+            file_cache.invalidate(os.path.join(directory, name))
+        shutil.rmtree(directory, ignore_errors = True)
+
+
+def get_manifest(engine: str, version: str = None) -> dict:
+    """
+    This function loads the manifest of a version
+    Args:
+        engine (str): The name of the engine
+        version (str): The name of the version (if None, the version in use)
+    Returns:
+        dict: The manifest (None if the version does not exists)
+    """
+    manifest_path = path(engine, name_manifest, version)
+    if manifest_path is None:
+        return None
+    try:
+        return file_cache.load(manifest_path, json.load)
+    except Exception as e:
+        return None
+
+
+def verify(engine: str, version: str = None) -> bool:
+    """
+    This function checks that the files of a version have the sizes and checksums of its manifest
+    Args:
+        engine (str): The name of the engine
+        version (str): The name of the version (if None, the version in use)
+    Returns:
+        bool: True if all the files are intact
+    """
+    manifest = get_manifest(engine, version)
+    if manifest is None:
+        return False
+    directory = version_directory(engine, manifest['version'])
+    for name, info in manifest['files'].items():
+        file_path = os.path.join(directory, name)
+        if not os.path.isfile(file_path) or os.path.getsize(file_path) != info['size'] or checksum(file_path) != info['sha256']:
+            return False
+    return True
+
+
+def load(engine: str, name: str, loader, version: str = None, mode: str = "r"):
+    """
+    This function loads a file of a version through the file_cache (see file_cache.load())
+    Args:
+        engine (str): The name of the engine
+        name (str): The name of the file
+        loader (function): The function that takes the opened file and returns its content
+        version (str): The name of the version (if None, the version in use)
+        mode (str): The mode used to open the file
+    Returns:
+        The content of the file, as returned by the loader
+    Raises:
+        OSError: If no version has been published or the file does not exists
+    """
+    file_path = path(engine, name, version)
+    if file_path is None:
+        raise FileNotFoundError(name)
+    return file_cache.load(file_path, loader, mode)
@@ -0,0 +1,334 @@
+from __future__ import annotations
+
+import os
+import json
+
+# Export of the map of the courses for the web, scalable to the whole dataset.
+# Instead of one marker (with its HTML popup) for each course in a single HTML file, as the folium
+# map of the notebook, the markers are clustered in advance for each zoom level and saved as
+# small GeoJSON files ("chunks"), each one with the clusters of a square of the map at a zoom level.
+# The HTML page contains only the code of the map (Leaflet): it downloads the index of the chunks
+# and then only the chunks of the visible part of the map at the current zoom.
+# The clusters are computed on a grid of cells of cluster_radius pixels in the Web Mercator projection:
+# each cell at a zoom level is made of 2 x 2 cells of the next zoom level, so the clusters are
+# hierarchical (a cluster is the union of its clusters at the next zoom level).
+# Serve the folder with a web server (e.g. python -m http.server) to open the page, the browsers
+# do not allow reading the chunks from file://
+# numpy and pandas are imported only inside the functions, so that importing the module is fast
+
+path_map_folder = 'map'
+
+# The categories of the fees of the notebook (see fee_cat()) and their colors on the map
+fee_bounds = [1000, 5000, 10000, 15000, 20000]
+fee_categories = ['Less than 1000 €', '1000 to 5000 €', '5000 to 10000 €', '10000 to 15000 €', '15000 to 20000 €', 'More than 20000 €', 'Unknown']
+fee_colors = ['green', 'pink', 'orange', 'red', 'purple', 'black', 'gray']
+
+# The maximum latitude of the Web Mercator projection
+max_latitude = 85.05112878
+
+
+def fee_cat(fees: float) -> str:
+    """
+    This function categorizes the fee amounts into 6 categories (as in the notebook),
+    plus 'Unknown' for the courses without fees
+    Args:
+        fees (float): The fees in EUR
+    Returns:
+        str: The category
+    """
+    return fee_categories[int(fee_category_ids([fees])[0])]
+
+
+def fee_category_ids(fees):
+    """
+    This function returns the position in fee_categories of the category of some fees
+    Args:
+        fees (array): The fees in EUR (nan for the missing ones)
+    Returns:
+        np.ndarray: The positions of the categories
+    """
+    import numpy as np
+
+    fees = np.asarray(fees, dtype = np.float64)
+    categories = np.searchsorted(fee_bounds, fees, side = 'right')
+    categories[np.isnan(fees)] = len(fee_categories) - 1
+    return categories
+
+
+def project(latitudes, longitudes) -> tuple:
+    """
+    This function projects the coordinates with the Web Mercator projection (the one of the web maps)
+    Args:
+        latitudes, longitudes (np.ndarray): The coordinates in degrees
+    Returns:
+        tuple: The coordinates x and y in [0, 1], i.e. the pixels at zoom z divided by 256 * 2^z
+    """
+    import numpy as np
+
+    latitudes = np.radians(np.clip(latitudes, -max_latitude, max_latitude))
+    x = (np.asarray(longitudes, dtype = np.float64) + 180) / 360
+    y = (1 - np.log(np.tan(latitudes) + 1 / np.cos(latitudes)) / np.pi) / 2
+    return np.clip(x, 0, 1 - 1e-12), np.clip(y, 0, 1 - 1e-12)
+
+
+def cluster_levels(x, y, min_zoom: int, max_zoom: int, cluster_radius: int) -> dict:
+    """
+    This function clusters the points at each zoom level: two points are in the same cluster
+    at zoom z if they are in the same cell of cluster_radius x cluster_radius pixels
+    Args:
+        x, y (np.ndarray): The projected coordinates of the points (see project())
+        min_zoom, max_zoom (int): The zoom levels
+        cluster_radius (int): The size of the cells in pixels
+    Returns:
+        dict: For each zoom level the cluster of each point ('inverse') and, for each cluster,
+            the zoom level where it splits into more clusters ('expansion', -1 if it never splits)
+    """
+    import numpy as np
+
+    levels = {}
+    for zoom in range(max_zoom, min_zoom - 1, -1):
+        scale = 256 * 2 ** zoom / cluster_radius
+        n_cells = int(np.ceil(scale)) + 1
+        keys = np.floor(x * scale).astype(np.int64) * n_cells + np.floor(y * scale).astype(np.int64)
+        _, inverse = np.unique(keys, return_inverse = True)
+        n_clusters = int(inverse.max()) + 1 if len(inverse) > 0 else 0
+
+        if zoom == max_zoom:
+            expansion = np.full(n_clusters, -1, dtype = np.int64)
+        else:
+            # The clusters of the next zoom level contained in each cluster
+            child_inverse, child_expansion = levels[zoom + 1]['inverse'], levels[zoom + 1]['expansion']
+            n_child_clusters = len(child_expansion)
+            pairs = np.unique(inverse * n_child_clusters + child_inverse)
+            parents, children = pairs // n_child_clusters, pairs % n_child_clusters
+            n_children = np.bincount(parents, minlength = n_clusters)
+            # A cluster with one child splits where its child splits
+            expansion = np.full(n_clusters, zoom + 1, dtype = np.int64)
+            single = n_children == 1
+            only_child = np.zeros(n_clusters, dtype = np.int64)
+            only_child[parents] = children
+            expansion[single] = child_expansion[only_child[single]]
+        levels[zoom] = {'inverse': inverse, 'expansion': expansion}
+    return levels
+
+
+def compact(value: float) -> float:
+    """
+    This function rounds the coordinates to 5 decimals (about 1 meter), to keep the files small
+    """
+    return round(float(value), 5)
+
+
+def point_properties(row: tuple) -> dict:
+    """
+    This function returns the properties of a single course on the map
+    Args:
+        row (tuple): The id, name, university, fees, category and url of the course
+    Returns:
+        dict: The properties
+    """
+    doc_id, name, university, fees, category, url = row
+    return {'id': int(doc_id), 'n': name, 'u': university, 'f': None if fees != fees else int(fees), 'c': int(category), 'l': url}
+
+
+def export(df: pd.DataFrame, folder: str = path_map_folder, min_zoom: int = 2, max_zoom: int = 13,
+           cluster_radius: int = 60, chunk_shift: int = 2, max_items: int = 50) -> dict:
+    """
+    This function exports the map of the courses in a folder:
+        index.html                  the page with the map
+        index.json                  the zoom levels, the categories and the list of the chunks
+        chunks/{zoom}/{x}_{y}.json  the GeoJSON features of a square of 256 * 2^chunk_shift pixels at a zoom level
+    The features are the clusters (with the number of courses of each fee category and the zoom level
+    where they split) and the single courses (with name, university, fees, fee category and url).
+    The clusters that never split (e.g. the courses of the same university) also contain the
+    list of their first max_items courses
+    Args:
+        df (pd.DataFrame): The courses, indexed by document id, with the columns 'latitude' and 'longitude'
+            (see geocoding.geocode_courses()) and optionally 'feesEUR', 'courseName', 'universityName', 'url'
+        folder (str): The output folder
+        min_zoom, max_zoom (int): The zoom levels of the chunks (at higher zoom levels the chunks of max_zoom are used)
+        cluster_radius (int): The size in pixels of the cells of the clusters
+        chunk_shift (int): The chunks are 2^chunk_shift x 2^chunk_shift tiles of 256 pixels
+        max_items (int): The maximum number of courses listed in a cluster that never splits
+    Returns:
+        dict: The number of courses, of chunks and the total size of the chunks in bytes
+    """
+    import numpy as np
+    import pandas as pd
+
+    latitudes = pd.to_numeric(df['latitude'], errors = 'coerce').to_numpy(dtype = np.float64)
+    longitudes = pd.to_numeric(df['longitude'], errors = 'coerce').to_numpy(dtype = np.float64)
+    present = np.isfinite(latitudes) & np.isfinite(longitudes)
+    df = df[present]
+    latitudes, longitudes = latitudes[present], longitudes[present]
+
+    fees = pd.to_numeric(df['feesEUR'], errors = 'coerce').to_numpy(dtype = np.float64) if 'feesEUR' in df.columns else np.full(len(df), np.nan)
+    categories = fee_category_ids(fees)
+    columns = [df[column].astype(str).tolist() if column in df.columns else [''] * len(df) for column in ('courseName', 'universityName', 'url')]
+    rows = list(zip(df.index.tolist(), columns[0], columns[1], fees.tolist(), categories.tolist(), columns[2]))
+
+    x, y = project(latitudes, longitudes)
+    levels = cluster_levels(x, y, min_zoom, max_zoom, cluster_radius)
+    n_categories = len(fee_categories)
+    chunk_size = 256 * 2 ** chunk_shift
+
+    chunk_index = {}
+    n_bytes = 0
+    for zoom, level in levels.items():
+        inverse, expansion = level['inverse'], level['expansion']
+        n_clusters = len(expansion)
+        counts = np.bincount(inverse, minlength = n_clusters)
+        # The position of a cluster is the mean of the projected positions of its courses
+        cluster_x = np.bincount(inverse, weights = x, minlength = n_clusters) / np.maximum(counts, 1)
+        cluster_y = np.bincount(inverse, weights = y, minlength = n_clusters) / np.maximum(counts, 1)
+        cluster_longitudes = cluster_x * 360 - 180
+        cluster_latitudes = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * cluster_y))))
+        category_counts = np.bincount(inverse * n_categories + categories, minlength = n_clusters * n_categories).reshape(n_clusters, n_categories)
+
+        # The courses of each cluster, used for the single courses and the clusters that never split
+        order = np.argsort(inverse, kind = 'stable')
+        starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+        # The chunk of each cluster
+        chunk_x = np.floor(cluster_x * 256 * 2 ** zoom / chunk_size).astype(np.int64)
+        chunk_y = np.floor(cluster_y * 256 * 2 ** zoom / chunk_size).astype(np.int64)
+
+        chunks = {}
+        for cluster in range(n_clusters):
+            geometry = {'type': 'Point', 'coordinates': [compact(cluster_longitudes[cluster]), compact(cluster_latitudes[cluster])]}
+            if counts[cluster] == 1:
+                properties = point_properties(rows[order[starts[cluster]]])
+            else:
+                properties = {'k': int(counts[cluster]), 'fc': category_counts[cluster].tolist(),
+                              'e': int(expansion[cluster]) if expansion[cluster] >= 0 else None}
+                if expansion[cluster] < 0:
+                    members = order[starts[cluster]:starts[cluster] + min(counts[cluster], max_items)]
+                    properties['items'] = [point_properties(rows[member]) for member in members]
+            chunks.setdefault((int(chunk_x[cluster]), int(chunk_y[cluster])), []).append(
+                {'type': 'Feature', 'geometry': geometry, 'properties': properties})
+
+        os.makedirs(os.path.join(folder, 'chunks', str(zoom)), exist_ok = True)
+        for (cx, cy), features in chunks.items():
+            content = json.dumps({'type': 'FeatureCollection', 'features': features}, separators = (',', ':'), ensure_ascii = False)
+            with open(os.path.join(folder, 'chunks', str(zoom), f'{cx}_{cy}.json'), "w", encoding = 'utf-8') as f:
+                f.write(content)
+            n_bytes += len(content.encode('utf-8'))
+        chunk_index[zoom] = sorted(f'{cx}_{cy}' for cx, cy in chunks)
+
+    index = {
+        'min_zoom': min_zoom,
+        'max_zoom': max_zoom,
+        'chunk_size': chunk_size,
+        'categories': fee_categories,
+        'colors': fee_colors,
+        'count': int(len(df)),
+        'bounds': [[float(latitudes.min()), float(longitudes.min())], [float(latitudes.max()), float(longitudes.max())]] if len(df) > 0 else None,
+        'chunks': chunk_index,
+    }
+    with open(os.path.join(folder, 'index.json'), "w", encoding = 'utf-8') as f:
+        json.dump(index, f, separators = (',', ':'), ensure_ascii = False)
+    with open(os.path.join(folder, 'index.html'), "w", encoding = 'utf-8') as f:
+        f.write(html_page)
+
+    return {'courses': int(len(df)), 'chunks': sum(len(names) for names in chunk_index.values()), 'bytes': n_bytes}
+
+
+# The page of the map: it loads index.json, then the chunks of the visible area at the current zoom
+html_page = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>MSc courses</title>
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<link rel="stylesheet" href="https://unpkg.com/leaflet@1.9.4/dist/leaflet.css">
+<script src="https://unpkg.com/leaflet@1.9.4/dist/leaflet.js"></script>
+<style>
+html, body, #map { height: 100%; margin: 0; }
+.cluster { border-radius: 50%; color: white; font: bold 12px sans-serif; text-align: center; line-height: 36px; opacity: 0.85; }
+.legend { background: white; padding: 6px 8px; font: 12px sans-serif; }
+.legend i { display: inline-block; width: 10px; height: 10px; margin-right: 6px; border-radius: 50%; }
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+var map = L.map('map', {preferCanvas: true, zoomControl: true}).setView([51.7548, 2], 5);
+L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {attribution: '&copy; OpenStreetMap contributors', maxZoom: 18}).addTo(map);
+
+var index = null, cache = {}, layer = L.layerGroup().addTo(map), shown = {}, shownZoom = null;
+
+function escape(text) {
+  return String(text === null || text === undefined ? '' : text).replace(/[&<>"']/g, function (c) {
+    return {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c];
+  });
+}
+
+function course(p) {
+  return '<b>' + escape(p.n) + '</b><br>' + escape(p.u) + '<br>Annual fees: ' + (p.f === null ? 'n/a' : escape(p.f) + ' &euro;') +
+    (p.l ? '<br><a href="' + escape(p.l) + '" target="_blank">Link</a>' : '');
+}
+
+function feature(f) {
+  var p = f.properties, latlng = [f.geometry.coordinates[1], f.geometry.coordinates[0]];
+  if (p.k === undefined) {
+    return L.circleMarker(latlng, {radius: 6, color: index.colors[p.c], fillOpacity: 0.8}).bindPopup(function () { return course(p); });
+  }
+  // The color of a cluster is the one of its most frequent fee category
+  var best = 0;
+  for (var i = 1; i < p.fc.length; i++) { if (p.fc[i] > p.fc[best]) best = i; }
+  var size = 36 + Math.min(4 * Math.log2(p.k), 24);
+  var marker = L.marker(latlng, {icon: L.divIcon({html: '<div class="cluster" style="background:' + index.colors[best] +
+    ';width:' + size + 'px;height:' + size + 'px;line-height:' + size + 'px">' + p.k + '</div>', className: '', iconSize: [size, size]})});
+  if (p.e !== null) {
+    marker.on('click', function () { map.setView(latlng, p.e); });
+  } else {
+    marker.bindPopup(function () {
+      return p.items.map(course).join('<hr>') + (p.k > p.items.length ? '<hr>... and ' + (p.k - p.items.length) + ' more' : '');
+    }, {maxHeight: 300});
+  }
+  return marker;
+}
+
+function update() {
+  if (index === null) return;
+  var zoom = Math.max(index.min_zoom, Math.min(index.max_zoom, map.getZoom()));
+  if (zoom !== shownZoom) { layer.clearLayers(); shown = {}; shownZoom = zoom; }
+  var available = new Set(index.chunks[zoom] || []);
+  var bounds = map.getBounds();
+  var northWest = map.project(bounds.getNorthWest(), zoom).divideBy(index.chunk_size).floor();
+  var southEast = map.project(bounds.getSouthEast(), zoom).divideBy(index.chunk_size).floor();
+  for (var cx = northWest.x; cx <= southEast.x; cx++) {
+    for (var cy = northWest.y; cy <= southEast.y; cy++) {
+      var name = cx + '_' + cy, key = zoom + '/' + name;
+      if (!available.has(name) || shown[key]) continue;
+      shown[key] = true;
+      load(zoom, key);
+    }
+  }
+}
+
+function load(zoom, key) {
+  var request = cache[key] || (cache[key] = fetch('chunks/' + key + '.json').then(function (r) { return r.json(); }));
+  request.then(function (data) {
+    if (zoom !== shownZoom) return;
+    data.features.forEach(function (f) { layer.addLayer(feature(f)); });
+  });
+}
+
+fetch('index.json').then(function (r) { return r.json(); }).then(function (data) {
+  index = data;
+  if (index.bounds) map.fitBounds(index.bounds);
+  var legend = L.control({position: 'bottomright'});
+  legend.onAdd = function () {
+    var div = L.DomUtil.create('div', 'legend');
+    div.innerHTML = index.categories.map(function (c, i) { return '<i style="background:' + index.colors[i] + '"></i>' + escape(c); }).join('<br>');
+    return div;
+  };
+  legend.addTo(map);
+  map.on('moveend', update);
+  update();
+});
+</script>
+</body>
+</html>
+"""
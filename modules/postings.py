@@ -0,0 +1,98 @@
+from array import array
+from bisect import bisect_left
+
+# Type code of the arrays used to store the posting lists (signed 64 bit integers)
+typecode = 'q'
+
+
+def to_array(postings) -> array:
+    """
+    This function converts a sorted posting list into a compact array of integers
+    Args:
+        postings (list): The sorted list of document ids
+    Returns:
+        array: The posting list as an array of integers
+    """
+    return array(typecode, postings)
+
+
+def gallop(postings, target: int, lo: int = 0) -> int:
+    """
+    This function returns the position of the first element of the sorted posting list
+    which is greater or equal to target, starting the search from the position lo.
+    It doubles the step until it jumps over the target (galloping or exponential search)
+    and then it runs a binary search only in the last step, so the cost depends on
+    the distance from lo and not on the length of the list
+    Args:
+        postings (array): The sorted posting list
+        target (int): The document id to search
+        lo (int): The position where the search starts
+    Returns:
+        int: The position of the first element >= target (len(postings) if there is none)
+    """
+    n = len(postings)
+    if lo >= n or postings[lo] >= target:
+        return lo
+
+    step = 1
+    hi = lo + 1
+    while hi < n and postings[hi] < target:
+        lo = hi
+        step *= 2
+        hi = lo + step
+
+    return bisect_left(postings, target, lo + 1, min(hi, n))
+
+
+def intersect(short, long) -> array:
+    """
+    This function intersects two sorted posting lists. For each element of the shortest
+    list it gallops forward in the longest one, so when the lists have very different
+    lengths most of the longest list is skipped
+    Args:
+        short (array): The shortest sorted posting list
+        long (array): The longest sorted posting list
+    Returns:
+        array: The sorted intersection of the two lists
+    """
+    if len(short) > len(long):
+        short, long = long, short
+
+    result = array(typecode)
+    position = 0
+    n = len(long)
+    for doc_id in short:
+        position = gallop(long, doc_id, position)
+        if position == n:
+            # All the remaining elements of the shortest list are greater than the ones
+            # of the longest list, so there can not be other matches
+            break
+        if long[position] == doc_id:
+            result.append(doc_id)
+            position += 1
+
+    return result
+
+
+def intersect_all(lst_postings: list) -> array:
+    """
+    This function intersects many sorted posting lists (conjunctive query).
+    The lists are processed from the shortest to the longest, so that the intermediate
+    result is as small as possible, and the computation stops as soon as it becomes empty
+    Args:
+        lst_postings (list): The sorted posting lists
+    Returns:
+        array: The sorted intersection of all the lists
+    """
+    if len(lst_postings) == 0:
+        return array(typecode)
+
+    lst_postings = sorted(lst_postings, key = len)
+
+    result = to_array(lst_postings[0])
+    for postings in lst_postings[1:]:
+        if len(result) == 0:
+            break
+        result = intersect(result, postings)
+
+    return result
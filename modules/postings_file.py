@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import os
+import mmap
+from functools import lru_cache
+
+# Binary format of the weighted inverted indexes (engine_v2 and engine_v3).
+# The file is made of three parts:
+#     header: the magic string and the number of terms
+#     dictionary: one fixed size record for each term, sorted by term_id, with the number of
+#         documents, the offsets and sizes of its document ids and impacts, and the scale of its impacts
+#     postings: for each term the document ids (gaps between consecutive ids encoded as varint,
+#         7 bits for each byte) followed by the impacts (the weights quantized to 8 bits)
+# The file is opened with mmap, so the operating system reads only the pages of the terms that are
+# used by the queries, and all the processes that open the same file share the same memory.
+# The impacts of a term are quantized as round(weight / scale) with scale = maximum weight / 255,
+# so the error of a weight is at most 1 / 510 of the maximum weight of its term. The weights smaller
+# than scale / 2 are raised to the smallest code (1), so that they are not lost, and their error
+# can reach 1 / 255 of the maximum weight.
+# numpy is imported only inside the functions, so that importing the engines is fast
+
+magic = b'ADMPOST1'
+header_size = 16
+
+# The number of decoded posting lists kept in memory by each opened file
+decoded_cache_size = 4096
+
+
+def dictionary_dtype():
+    """
+    This function returns the numpy type of the records of the dictionary of the terms
+    Returns:
+        np.dtype: The type of a record
+    """
+    import numpy as np
+
+    return np.dtype([('term_id', '<i8'), ('n_postings', '<i8'), ('docs_offset', '<i8'), ('docs_size', '<i8'),
+                     ('impacts_offset', '<i8'), ('scale', '<f8')])
+
+
+def encode_varint(values) -> bytes:
+    """
+    This function encodes non negative integers as varint: 7 bits in each byte,
+    with the highest bit set on all the bytes of a number except the last one
+    Args:
+        values (np.ndarray): The integers
+    Returns:
+        bytes: The encoded integers
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype = np.uint64)
+    if len(values) == 0:
+        return b''
+
+    # The number of bytes of each integer
+    n_bytes = np.ones(len(values), dtype = np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        n_bytes += rest > 0
+        rest >>= np.uint64(7)
+
+    offsets = np.concatenate(([0], np.cumsum(n_bytes)[:-1]))
+    encoded = np.zeros(int(n_bytes.sum()), dtype = np.uint8)
+    for j in range(int(n_bytes.max())):
+        mask = n_bytes > j
+        byte = (values[mask] >> np.uint64(7 * j)) & np.uint64(0x7f)
+        more = (n_bytes[mask] > j + 1).astype(np.uint64) << np.uint64(7)
+        encoded[offsets[mask] + j] = (byte | more).astype(np.uint8)
+    return encoded.tobytes()
+
+
+def decode_varint(buffer):
+    """
+    This function decodes the integers encoded by encode_varint()
+    Args:
+        buffer (np.ndarray): The encoded bytes (as uint8)
+    Returns:
+        np.ndarray: The integers
+    """
+    import numpy as np
+
+    if len(buffer) == 0:
+        return np.zeros(0, dtype = np.int64)
+
+    # The last byte of each integer is the one without the highest bit
+    ends = np.flatnonzero(buffer < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # The position of each byte inside its integer
+    positions = np.arange(len(buffer)) - np.repeat(starts, ends - starts + 1)
+    parts = (buffer & 0x7f).astype(np.int64) << (7 * positions)
+    return np.add.reduceat(parts, starts)
+
+
+def quantize(weights) -> tuple:
+    """
+    This function quantizes the weights of a posting list to 8 bits
+    Args:
+        weights (np.ndarray): The (positive) weights
+    Returns:
+        tuple: The quantized weights (uint8, at least 1) and the scale to convert them back
+    """
+    import numpy as np
+
+    weights = np.asarray(weights, dtype = np.float64)
+    maximum = weights.max() if len(weights) > 0 else 0.0
+    if maximum <= 0:
+        return np.ones(len(weights), dtype = np.uint8), 0.0
+    scale = maximum / 255
+    return np.clip(np.rint(weights / scale), 1, 255).astype(np.uint8), scale
+
+
+def dequantized(matrix):
+    """
+    This function returns a copy of a documents x vocabulary matrix with the weights replaced
+    by their quantized values (as read from the postings file), e.g. to compute the maximum impacts
+    Args:
+        matrix (scipy.sparse matrix): The documents x vocabulary matrix
+    Returns:
+        scipy.sparse.csr_matrix: The matrix with the quantized weights
+    """
+    import numpy as np
+
+    csc = matrix.tocsc(copy = True)
+    columns = np.repeat(np.arange(csc.shape[1]), np.diff(csc.indptr))
+    maxima = np.zeros(csc.shape[1])
+    np.maximum.at(maxima, columns, csc.data)
+    scales = maxima[columns] / 255
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        codes = np.clip(np.rint(csc.data / scales), 1, 255)
+    csc.data = np.where(scales > 0, codes * scales, csc.data)
+    return csc.tocsr()
+
+
+def scoring_matrix(matrix, inverted_index):
+    """
+    This function returns the documents x vocabulary matrix with the same weights of an inverted index:
+    the quantized ones if the index is read from a postings file, so that the batch scoring
+    (e.g. search_many() of the engines) ranks the documents exactly as the queries on the index
+    Args:
+        matrix (scipy.sparse matrix): The documents x vocabulary matrix with the exact weights
+        inverted_index (dict): The inverted index used by the queries
+    Returns:
+        scipy.sparse.csr_matrix: The matrix
+    """
+    if isinstance(inverted_index, PostingsFile):
+        return dequantized(matrix)
+    return matrix
+
+
+def write(path: str, inverted_index: dict) -> int:
+    """
+    This function writes a weighted inverted index in the binary format.
+    The file is written in a temporary file that then replaces the old one, so the processes
+    that have the old file opened keep reading it until they open the new one
+    Args:
+        path (str): The path of the file
+        inverted_index (dict): The inverted index {term_id: (document ids, weights)}
+            with the documents sorted by id (see scoring.to_arrays())
+    Returns:
+        int: The size of the file in bytes
+    """
+    import numpy as np
+
+    term_ids = sorted(inverted_index)
+    dictionary = np.zeros(len(term_ids), dtype = dictionary_dtype())
+    offset = header_size + dictionary.nbytes
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, "wb") as f:
+        f.seek(offset)
+        for i, term_id in enumerate(term_ids):
+            doc_ids, weights = inverted_index[term_id]
+            doc_ids = np.asarray(doc_ids, dtype = np.int64)
+            # The first document id is stored as it is, then only the gaps
+            docs = encode_varint(np.diff(doc_ids, prepend = 0))
+            impacts, scale = quantize(weights)
+            f.write(docs)
+            f.write(impacts.tobytes())
+            dictionary[i] = (term_id, len(doc_ids), offset, len(docs), offset + len(docs), scale)
+            offset += len(docs) + len(impacts)
+
+        f.seek(0)
+        f.write(magic)
+        f.write(np.array([len(term_ids)], dtype = '<i8').tobytes())
+        f.write(dictionary.tobytes())
+    os.replace(tmp_path, path)
+
+    return offset
+
+
+def load(f) -> PostingsFile:
+    """
+    This function opens a postings file from an opened binary file (the loader for the file_cache)
+    Args:
+        f (file): The opened file
+    Returns:
+        PostingsFile: The memory mapped postings
+    """
+    return PostingsFile(f)
+
+
+class PostingsFile:
+    """
+    Weighted inverted index read from a memory mapped postings file.
+    It behaves as the dictionary {term_id: (document ids, weights)} used by the scoring module,
+    but each posting list is decoded only when it is requested (and then kept in a small cache)
+    """
+
+    def __init__(self, f):
+        """
+        Args:
+            f (file): The opened binary file (the mapping remains valid after the file is closed)
+        """
+        import numpy as np
+
+        self.buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        if self.buffer[:len(magic)] != magic:
+            raise ValueError("Not a postings file")
+        n_terms = int(np.frombuffer(self.buffer, dtype = '<i8', count = 1, offset = len(magic))[0])
+        self.dictionary = np.frombuffer(self.buffer, dtype = dictionary_dtype(), count = n_terms, offset = header_size)
+        self.term_ids = self.dictionary['term_id']
+        self.decoded = lru_cache(maxsize = decoded_cache_size)(self.decode)
+
+    def find(self, term_id) -> int:
+        """
+        This function returns the position of a term in the dictionary (None if it is not in the index)
+        """
+        import numpy as np
+
+        if not isinstance(term_id, (int, np.integer)):
+            return None
+        position = int(np.searchsorted(self.term_ids, term_id))
+        if position < len(self.term_ids) and self.term_ids[position] == term_id:
+            return position
+        return None
+
+    def decode(self, position: int) -> tuple:
+        """
+        This function decodes the posting list of the term in a position of the dictionary
+        Returns:
+            tuple: The document ids and the weights (as numpy arrays)
+        """
+        import numpy as np
+
+        record = self.dictionary[position]
+        docs = np.frombuffer(self.buffer, dtype = np.uint8, count = int(record['docs_size']), offset = int(record['docs_offset']))
+        impacts = np.frombuffer(self.buffer, dtype = np.uint8, count = int(record['n_postings']), offset = int(record['impacts_offset']))
+        doc_ids = np.cumsum(decode_varint(docs))
+        return doc_ids, impacts * float(record['scale'])
+
+    def __getitem__(self, term_id) -> tuple:
+        position = self.find(term_id)
+        if position is None:
+            raise KeyError(term_id)
+        return self.decoded(position)
+
+    def get(self, term_id, default = None):
+        position = self.find(term_id)
+        return self.decoded(position) if position is not None else default
+
+    def __contains__(self, term_id) -> bool:
+        return self.find(term_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.term_ids)
+
+    def __iter__(self):
+        return (int(term_id) for term_id in self.term_ids)
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        return ((int(term_id), self.decode(position)) for position, term_id in enumerate(self.term_ids))
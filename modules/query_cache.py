@@ -0,0 +1,95 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Cache of the results of the queries, with a LRU (least recently used) eviction policy
+    and a TTL (time to live) for each entry.
+    The keys are built by the search engines from the preprocessed words of the query,
+    the number of results and the generation of the index (the signature of its files),
+    so when the index is rebuilt the old results are never returned again.
+    All the methods are protected by a lock, so the cache can be shared by more threads
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 600):
+        """
+        Args:
+            max_size (int): The maximum number of results kept in the cache
+            ttl (float): The number of seconds after which a result expires (None for no expiration)
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key) -> tuple:
+        """
+        This function looks for a result in the cache
+        Args:
+            key (tuple): The key of the query
+        Returns:
+            tuple: A pair (found, result), where found is False if the result
+                is not in the cache or it is expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expiration, result = entry
+                if expiration is None or expiration > time.monotonic():
+                    # Marking the entry as the most recently used
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return True, result
+                del self.entries[key]
+
+            self.misses += 1
+            return False, None
+
+    def put(self, key, result) -> None:
+        """
+        This function saves a result in the cache, removing the least recently used
+        results if the cache is full
+        Args:
+            key (tuple): The key of the query
+            result: The result of the query
+        Returns:
+            None
+        """
+        expiration = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self.entries[key] = (expiration, result)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """
+        This function removes all the results from the cache (e.g. when the index is rebuilt)
+        Returns:
+            None
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """
+        This function returns the statistics of the cache
+        Returns:
+            dict: The number of hits, misses, evictions, the hit rate and the current size
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+                'size': len(self.entries),
+            }
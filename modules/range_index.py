@@ -0,0 +1,320 @@
+from __future__ import annotations
+
+import os
+import io
+import regex as re
+
+from . import file_cache
+
+# Numeric range index of the fees (converted in EUR) and of the duration (in months) of the courses.
+# For each field the values of the documents are sorted together with the ids of their documents,
+# so the documents with the value in a range [low, high] are a contiguous slice of the sorted
+# values, found with two binary searches (np.searchsorted) instead of a mask over the whole dataset.
+# The documents without a value (e.g. the fees are not published) are not indexed.
+# The index is saved in the file range_index.npz
+# numpy is imported only inside the functions, so that importing the module is fast
+
+path_range_index = 'data/range_index.npz'
+
+# The indexed fields: the fees in EUR and the duration in months
+range_fields = ['feesEUR', 'duration']
+
+# The number of months of each unit of the durations
+months_per_unit = {'year': 12, 'yr': 12, 'month': 1, 'mth': 1, 'semester': 6, 'trimester': 3, 'quarter': 3,
+                   'week': 12 / 52, 'wk': 12 / 52, 'day': 12 / 365}
+number_words = {'half': 0.5, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6,
+                'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'thirteen': 13,
+                'fourteen': 14, 'fifteen': 15, 'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19}
+
+# The currency symbols of the fees (the ones of the notebook and of the currency module)
+currency_symbols = '€$£'
+
+# A number written with digits or with a whole word (so that 'eight' does not match inside 'eighteen')
+number_pattern = r'(\d+(?:[.,]\d+)?|\b(?:' + '|'.join(number_words) + r')\b)'
+# The runs of digits and separators in the text of a duration, each one must be a valid number
+duration_token_pattern = r'\d+(?:[.,]\d+)*'
+unit_pattern = r'(' + '|'.join(sorted(months_per_unit, key = len, reverse = True)) + r')s?\b'
+# A number (or a range of numbers, e.g. '1-2 years') followed by a unit of time
+duration_pattern = re.compile(r'\b' + number_pattern + r'(?:\s*(?:-|to)\s*' + number_pattern + r')?\s*' + unit_pattern, re.IGNORECASE)
+# An amount of money: the digits with the thousands separators (e.g. '9,250' or '12.500'), an optional decimal
+# part of 1 or 2 digits (e.g. '9,250.00') and, in the ranges, an optional 'k' for thousands (e.g. '7.5k')
+amount_pattern = re.compile(r"(?P<integer>\d{1,3}(?P<separator>[.,' ])\d{3}(?:(?P=separator)\d{3})*|\d+)"
+                            r"(?:(?!(?P=separator))[.,](?P<decimals>\d{1,2}))?(?:\s?(?P<thousands>k))?")
+# The runs of digits and separators in the text of the fees, each one must be a valid amount
+amount_token_pattern = r"\d+(?:[.,' ]\d+)*(?:\s?k\b)?"
+# An amount of money preceded or followed by its currency symbol (as in the notebook)
+fees_pattern = re.compile(r"([" + re.escape(currency_symbols) + r"])\s*(\d+(?:[.,']\d+)*)|(\d+(?:[.,']\d+)*)\s*([" + re.escape(currency_symbols) + r"])")
+
+
+def parse_number(text: str) -> float:
+    """
+    This function converts a number written with digits or with a word (e.g. 'two') into a float
+    Args:
+        text (str): The number
+    Returns:
+        float: The number
+    Raises:
+        ValueError: If the text is not a number (e.g. '1.5.2')
+    """
+    text = text.lower()
+    if text in number_words:
+        return float(number_words[text])
+    if not re.fullmatch(r'\d+(?:[.,]\d+)?', text):
+        raise ValueError(f"Invalid number {text}")
+    return float(text.replace(',', '.'))
+
+
+def parse_amount(text: str) -> float:
+    """
+    This function converts an amount of money into a float, e.g.
+        '9,250' -> 9250, '9,250.00' -> 9250, '12.500,50' -> 12500.5, '7.5k' -> 7500
+    Args:
+        text (str): The amount
+    Returns:
+        float: The amount
+    Raises:
+        ValueError: If the text is not a valid amount (e.g. '1,2,3')
+    """
+    match = amount_pattern.fullmatch(text.lower())
+    if match is None:
+        raise ValueError(f"Invalid amount {text}")
+    value = float(re.sub(r"[.,' ]", "", match.group('integer')))
+    if match.group('decimals') is not None:
+        value += float('0.' + match.group('decimals'))
+    return value * 1000 if match.group('thousands') else value
+
+
+def parse_duration(text: str) -> float:
+    """
+    This function returns the duration of a course in months, e.g.
+        '1 year' -> 12, '18 months' -> 18, 'Two years part time' -> 24, '1 year full time, 2 years part time' -> 12
+    When the text contains more durations (e.g. full time and part time) the shortest one is returned
+    Args:
+        text (str): The duration, as written in the 'duration' column
+    Returns:
+        float: The duration in months (None if no duration is found)
+    """
+    if not isinstance(text, str):
+        return None
+    durations = [parse_number(match.group(1)) * months_per_unit[match.group(3).lower()]
+                 for match in duration_pattern.finditer(text)]
+    return min(durations) if len(durations) > 0 else None
+
+
+def parse_fees(text: str) -> tuple:
+    """
+    This function returns the fees of a course and their currency, i.e. the highest amount
+    of money in the text preceded or followed by €, $ or £ (as in the notebook).
+    The thousands separators are removed and the decimal part is dropped, e.g. '£9,250.00 per year' -> 9250
+    Args:
+        text (str): The fees, as written in the 'fees' column
+    Returns:
+        tuple: The amount and the currency symbol (None, None if no amount is found)
+    """
+    if not isinstance(text, str):
+        return None, None
+    amounts = []
+    for match in fees_pattern.finditer(text):
+        symbol = match.group(1) or match.group(4)
+        try:
+            amount = parse_amount(match.group(2) or match.group(3))
+        except ValueError:
+            # The digits are not a valid amount (e.g. '1,2,3'), so they are ignored
+            continue
+        amounts.append((float(int(amount)), symbol))
+    return max(amounts) if len(amounts) > 0 else (None, None)
+
+
+def fees_to_EUR(text: str) -> float:
+    """
+    This function returns the fees of a course converted in EUR (see the currency module)
+    Args:
+        text (str): The fees, as written in the 'fees' column
+    Returns:
+        float: The fees in EUR (None if there are no fees or the currency can not be converted)
+    """
+    amount, symbol = parse_fees(text)
+    if amount is None:
+        return None
+    if symbol == '€':
+        return amount
+    # The conversion rates are downloaded only when a currency different from EUR is found
+    from . import currency
+    return currency.convert_to_EUR(amount, symbol)
+
+
+def build(df: pd.DataFrame) -> dict:
+    """
+    This function creates the range index of the fees and of the duration of the courses
+    and saves it in the file range_index.npz.
+    The fees are read from the column 'feesEUR' if it has already been computed (as in the notebook),
+    otherwise they are extracted from the column 'fees' and converted in EUR
+    Args:
+        df (pd.DataFrame): The dataset, indexed by document id
+    Returns:
+        dict: The range index, as returned by get_range_index()
+    """
+    import numpy as np
+    import pandas as pd
+
+    if 'feesEUR' in df.columns:
+        fees = pd.to_numeric(df['feesEUR'].replace('', np.nan), errors = 'coerce')
+    else:
+        fees = df['fees'].apply(fees_to_EUR)
+    values = {
+        'feesEUR': np.asarray(fees, dtype = np.float64),
+        'duration': np.asarray(df['duration'].apply(parse_duration), dtype = np.float64),
+    }
+
+    doc_ids = np.asarray(df.index, dtype = np.int64)
+    arrays = {}
+    for field in range_fields:
+        present = ~np.isnan(values[field])
+        # Sorting by value (and by document id for the same value)
+        order = np.lexsort((doc_ids[present], values[field][present]))
+        arrays[field + '_values'] = values[field][present][order]
+        arrays[field + '_ids'] = doc_ids[present][order]
+
+    os.makedirs(os.path.dirname(path_range_index), exist_ok = True)
+    with open(path_range_index + '.tmp', "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(path_range_index + '.tmp', path_range_index)
+
+    # Keeping the index in memory, so that it is not read again from the file
+    range_index = {field: (arrays[field + '_values'], arrays[field + '_ids']) for field in range_fields}
+    file_cache.store(path_range_index, range_index)
+    return range_index
+
+
+def load(f) -> dict:
+    """
+    This function reads the range index from the opened range_index.npz file (the loader for the file_cache)
+    Args:
+        f (file): The opened binary file
+    Returns:
+        dict: The range index
+    """
+    import numpy as np
+
+    with np.load(io.BytesIO(f.read())) as arrays:
+        return {field: (arrays[field + '_values'], arrays[field + '_ids']) for field in range_fields}
+
+
+def get_range_index() -> dict:
+    """
+    This function loads the range index from the range_index.npz file
+    The file is read only the first time (or when it changes on disk)
+    If the file does not exists it returns None
+    Returns:
+        dict: For each field the sorted values and the ids of their documents
+    """
+    try:
+        return file_cache.load(path_range_index, load, mode = "rb")
+    except Exception as e:
+        return None
+
+
+def generation() -> tuple:
+    """
+    This function returns the generation of the range index, used in the keys of the result caches
+    Returns:
+        tuple: The signature of the range_index.npz file
+    """
+    return (file_cache.file_signature(path_range_index),)
+
+
+def parse_range(field: str, text: str) -> tuple:
+    """
+    This function converts a range predicate written as text into the bounds of the range, e.g.
+        '5,000-10,000 €' -> (5000, 10000), '<= 12 months' -> (None, 12), 'at least 1 year' -> (12, None)
+    The fees are in EUR (the amounts in $ or £ are converted, 'k' means thousands), the durations in months
+    (the default unit) unless another unit is written. The strict bounds ('<', '>', 'under', 'over')
+    exclude the value itself
+    Args:
+        field (str): The field ('feesEUR' or 'duration')
+        text (str): The predicate
+    Returns:
+        tuple: The lowest and the highest accepted values (None if there is no bound)
+    Raises:
+        ValueError: If the predicate does not contain any value or contains a value that is not valid
+    """
+    import numpy as np
+
+    text = ' '.join(text.lower().replace('≤', '<=').replace('≥', '>=').replace('–', '-').replace('—', '-').split())
+
+    if field == 'duration':
+        # Each run of digits must be a number, e.g. '1.5.2 years' is not valid
+        for token in re.findall(duration_token_pattern, text):
+            parse_number(token)
+        numbers = [parse_number(value) for value in re.findall(number_pattern, text)]
+        match = re.search(unit_pattern, text)
+        numbers = [value * (months_per_unit[match.group(1)] if match else 1) for value in numbers]
+    else:
+        numbers = [parse_amount(token) for token in re.findall(amount_token_pattern, text)]
+        symbol = re.search(r'\p{Sc}', text)
+        if symbol and symbol.group(0) not in currency_symbols:
+            raise ValueError(f"Unknown currency {symbol.group(0)}")
+        if symbol and symbol.group(0) != '€' and len(numbers) > 0:
+            from . import currency
+            numbers = [currency.convert_to_EUR(value, symbol.group(0)) for value in numbers]
+            if None in numbers:
+                raise ValueError(f"Can not convert the currency {symbol.group(0)}")
+    if len(numbers) == 0:
+        raise ValueError(f"No value in the range {text}")
+
+    if len(numbers) >= 2:
+        return min(numbers[:2]), max(numbers[:2])
+    value = numbers[0]
+    if re.match(r'(<=|=<|up to|max|at most)', text):
+        return None, value
+    if re.match(r'(<|under|less than|below)', text):
+        return None, float(np.nextafter(value, -np.inf))
+    if re.match(r'(>=|=>|from|min|at least)', text) or text.endswith('+'):
+        return value, None
+    if re.match(r'(>|over|more than|above)', text):
+        return float(np.nextafter(value, np.inf)), None
+    return value, value
+
+
+def as_range(field: str, value) -> tuple:
+    """
+    This function returns the bounds of a range filter, given as text (see parse_range())
+    or as a pair (low, high)
+    Args:
+        field (str): The field
+        value: The range
+    Returns:
+        tuple: The lowest and the highest accepted values (None if there is no bound)
+    """
+    if isinstance(value, (list, tuple)) and len(value) == 1:
+        value = value[0]
+    if isinstance(value, str):
+        return parse_range(field, value)
+    low, high = value
+    return (None if low is None else float(low)), (None if high is None else float(high))
+
+
+def range_ids(field: str, low: float = None, high: float = None):
+    """
+    This function returns the documents with the value of a field in the range [low, high]
+    Args:
+        field (str): The field ('feesEUR' or 'duration')
+        low (float): The lowest accepted value (if None, no lower bound)
+        high (float): The highest accepted value (if None, no upper bound)
+    Returns:
+        np.ndarray: The sorted ids of the documents (None if the range index has not been computed yet)
+    Raises:
+        ValueError: If the field is not in the range index
+    """
+    import numpy as np
+
+    range_index = get_range_index()
+    if range_index is None:
+        return None
+    if field not in range_index:
+        raise ValueError(f"Unknown range field {field}")
+
+    values, doc_ids = range_index[field]
+    start = 0 if low is None else int(np.searchsorted(values, low, side = 'left'))
+    end = len(values) if high is None else int(np.searchsorted(values, high, side = 'right'))
+    return np.sort(doc_ids[start:end])
@@ -0,0 +1,409 @@
+from __future__ import annotations
+
+import json
+import heapq
+from collections import Counter
+
+from . import engine_v1
+from . import sparse_matrix
+
+# Functions shared by the ranked engines (engine_v2 and engine_v3).
+# The weighted posting lists are kept in memory as pairs of numpy arrays
+# (sorted document ids, weights), so that the scores of a query are computed
+# with vectorized operations touching only the posting lists of its words.
+# numpy is imported only inside the functions, so that importing the engines is fast
+
+
+def load_postings(f) -> dict:
+    """
+    This function reads a weighted inverted index from an opened json file in the format
+    {term_id: [[document1, weight1], [document2, weight2], ...]}
+    converting each posting list into a pair of numpy arrays sorted by document id
+    Args:
+        f (file): The opened json file
+    Returns:
+        dict: The inverted index {term_id: (document ids, weights)}
+    """
+    return to_arrays(json.load(f))
+
+
+def to_arrays(inverted_index: dict) -> dict:
+    """
+    This function converts the posting lists of a weighted inverted index
+    into pairs of numpy arrays (document ids, weights) sorted by document id
+    Args:
+        inverted_index (dict): The inverted index {term_id: [(document1, weight1), ...]}
+    Returns:
+        dict: The inverted index {term_id: (document ids, weights)}
+    """
+    import numpy as np
+
+    result = {}
+    for term_id, lst_tuple in inverted_index.items():
+        doc_ids = np.array([item[0] for item in lst_tuple], dtype = np.int64)
+        weights = np.array([item[1] for item in lst_tuple], dtype = np.float64)
+        order = np.argsort(doc_ids, kind = 'stable')
+        result[int(term_id)] = (doc_ids[order], weights[order])
+    return result
+
+
+def query_weights(words: list, inverted_index: dict, n_documents: int, vocabulary: dict = None) -> dict:
+    """
+    This function computes the tf-idf weights of the words of the query,
+    without using the function tfidf_vectorizer.transform() of sklearn:
+        weight = tf_{query} * (1 + log((N + 1) / (1 + df)))
+    where df is the number of documents that contain the word (the length of its posting list)
+    The words that are not in the vocabulary (or in the index) are ignored
+    Args:
+        words (list): The preprocessed words of the query
+        inverted_index (dict): The inverted index {term_id: (document ids, weights)}
+        n_documents (int): The number of documents N
+        vocabulary (dict): The mapping from the words to the term_ids of the index
+            (if None, the vocabulary of the engine_v1 module)
+    Returns:
+        dict: The weight of each term_id of the query
+    """
+    import numpy as np
+
+    if vocabulary is None:
+        vocabulary = engine_v1.get_vocabulary()
+    if vocabulary is None:
+        return {}
+
+    counts = Counter(vocabulary[word.lower()] for word in words if word.lower() in vocabulary)
+
+    # The 1s are added to avoid division by 0
+    return {term_id: count * (1 + np.log((n_documents + 1) / (1 + len(inverted_index[term_id][0]))))
+            for term_id, count in counts.items() if term_id in inverted_index}
+
+
+def cosine_top_k(words: list, inverted_index: dict, norms, k: int = 10, candidates = None, vocabulary: dict = None) -> list:
+    """
+    This function returns the k documents with the highest cosine similarity with the query.
+    The scores are accumulated term by term into a vector (one element for each candidate),
+    then divided by the norms of the documents and of the query, and the k best documents
+    are selected with a partial sort (np.argpartition) instead of sorting all of them
+    Args:
+        words (list): The preprocessed words of the query
+        inverted_index (dict): The inverted index {term_id: (document ids, weights)}
+        norms (pd.DataFrame): The norm of each document (column 'norm', indexed by document id)
+        k (int): The number of documents to return
+        candidates (array): The sorted ids of the candidate documents
+            (if None, all the documents that contain at least one word of the query)
+        vocabulary (dict): The mapping from the words to the term_ids of the index (see query_weights())
+    Returns:
+        list: The pairs (document id, similarity) sorted by decreasing similarity
+            (None if none of the words is in the vocabulary)
+    """
+    import numpy as np
+
+    weights = query_weights(words, inverted_index, len(norms), vocabulary)
+    if len(weights) == 0:
+        return None
+    query_norm = np.linalg.norm(list(weights.values()))
+
+    if candidates is not None:
+        doc_ids = np.asarray(candidates, dtype = np.int64)
+        scores = np.zeros(len(doc_ids))
+        if len(doc_ids) == 0:
+            return []
+        for term_id, weight in weights.items():
+            term_doc_ids, term_weights = inverted_index[term_id]
+            if len(term_doc_ids) == 0:
+                continue
+            # Finding the position of each candidate in the posting list
+            # (the candidates are usually much less than the documents of the posting list)
+            positions = np.searchsorted(term_doc_ids, doc_ids)
+            positions[positions == len(term_doc_ids)] = 0
+            mask = term_doc_ids[positions] == doc_ids
+            scores[mask] += weight * term_weights[positions[mask]]
+    else:
+        all_doc_ids = np.concatenate([inverted_index[term_id][0] for term_id in weights])
+        all_scores = np.concatenate([weight * inverted_index[term_id][1] for term_id, weight in weights.items()])
+        doc_ids, inverse = np.unique(all_doc_ids, return_inverse = True)
+        scores = np.bincount(inverse, weights = all_scores, minlength = len(doc_ids))
+
+    # Dividing by the norms of the documents and of the query
+    doc_norms = lookup_norms(norms, doc_ids)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        similarities = scores / (doc_norms * query_norm)
+    similarities[~np.isfinite(similarities)] = 0
+
+    return top_k(doc_ids, similarities, k)
+
+
+def top_k(doc_ids, similarities, k: int) -> list:
+    """
+    This function selects the k documents with the highest (positive) similarity
+    with a partial sort, and then sorts only them. The ties are broken by document id
+    Args:
+        doc_ids (np.ndarray): The ids of the documents
+        similarities (np.ndarray): The similarity of each document
+        k (int): The number of documents to return
+    Returns:
+        list: The pairs (document id, similarity) sorted by decreasing similarity
+    """
+    import numpy as np
+
+    positive = similarities > 0
+    doc_ids, similarities = doc_ids[positive], similarities[positive]
+
+    if len(similarities) > k:
+        # All the documents with the k-th similarity are kept, otherwise the partial sort
+        # would choose among the ties at random and not by document id
+        kth = -np.partition(-similarities, k - 1)[k - 1]
+        best = similarities >= kth
+        doc_ids, similarities = doc_ids[best], similarities[best]
+
+    order = np.lexsort((doc_ids, -similarities))[:k]
+    return [(int(doc_ids[i]), float(similarities[i])) for i in order]
+
+
+def build_heap(df, results: list) -> list:
+    """
+    This function materializes the rows of the k best documents and builds the heap
+    returned by the search engines, with elements (-similarity, [id] + row values + [similarity])
+    Since we have a min heap we need to add the negative similarity score to get the max heap
+    Args:
+        df (pd.DataFrame): The dataset
+        results (list): The pairs (document id, similarity)
+    Returns:
+        list: The heap
+    """
+    heap = []
+    if len(results) == 0:
+        return heap
+
+    rows = df.loc[[doc_id for doc_id, _ in results]]
+    for (doc_id, similarity), values in zip(results, rows.values.tolist()):
+        heapq.heappush(heap, (-similarity, [doc_id] + values + [similarity]))
+
+    return heap
+
+
+def build_heaps(df, lst_results: list) -> list:
+    """
+    This function builds the heaps of a batch of queries (see build_heap()),
+    materializing the rows of all the documents found with a single lookup in the dataset
+    Args:
+        df (pd.DataFrame): The dataset
+        lst_results (list): For each query the pairs (document id, similarity) (or None)
+    Returns:
+        list: The heap of each query (None for the queries without results)
+    """
+    doc_ids = sorted({doc_id for results in lst_results if results is not None for doc_id, _ in results})
+    rows = dict(zip(doc_ids, df.loc[doc_ids].values.tolist())) if len(doc_ids) > 0 else {}
+
+    lst_heaps = []
+    for results in lst_results:
+        if results is None:
+            lst_heaps.append(None)
+            continue
+        heap = []
+        for doc_id, similarity in results:
+            heapq.heappush(heap, (-similarity, [doc_id] + rows[doc_id] + [similarity]))
+        lst_heaps.append(heap)
+    return lst_heaps
+
+
+def query_matrix(lst_words: list, inverted_index: dict, n_terms: int, n_documents: int, vocabulary: dict = None):
+    """
+    This function builds the sparse queries x vocabulary matrix of a batch of queries,
+    with the weights of query_weights() divided by the norm of each query
+    Args:
+        lst_words (list): The preprocessed words of each query
+        inverted_index (dict): The inverted index {term_id: (document ids, weights)}
+        n_terms (int): The number of terms (columns)
+        n_documents (int): The number of documents N
+        vocabulary (dict): The mapping from the words to the term_ids of the index (see query_weights())
+    Returns:
+        scipy.sparse.csr_matrix: The normalized query matrix (an empty row for the queries
+            without words in the vocabulary)
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+
+    rows, columns, data = [], [], []
+    for row, words in enumerate(lst_words):
+        weights = query_weights(words, inverted_index, n_documents, vocabulary)
+        if len(weights) == 0:
+            continue
+        query_norm = np.linalg.norm(list(weights.values()))
+        for term_id, weight in weights.items():
+            rows.append(row)
+            columns.append(term_id)
+            data.append(weight / query_norm)
+
+    return csr_matrix((data, (rows, columns)), shape = (len(lst_words), n_terms), dtype = np.float64)
+
+
+def batch_top_k(queries, matrix, doc_ids, k: int = 10, incidence = None, block_size: int = 256, n_jobs: int = 1, norms = None) -> list:
+    """
+    This function returns the k documents with the highest cosine similarity with each query
+    of a batch. The documents matrix is normalized once, then the similarities of a block of
+    queries with all the documents are computed with a single sparse matrix product
+    (queries x vocabulary) @ (vocabulary x documents), so no Python loop runs over the postings.
+    The blocks are independent, so with n_jobs > 1 they are computed by a pool of threads
+    (scipy releases the GIL during the sparse products)
+    Args:
+        queries (scipy.sparse.csr_matrix): The normalized query matrix (see query_matrix())
+        matrix (scipy.sparse matrix): The documents x vocabulary matrix
+        doc_ids (np.ndarray): The id of the document of each row of the matrix
+        k (int): The number of documents to return for each query
+        incidence (scipy.sparse.csr_matrix): The binary documents x vocabulary matrix used to keep
+            only the documents that contain all the words of the query (AND logic).
+            If None all the documents that contain at least one word are ranked (OR logic)
+        block_size (int): The number of queries multiplied together
+        n_jobs (int): The number of threads (None to use all the cores)
+        norms (np.ndarray): The norm of each row of the matrix (if None, the l2 norms of the rows)
+    Returns:
+        list: For each query the pairs (document id, similarity) sorted by decreasing similarity
+            (None for the queries without words in the vocabulary)
+    """
+    import os
+    import numpy as np
+    from scipy.sparse import diags
+    from concurrent.futures import ThreadPoolExecutor
+
+    doc_ids = np.asarray(doc_ids, dtype = np.int64)
+    if norms is None:
+        norms = sparse_matrix.row_norms(matrix)
+    with np.errstate(divide = 'ignore'):
+        inverse_norms = np.where(norms > 0, 1 / norms, 0)
+    # vocabulary x documents matrix with the documents divided by their norms
+    documents = (diags(inverse_norms) @ matrix).T.tocsr()
+    if incidence is not None:
+        incidence = incidence.T.tocsr()
+
+    # The number of (distinct) words of each query, needed by the AND logic
+    n_words = np.diff(queries.indptr)
+
+    def score_block(start: int) -> list:
+        block = queries[start:start + block_size]
+        similarities = (block @ documents).tocsr()
+        if incidence is not None:
+            # Counting how many words of the query each document contains,
+            # and keeping only the documents that contain all of them
+            counts = (block.sign() @ incidence).tocsr()
+            with np.errstate(divide = 'ignore'):
+                counts = diags(np.where(n_words[start:start + block_size] > 0, 1 / n_words[start:start + block_size], 0)) @ counts
+            counts.data = (counts.data > 1 - 1e-9).astype(np.float64)
+            similarities = similarities.multiply(counts).tocsr()
+        similarities.sort_indices()
+
+        results = []
+        for row in range(block.shape[0]):
+            if n_words[start + row] == 0:
+                results.append(None)
+                continue
+            begin, end = similarities.indptr[row], similarities.indptr[row + 1]
+            results.append(top_k(doc_ids[similarities.indices[begin:end]], similarities.data[begin:end], k))
+        return results
+
+    if n_jobs is None:
+        n_jobs = os.cpu_count() or 1
+    starts = range(0, queries.shape[0], block_size)
+    if n_jobs <= 1 or len(starts) <= 1:
+        blocks = map(score_block, starts)
+        return [result for block in blocks for result in block]
+    with ThreadPoolExecutor(max_workers = n_jobs) as executor:
+        return [result for block in executor.map(score_block, starts) for result in block]
+
+
+def load_max_impacts(f) -> dict:
+    """
+    This function reads the maximum impact of each term from an opened json file
+    Args:
+        f (file): The opened json file
+    Returns:
+        dict: The maximum impact of each term_id
+    """
+    return {int(term_id): value for term_id, value in json.load(f).items()}
+
+
+def max_score_top_k(words: list, inverted_index: dict, norms, max_impacts: dict, k: int = 10, vocabulary: dict = None) -> list:
+    """
+    This function returns the k documents with the highest cosine similarity with the query
+    among all the documents that contain at least one word of the query (ranked OR),
+    using the MaxScore dynamic pruning.
+    The upper bound of the contribution of a term to the similarity is its (normalized) query weight
+    times its maximum impact. The terms are sorted by upper bound: if the sum of the upper bounds
+    of the first terms is not greater than a lower bound of the k-th best similarity (the threshold),
+    a document that contains only those terms ("non essential") can not enter the top k.
+    The threshold is found scoring first the documents of the term with the highest upper bound,
+    then only the documents in the posting lists of the essential terms are scored, so the long
+    posting lists of the common words are just searched and never enumerated.
+    The result is the same of cosine_top_k() with candidates = None
+    (apart from the order of the documents with the same similarity up to the rounding errors)
+    Args:
+        words (list): The preprocessed words of the query
+        inverted_index (dict): The inverted index {term_id: (document ids, weights)}
+        norms (pd.DataFrame): The norm of each document (column 'norm', indexed by document id)
+        max_impacts (dict): The maximum impact (weight / norm of the document) of each term_id
+            (see sparse_matrix.max_impacts())
+        k (int): The number of documents to return
+        vocabulary (dict): The mapping from the words to the term_ids of the index (see query_weights())
+    Returns:
+        list: The pairs (document id, similarity) sorted by decreasing similarity
+            (None if none of the words is in the vocabulary)
+    """
+    import numpy as np
+
+    weights = query_weights(words, inverted_index, len(norms), vocabulary)
+    if len(weights) == 0:
+        return None
+    query_norm = np.linalg.norm(list(weights.values()))
+
+    # Sorting the terms by upper bound (the terms without a bound are always essential)
+    upper_bounds = {term_id: weight / query_norm * max_impacts.get(term_id, np.inf) for term_id, weight in weights.items()}
+    terms = sorted(weights, key = lambda term_id: upper_bounds[term_id])
+    # cumulative[i] = sum of the upper bounds of the terms 0, ..., i
+    cumulative = np.cumsum([upper_bounds[term_id] for term_id in terms])
+
+    # The exact similarities of the documents of the term with the highest upper bound
+    # give a lower bound of the k-th best similarity
+    first = inverted_index[terms[-1]][0]
+    threshold = 0.0
+    if len(first) >= k:
+        first_results = cosine_top_k(words, inverted_index, norms, k, first, vocabulary)
+        if len(first_results) == k:
+            threshold = first_results[-1][1]
+
+    # The documents that contain only the non essential terms are skipped
+    # (the term with the highest upper bound is always essential, its documents can reach the threshold)
+    n_non_essential = min(int(np.searchsorted(cumulative, threshold, side = 'right')), len(terms) - 1)
+    essential = terms[n_non_essential:]
+    candidates = np.unique(np.concatenate([inverted_index[term_id][0] for term_id in essential]))
+
+    return cosine_top_k(words, inverted_index, norms, k, candidates, vocabulary)
+
+
+# The last norms dataframe and its content as numpy arrays (sorted document ids, norms)
+norms_memo = (None, None, None)
+
+
+def lookup_norms(norms, doc_ids):
+    """
+    This function returns the norms of some documents. The norms dataframe is converted
+    into numpy arrays sorted by document id (only when it changes), so the lookup is a binary search
+    instead of a reindex of the dataframe
+    Args:
+        norms (pd.DataFrame): The norm of each document (column 'norm', indexed by document id)
+        doc_ids (np.ndarray): The ids of the documents
+    Returns:
+        np.ndarray: The norm of each document (nan if the document has no norm)
+    """
+    import numpy as np
+
+    global norms_memo
+    if norms_memo[0] is not norms:
+        all_doc_ids = norms.index.to_numpy(dtype = np.int64)
+        order = np.argsort(all_doc_ids, kind = 'stable')
+        norms_memo = (norms, all_doc_ids[order], norms['norm'].to_numpy(dtype = np.float64)[order])
+    _, all_doc_ids, all_norms = norms_memo
+
+    if len(all_doc_ids) == 0:
+        return np.full(len(doc_ids), np.nan)
+    positions = np.searchsorted(all_doc_ids, doc_ids)
+    positions[positions == len(all_doc_ids)] = 0
+    return np.where(all_doc_ids[positions] == doc_ids, all_norms[positions], np.nan)
@@ -0,0 +1,428 @@
+"""
+Local HTTP search service.
+The dataset and the indexes of the three search engines are loaded only once, when the
+service starts, and then the queries are served from memory. The service is based on asyncio:
+the connections are handled by the event loop, while the queries are run by a pool of threads,
+so a slow query does not block the other requests.
+Run it from the root of the repository (it works offline, the indexes are read from data/):
+    python -m modules.search_service [--host HOST] [--port PORT] [--workers N] [--rebuild]
+Endpoints (all GET, the results are returned as JSON):
+    /search?q=QUERY&engine=v1|v2|v3&k=10&mode=and|or|boolean|phrase&slop=0
+        optional filters on the facets (see the facets module), e.g. &country=Italy&country=France&modality=...
+        (the values of the same facet are in OR, the different facets in AND),
+        ranges of fees and duration (see the range_index module), e.g. &feesEUR=5000-10000&duration=<=12 months,
+        areas (see the spatial_index module), e.g. &near=45.46,9.19,50 or &near=Milan,Italy;50 or &bbox=45,9,46,10,
+        and &facets=1 to also return the facet counts of the result set
+    /stats      the number of requests, the latencies and the statistics of the result caches
+    /health     the status of the service
+"""
+from __future__ import annotations
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import deque
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+
+from . import engine_v1
+from . import engine_v2
+from . import engine_v3
+from . import boolean_query
+from . import facets
+from . import range_index
+from . import spatial_index
+
+path_dataset_folder = "data/TSVs/"
+col_names = ['courseName','universityName','facultyName', 'isItFullTime','description','startDate','fees','modality','duration','city','country','administration','url']
+
+# The columns of the documents returned by the service
+result_columns = ['courseName', 'universityName', 'city', 'country', 'url']
+
+# The maximum number of results for a query, and the number of latencies used for the statistics
+max_k = 100
+latency_window = 10000
+
+# The maximum size of the head of a request
+max_header_size = 16384
+
+
+def load_dataset(folder: str = path_dataset_folder) -> pd.DataFrame:
+    """
+    This function reads all the course_i.tsv files of a folder into a single dataframe
+    indexed by the number i of the course, sorted by index
+    Args:
+        folder (str): The folder with the tsv files
+    Returns:
+        pd.DataFrame: The dataset
+    """
+    import pandas as pd
+
+    lst_df = []
+    for file_name in os.listdir(folder):
+        if not file_name.endswith(".tsv"):
+            continue
+        try:
+            df_course = pd.read_csv(os.path.join(folder, file_name), sep = '\t', names = col_names, header = None)
+            df_course['index'] = int(file_name.split("_")[1].split(".")[0])
+            df_course.set_index('index', inplace = True)
+            lst_df.append(df_course)
+        except Exception as e:
+            pass
+
+    if len(lst_df) == 0:
+        return pd.DataFrame(columns = col_names)
+    return pd.concat(lst_df).sort_index()
+
+
+def warm_up(df: pd.DataFrame, rebuild: bool = False) -> None:
+    """
+    This function prepares the three search engines for the service: the indexes are built
+    if they are missing (or if rebuild is True), then all the files are loaded in memory
+    and a first query initializes the analyzer. After this function the engines
+    only read their module variables, so they can be used by more threads at the same time
+    Args:
+        df (pd.DataFrame): The dataset
+        rebuild (bool): If True the indexes are always built again
+    Returns:
+        None
+    """
+    engines = [engine for engine in (engine_v2, engine_v3) if rebuild or engine.get_inverted_index() is None]
+    build_v1 = rebuild or engine_v1.get_inverted_index() is None
+    if len(engines) > 0 or build_v1:
+        # The descriptions are preprocessed only once, and the same dataset is shared by the builds
+        df = engine_v1.prepare_dataset(df)
+    for engine in engines:
+        # Each engine builds its own vocabulary and index, in a new version directory (see the index_store module)
+        engine.create_inverted_index(df)
+    if build_v1:
+        # The index of the engine_v1 module is built from its vocabulary and from the preprocessed descriptions
+        engine_v1.create_vocabulary(df)
+        engine_v1.create_inverted_index()
+    if rebuild or facets.get_facets() is None:
+        facets.build(df)
+    if rebuild or range_index.get_range_index() is None:
+        range_index.build(df)
+    if rebuild or spatial_index.get_spatial_index() is None:
+        # The coordinates are read from the geocoding cache (see the geocoding module)
+        spatial_index.build(df)
+
+    # Sharing the dataset (with the preprocessed descriptions if they have been computed)
+    # with the engines that have not been built now
+    for engine in (engine_v1, engine_v2, engine_v3):
+        if engine.df_original is None:
+            engine.df_original = df
+
+    # Loading all the files in memory (see the file_cache module)
+    engine_v1.get_vocabulary()
+    engine_v1.get_inverted_index()
+    for engine in (engine_v2, engine_v3):
+        engine.get_vocabulary()
+        engine.get_inverted_index()
+        engine.get_norms()
+        engine.get_max_impacts()
+    facets.get_facets()
+    range_index.get_range_index()
+    spatial_index.get_spatial_index()
+    engine_v1.analyze_query("warm up")
+
+
+def run_query(engine: str, query: str, k: int = 10, mode: str = 'and', slop: int = 0, filters: dict = None) -> list:
+    """
+    This function runs a query with one of the search engines
+    Args:
+        engine (str): The search engine ('v1', 'v2' or 'v3')
+        query (str): The query
+        k (int): The maximum number of results
+        mode (str): 'and' (all the words), 'or' (at least one word, only for v2 and v3),
+            'boolean' (see the boolean_query module) or 'phrase' (only for v1)
+        slop (int): The slop of the phrase queries
+        filters (dict): The accepted values of the facets (see facets.filter_bitmap())
+    Returns:
+        list: The results, as dictionaries with the id of the document, its score
+            (None for the engine v1) and the columns in result_columns
+    Raises:
+        ValueError: If the parameters or the boolean query are not valid
+    """
+    if engine == 'v1':
+        if mode == 'and':
+            df_result = engine_v1.search(query, filters)
+        elif mode == 'boolean':
+            df_result = boolean_query.search(query)
+        elif mode == 'phrase':
+            df_result = engine_v1.phrase_search(query, slop)
+        else:
+            raise ValueError(f"Mode {mode} is not supported by the engine v1")
+        if df_result is None:
+            return []
+        if filters and mode != 'and':
+            df_result = df_result.loc[facets.filter_ids(filters, df_result.index.sort_values())]
+        df_result = df_result[:k]
+        return [dict({'id': int(doc_id), 'score': None}, **dict(zip(result_columns, values)))
+                for doc_id, values in zip(df_result.index, df_result[result_columns].values.tolist())]
+
+    if engine not in ('v2', 'v3'):
+        raise ValueError(f"Unknown engine {engine}")
+    if mode not in ('and', 'or', 'boolean'):
+        raise ValueError(f"Mode {mode} is not supported by the engine {engine}")
+
+    module = engine_v2 if engine == 'v2' else engine_v3
+    heap = module.search(query, k, boolean = mode == 'boolean', disjunctive = mode == 'or', filters = filters)
+    if heap is None:
+        return []
+
+    # The elements of the heap are (-similarity, [id] + row values + [similarity])
+    columns = ['id'] + module.df_original.columns.tolist() + ['score']
+    results = []
+    for _, values in sorted(heap, key = lambda item: (item[0], item[1][0])):
+        row = dict(zip(columns, values))
+        results.append(dict({'id': int(row['id']), 'score': float(row['score'])}, **{column: row[column] for column in result_columns}))
+    return results
+
+
+def facet_counts(results: list, query: str, mode: str = 'and', slop: int = 0, filters: dict = None, engine: str = 'v1') -> dict:
+    """
+    This function returns the facet counts of the result set of a query. For the AND, boolean and
+    phrase queries the result set is made of all the documents that match the query (not only the
+    returned ones), while for the ranked OR queries it is made of the returned documents
+    Args:
+        results (list): The results returned by run_query()
+        query (str): The query
+        mode (str): The mode of the query (see run_query())
+        slop (int): The slop of the phrase queries
+        filters (dict): The accepted values of the facets
+        engine (str): The search engine of the query (each engine finds the documents with its own index)
+    Returns:
+        dict: The number of documents with each value of each facet (see facets.counts())
+    """
+    import numpy as np
+
+    module = {'v2': engine_v2, 'v3': engine_v3}.get(engine)
+    if mode == 'and':
+        words = engine_v1.analyze_query(query)
+        doc_ids = engine_v1.get_document_ids(words) if module is None else module.get_document_ids(words)
+    elif mode == 'boolean':
+        tree = boolean_query.parse(query)
+        doc_ids = boolean_query.get_document_ids(tree) if module is None else module.get_boolean_document_ids(tree)
+    elif mode == 'phrase':
+        doc_ids = engine_v1.get_phrase_document_ids(engine_v1.analyze_query(query), slop)
+    else:
+        doc_ids = None
+
+    if doc_ids is None:
+        doc_ids = [result['id'] for result in results]
+    elif filters:
+        doc_ids = facets.filter_ids(filters, doc_ids)
+    return facets.counts(np.sort(np.asarray(doc_ids, dtype = np.int64)))
+
+
+def search(engine: str, query: str, k: int = 10, mode: str = 'and', slop: int = 0, filters: dict = None, counts: bool = False) -> dict:
+    """
+    This function runs a query (see run_query()) and, if requested, computes the facet counts of its result set
+    Returns:
+        dict: The results and the facet counts (None if they are not requested)
+    """
+    results = run_query(engine, query, k, mode, slop, filters)
+    return {'results': results, 'facets': facet_counts(results, query, mode, slop, filters, engine) if counts else None}
+
+
+class SearchService:
+    """
+    HTTP service that answers the queries with the search engines.
+    The engines must be ready (see warm_up()) before the service is started
+    """
+
+    def __init__(self, workers: int = 4):
+        """
+        Args:
+            workers (int): The number of threads that run the queries
+        """
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        self.started = time.time()
+        self.requests = 0
+        self.errors = 0
+        # The latencies (in milliseconds) of the last requests
+        self.latencies = deque(maxlen = latency_window)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        This function serves the requests of a connection (HTTP/1.1, with keep alive)
+        Args:
+            reader (asyncio.StreamReader): The stream of the requests
+            writer (asyncio.StreamWriter): The stream of the responses
+        Returns:
+            None
+        """
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                parts = lines[0].split(' ')
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                # The body of the request (if any) is ignored
+                length = int(headers.get('content-length', 0) or 0)
+                if length > 0:
+                    await reader.readexactly(length)
+
+                start = time.perf_counter()
+                if len(parts) != 3:
+                    status, body = 400, {'error': 'Malformed request'}
+                elif parts[0] != 'GET':
+                    status, body = 405, {'error': f'Method {parts[0]} is not allowed'}
+                else:
+                    status, body = await self.route(parts[1])
+                latency = (time.perf_counter() - start) * 1000
+
+                self.requests += 1
+                self.errors += status >= 400
+                self.latencies.append(latency)
+                body['latency_ms'] = round(latency, 3)
+
+                keep_alive = (parts[-1] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close') \
+                    or headers.get('connection', '').lower() == 'keep-alive'
+                writer.write(response(status, body, latency, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def route(self, target: str) -> tuple:
+        """
+        This function answers a request
+        Args:
+            target (str): The path and the query string of the request
+        Returns:
+            tuple: The status code and the body of the response
+        """
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+
+        if url.path == '/health':
+            return 200, {'status': 'ok', 'uptime_s': round(time.time() - self.started, 3)}
+
+        if url.path == '/stats':
+            return 200, self.stats()
+
+        if url.path != '/search':
+            return 404, {'error': f'Unknown path {url.path}'}
+
+        query = params.get('q', '')
+        engine = params.get('engine', 'v2')
+        mode = params.get('mode', 'and')
+        try:
+            k = min(max(int(params.get('k', 10)), 1), max_k)
+            slop = max(int(params.get('slop', 0)), 0)
+        except ValueError:
+            return 400, {'error': 'k and slop must be integers'}
+        # The filters on the facets can have more values (in OR), the ranges and the areas only one
+        filters = {field: values for field, values in parse_qs(url.query).items() if field in facets.facet_fields}
+        filters.update({field: params[field] for field in range_index.range_fields + spatial_index.spatial_fields if field in params})
+        counts = params.get('facets', '0') in ('1', 'true')
+
+        loop = asyncio.get_running_loop()
+        try:
+            # The query runs in a thread, so the event loop keeps serving the other requests
+            output = await loop.run_in_executor(self.executor, search, engine, query, k, mode, slop, filters or None, counts)
+        except ValueError as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': repr(e)}
+
+        body = {'query': query, 'engine': engine, 'mode': mode, 'k': k, 'results': output['results']}
+        if filters:
+            body['filters'] = filters
+        if counts:
+            body['facets'] = output['facets']
+        return 200, body
+
+    def stats(self) -> dict:
+        """
+        This function returns the statistics of the service
+        Returns:
+            dict: The number of requests and errors, the percentiles of the latencies
+                (in milliseconds) of the last requests and the statistics of the result caches
+        """
+        latencies = sorted(self.latencies)
+
+        def percentile(p: float) -> float:
+            if len(latencies) == 0:
+                return None
+            return round(latencies[min(int(p * len(latencies)), len(latencies) - 1)], 3)
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'latencies_ms': {'p50': percentile(0.5), 'p95': percentile(0.95), 'p99': percentile(0.99), 'max': percentile(1)},
+            'caches': {'v1': engine_v1.result_cache.stats(), 'v2': engine_v2.result_cache.stats(), 'v3': engine_v3.result_cache.stats()},
+        }
+
+    async def serve(self, host: str = '127.0.0.1', port: int = 8000) -> None:
+        """
+        This function starts the service and serves the requests forever
+        Args:
+            host (str): The address of the service
+            port (int): The port of the service
+        Returns:
+            None
+        """
+        server = await asyncio.start_server(self.handle, host, port, limit = max_header_size)
+        print(f"Search service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+
+def response(status: int, body: dict, latency: float, keep_alive: bool) -> bytes:
+    """
+    This function encodes an HTTP response with a JSON body
+    Args:
+        status (int): The status code
+        body (dict): The body of the response
+        latency (float): The latency of the request in milliseconds
+        keep_alive (bool): If False the connection is closed after the response
+    Returns:
+        bytes: The response
+    """
+    reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+    content = json.dumps(body).encode('utf-8')
+    head = (f"HTTP/1.1 {status} {reasons.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(content)}\r\n"
+            f"X-Latency-Ms: {latency:.3f}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    return head.encode('latin-1') + content
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description = 'Local HTTP search service')
+    parser.add_argument('--host', default = '127.0.0.1', help = 'Address of the service')
+    parser.add_argument('--port', type = int, default = 8000, help = 'Port of the service')
+    parser.add_argument('--workers', type = int, default = 4, help = 'Number of threads that run the queries')
+    parser.add_argument('--dataset', default = path_dataset_folder, help = 'Folder with the course_i.tsv files')
+    parser.add_argument('--rebuild', action = 'store_true', help = 'Build the indexes again')
+    args = parser.parse_args()
+
+    df = load_dataset(args.dataset)
+    warm_up(df, rebuild = args.rebuild)
+
+    try:
+        asyncio.run(SearchService(args.workers).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
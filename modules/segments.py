@@ -0,0 +1,535 @@
+from __future__ import annotations
+
+import os
+import copy
+import json
+import time
+import threading
+
+from . import engine_v1
+from . import file_cache
+from . import scoring
+from . import token_store
+from .query_cache import QueryCache
+
+# Incremental index made of immutable segments.
+# Each segment is a small inverted index of a group of documents, written once and never modified:
+#     {"doc_ids": [...], "lengths": [...], "postings": {word: [[document1, tf1], [document2, tf2], ...]}}
+# The postings are keyed by word (not by term_id), so adding documents never changes the existing
+# segments. The manifest lists the live segments, and for each segment the ids of its deleted
+# documents (tombstones):
+#     {"generation": 3, "next_segment": 4, "segments": [{"name": "segment_000001.json", "deleted": [...]}, ...]}
+# Updating a document means deleting its old version and adding the new one in a new segment.
+# The documents are ranked with BM25, whose statistics (number of documents, document frequency,
+# average length) are computed on the whole live corpus at query time, so they are always exact
+# without rebuilding anything. The small segments are merged together (dropping the deleted
+# documents) by merge_segments(), which can also run in a background thread
+
+path_segments = 'data/segments'
+path_manifest = os.path.join(path_segments, 'manifest.json')
+
+# Parameters of BM25
+k1 = 1.2
+b = 0.75
+
+# When there are more than max_segments segments, the smallest ones are merged
+max_segments = 8
+
+# Lock of the writers (add, delete, merge). The readers never wait: they see the last saved manifest
+_lock = threading.RLock()
+
+# The background merge thread and the event used to stop it
+merge_thread = None
+stop_merging = threading.Event()
+
+# Cache of the results of the queries (see the query_cache module)
+result_cache = QueryCache()
+
+
+def empty_manifest() -> dict:
+    """
+    This function returns the manifest of an index without segments
+    Returns:
+        dict: The manifest
+    """
+    return {'generation': 0, 'next_segment': 1, 'segments': []}
+
+
+def get_manifest() -> dict:
+    """
+    This function loads the manifest of the index (the file is read only when it changes)
+    Returns:
+        dict: The manifest (an empty one if the index has not been created yet)
+    """
+    try:
+        return file_cache.load(path_manifest, json.load)
+    except Exception as e:
+        return empty_manifest()
+
+
+def edit_manifest() -> dict:
+    """
+    This function returns a copy of the manifest that a writer can modify (and then save),
+    since the loaded manifest is shared with the readers
+    Returns:
+        dict: The copy of the manifest
+    """
+    return copy.deepcopy(get_manifest())
+
+
+def save_json(path: str, content: dict, loaded = None) -> None:
+    """
+    This function saves a json file atomically: the content is written in a temporary file
+    that then replaces the old one, so a reader always sees a complete file
+    Args:
+        path (str): The path of the file
+        content (dict): The content
+        loaded: The content as returned by the loader of the file, kept in the file_cache
+            (if None, the content itself)
+    Returns:
+        None
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, "w") as f:
+        json.dump(content, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    file_cache.store(path, content if loaded is None else loaded)
+
+
+def save_manifest(manifest: dict) -> None:
+    """
+    This function saves a new version of the manifest, increasing its generation
+    Args:
+        manifest (dict): The manifest
+    Returns:
+        None
+    """
+    manifest['generation'] += 1
+    os.makedirs(path_segments, exist_ok = True)
+    save_json(path_manifest, manifest)
+    # The results computed with the previous segments are no more valid
+    result_cache.clear()
+
+
+def load_segment(f) -> dict:
+    """
+    This function reads a segment from an opened json file, converting its lists into numpy arrays
+    Args:
+        f (file): The opened json file
+    Returns:
+        dict: The segment, with the posting lists as pairs (document ids, term frequencies)
+    """
+    return to_segment(json.load(f))
+
+
+def to_segment(segment: dict) -> dict:
+    """
+    This function converts the content of a segment file into numpy arrays (see load_segment())
+    Args:
+        segment (dict): The content of the segment file
+    Returns:
+        dict: The segment
+    """
+    import numpy as np
+
+    return {
+        'doc_ids': np.array(segment['doc_ids'], dtype = np.int64),
+        'lengths': np.array(segment['lengths'], dtype = np.float64),
+        'postings': {word: (np.array([item[0] for item in lst], dtype = np.int64), np.array([item[1] for item in lst], dtype = np.float64))
+                     for word, lst in segment['postings'].items()},
+    }
+
+
+def get_segment(name: str) -> dict:
+    """
+    This function loads a segment. Since the segments never change, each one is read only once
+    Args:
+        name (str): The name of the segment file
+    Returns:
+        dict: The segment (see load_segment())
+    Raises:
+        OSError: If the segment does not exists (e.g. it has just been merged)
+    """
+    return file_cache.load(os.path.join(path_segments, name), load_segment)
+
+
+def write_segment(manifest: dict, doc_ids: list, lst_words: list) -> dict:
+    """
+    This function writes a new segment with some documents
+    Args:
+        manifest (dict): The manifest (its counter of the segments is increased)
+        doc_ids (list): The ids of the documents
+        lst_words (list): The preprocessed words of each document
+    Returns:
+        dict: The entry of the new segment for the manifest
+    """
+    postings = {}
+    lengths = []
+    for doc_id, words in zip(doc_ids, lst_words):
+        lengths.append(len(words))
+        counts = {}
+        for word in words:
+            word = word.lower()
+            counts[word] = counts.get(word, 0) + 1
+        for word, count in counts.items():
+            postings.setdefault(word, []).append([int(doc_id), count])
+
+    # The posting lists must be sorted by document id
+    order = sorted(range(len(doc_ids)), key = lambda i: doc_ids[i])
+    doc_ids = [int(doc_ids[i]) for i in order]
+    lengths = [lengths[i] for i in order]
+    for lst in postings.values():
+        lst.sort()
+
+    name = f"segment_{manifest['next_segment']:06d}.json"
+    manifest['next_segment'] += 1
+    content = {'doc_ids': doc_ids, 'lengths': lengths, 'postings': postings}
+    save_json(os.path.join(path_segments, name), content, to_segment(content))
+
+    return {'name': name, 'deleted': []}
+
+
+def add_documents(df: pd.DataFrame) -> int:
+    """
+    This function adds (or updates) some documents, writing them in a new segment.
+    The previous versions of the documents, if any, are deleted.
+    The descriptions are analyzed through the token store, so a text already seen is not preprocessed again
+    Args:
+        df (pd.DataFrame): The new documents (with the 'description' column), indexed by document id
+    Returns:
+        int: The number of documents added
+    """
+    if len(df) == 0:
+        return 0
+    os.makedirs(path_segments, exist_ok = True)
+
+    # If a document appears more times only its last version is kept
+    df = df[~df.index.duplicated(keep = 'last')]
+
+    doc_ids = [int(doc_id) for doc_id in df.index]
+    lst_words = token_store.analyze(df['description'], 'description').tolist()
+
+    with _lock:
+        manifest = edit_manifest()
+        delete_from_manifest(manifest, doc_ids)
+        manifest['segments'].append(write_segment(manifest, doc_ids, lst_words))
+        save_manifest(manifest)
+
+    return len(doc_ids)
+
+
+def delete_documents(doc_ids: list) -> None:
+    """
+    This function deletes some documents, adding them to the tombstones of their segments
+    Args:
+        doc_ids (list): The ids of the documents
+    Returns:
+        None
+    """
+    with _lock:
+        manifest = edit_manifest()
+        delete_from_manifest(manifest, doc_ids)
+        save_manifest(manifest)
+
+
+def delete_from_manifest(manifest: dict, doc_ids: list) -> None:
+    """
+    This function marks some documents as deleted in all the segments that contain them
+    Args:
+        manifest (dict): The manifest (modified in place)
+        doc_ids (list): The ids of the documents
+    Returns:
+        None
+    """
+    import numpy as np
+
+    doc_ids = np.asarray(list(doc_ids), dtype = np.int64)
+    for entry in manifest['segments']:
+        segment_doc_ids = get_segment(entry['name'])['doc_ids']
+        found = segment_doc_ids[np.isin(segment_doc_ids, doc_ids)]
+        if len(found) > 0:
+            entry['deleted'] = sorted(set(entry['deleted']) | set(found.tolist()))
+
+
+def build(df: pd.DataFrame) -> int:
+    """
+    This function creates the index from scratch, with a single segment with all the documents
+    Args:
+        df (pd.DataFrame): The dataset (with the 'description' column), indexed by document id
+    Returns:
+        int: The number of documents
+    """
+    with _lock:
+        old_manifest = get_manifest()
+        save_manifest({'generation': old_manifest['generation'], 'next_segment': old_manifest['next_segment'], 'segments': []})
+        remove_segments([entry['name'] for entry in old_manifest['segments']])
+        return add_documents(df)
+
+
+def remove_segments(names: list) -> None:
+    """
+    This function removes the files of some segments that are no more in the manifest
+    Args:
+        names (list): The names of the segment files
+    Returns:
+        None
+    """
+    for name in names:
+        path = os.path.join(path_segments, name)
+        file_cache.invalidate(path)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def live_mask(segment: dict, deleted: list):
+    """
+    This function returns which documents of a segment are not deleted
+    Args:
+        segment (dict): The segment
+        deleted (list): The ids of the deleted documents of the segment
+    Returns:
+        np.ndarray: A boolean array, one element for each document of the segment
+    """
+    import numpy as np
+
+    if len(deleted) == 0:
+        return np.ones(len(segment['doc_ids']), dtype = bool)
+    return ~np.isin(segment['doc_ids'], deleted)
+
+
+def merge_segments(names: list = None) -> str:
+    """
+    This function merges some segments into a new one, dropping their deleted documents.
+    The new segment is written without holding the lock, so the index can be updated in the meantime:
+    the documents deleted during the merge are then deleted also in the new segment
+    Args:
+        names (list): The names of the segments to merge (if None, all the segments)
+    Returns:
+        str: The name of the new segment (None if there was nothing to merge)
+    """
+    import numpy as np
+
+    with _lock:
+        manifest = edit_manifest()
+        entries = [entry for entry in manifest['segments'] if names is None or entry['name'] in names]
+        if len(entries) < 2 and not any(len(entry['deleted']) > 0 for entry in entries):
+            return None
+        # Reserving the name of the new segment
+        manifest['next_segment'] += 1
+        name = f"segment_{manifest['next_segment'] - 1:06d}.json"
+        save_manifest(manifest)
+
+    # Collecting the live documents of the segments
+    doc_ids, lengths, postings = [], [], {}
+    for entry in entries:
+        segment = get_segment(entry['name'])
+        mask = live_mask(segment, entry['deleted'])
+        doc_ids.extend(segment['doc_ids'][mask].tolist())
+        lengths.extend(segment['lengths'][mask].tolist())
+        deleted = np.asarray(entry['deleted'], dtype = np.int64)
+        for word, (term_doc_ids, tfs) in segment['postings'].items():
+            keep = ~np.isin(term_doc_ids, deleted) if len(deleted) > 0 else slice(None)
+            lst = postings.setdefault(word, [])
+            lst.extend(zip(term_doc_ids[keep].tolist(), tfs[keep].tolist()))
+
+    order = np.argsort(doc_ids, kind = 'stable')
+    content = {
+        'doc_ids': [doc_ids[i] for i in order],
+        'lengths': [lengths[i] for i in order],
+        'postings': {word: sorted(lst) for word, lst in postings.items() if len(lst) > 0},
+    }
+    save_json(os.path.join(path_segments, name), content, to_segment(content))
+
+    with _lock:
+        manifest = edit_manifest()
+        current = {entry['name']: entry for entry in manifest['segments']}
+        if any(entry['name'] not in current for entry in entries):
+            # Another merge has already replaced some of these segments
+            remove_segments([name])
+            return None
+
+        # The documents deleted while we were merging
+        deleted = set()
+        for entry in entries:
+            deleted |= set(current[entry['name']]['deleted']) - set(entry['deleted'])
+        merged = {entry['name'] for entry in entries}
+
+        # The new segment takes the place of the first merged segment
+        segments = []
+        for entry in manifest['segments']:
+            if entry['name'] not in merged:
+                segments.append(entry)
+            elif entry['name'] == entries[0]['name']:
+                segments.append({'name': name, 'deleted': sorted(deleted)})
+        manifest['segments'] = segments
+        save_manifest(manifest)
+
+    remove_segments(list(merged))
+    return name
+
+
+def maybe_merge() -> str:
+    """
+    This function merges the smallest segments when there are more than max_segments,
+    so that the number of segments (and so the work of each query) stays small
+    Returns:
+        str: The name of the new segment (None if no merge was needed)
+    """
+    manifest = get_manifest()
+    if len(manifest['segments']) <= max_segments:
+        return None
+
+    sizes = {entry['name']: len(get_segment(entry['name'])['doc_ids']) - len(entry['deleted']) for entry in manifest['segments']}
+    smallest = sorted(sizes, key = lambda name: sizes[name])[:len(sizes) - max_segments + 1]
+    return merge_segments(smallest)
+
+
+def start_background_merge(interval: float = 5.0) -> threading.Thread:
+    """
+    This function starts a thread that checks every interval seconds if the segments must be merged
+    Args:
+        interval (float): The number of seconds between two checks
+    Returns:
+        threading.Thread: The merge thread
+    """
+    global merge_thread
+    if merge_thread is not None and merge_thread.is_alive():
+        return merge_thread
+
+    def run():
+        while not stop_merging.wait(interval):
+            try:
+                maybe_merge()
+            except Exception as e:
+                print("Error while merging the segments: " + repr(e))
+
+    stop_merging.clear()
+    merge_thread = threading.Thread(target = run, name = 'segment-merge', daemon = True)
+    merge_thread.start()
+    return merge_thread
+
+
+def stop_background_merge() -> None:
+    """
+    This function stops the background merge thread (waiting for the current merge to end)
+    Returns:
+        None
+    """
+    global merge_thread
+    stop_merging.set()
+    if merge_thread is not None:
+        merge_thread.join()
+        merge_thread = None
+
+
+def statistics(manifest: dict) -> tuple:
+    """
+    This function computes the statistics of the live corpus needed by BM25
+    Args:
+        manifest (dict): The manifest
+    Returns:
+        tuple: The number of documents and their average length
+    """
+    n_documents, total_length = 0, 0.0
+    for entry in manifest['segments']:
+        segment = get_segment(entry['name'])
+        mask = live_mask(segment, entry['deleted'])
+        n_documents += int(mask.sum())
+        total_length += float(segment['lengths'][mask].sum())
+    return n_documents, (total_length / n_documents if n_documents > 0 else 0.0)
+
+
+def search(query: str, k: int = 10, conjunctive: bool = False) -> list:
+    """
+    This function returns the k documents with the highest BM25 score, merging the posting lists
+    of all the segments and ignoring the deleted documents:
+        score = sum_{word} idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / average length))
+        idf = log(1 + (N - df + 0.5) / (df + 0.5))
+    N, df and the average length are computed on the live documents of all the segments
+    Args:
+        query (str): The query
+        k (int): The number of documents to return
+        conjunctive (bool): If True only the documents that contain all the words of the query are ranked
+    Returns:
+        list: The pairs (document id, score) sorted by decreasing score
+    """
+    words = tuple(sorted(set(word.lower() for word in engine_v1.analyze_query(query))))
+
+    for attempt in range(2):
+        manifest = get_manifest()
+        key = (words, (k, conjunctive), manifest['generation'])
+        found, results = result_cache.get(key)
+        if found:
+            return list(results)
+        try:
+            results = rank(manifest, words, k, conjunctive)
+            break
+        except FileNotFoundError:
+            # A segment has been merged (and removed) after reading the manifest: we try again
+            if attempt == 1:
+                raise
+            time.sleep(0.01)
+
+    result_cache.put(key, results)
+    return list(results)
+
+
+def rank(manifest: dict, words: tuple, k: int, conjunctive: bool) -> list:
+    """
+    This function computes the BM25 scores of the documents of the segments of a manifest (see search())
+    Args:
+        manifest (dict): The manifest
+        words (tuple): The distinct preprocessed words of the query
+        k (int): The number of documents to return
+        conjunctive (bool): If True only the documents that contain all the words of the query are ranked
+    Returns:
+        list: The pairs (document id, score) sorted by decreasing score
+    """
+    import numpy as np
+
+    if len(words) == 0:
+        return []
+
+    n_documents, average_length = statistics(manifest)
+    if n_documents == 0:
+        return []
+
+    # For each word, the live postings of all the segments, with the lengths of the documents
+    lst_doc_ids, lst_scores = [], []
+    for word in words:
+        term_doc_ids, term_tfs, term_lengths = [], [], []
+        for entry in manifest['segments']:
+            segment = get_segment(entry['name'])
+            if word not in segment['postings']:
+                continue
+            doc_ids, tfs = segment['postings'][word]
+            if len(entry['deleted']) > 0:
+                keep = ~np.isin(doc_ids, entry['deleted'])
+                doc_ids, tfs = doc_ids[keep], tfs[keep]
+            term_doc_ids.append(doc_ids)
+            term_tfs.append(tfs)
+            term_lengths.append(segment['lengths'][np.searchsorted(segment['doc_ids'], doc_ids)])
+
+        if len(term_doc_ids) == 0:
+            if conjunctive:
+                return []
+            continue
+        doc_ids, tfs, lengths = np.concatenate(term_doc_ids), np.concatenate(term_tfs), np.concatenate(term_lengths)
+        df = len(doc_ids)
+        idf = np.log(1 + (n_documents - df + 0.5) / (df + 0.5))
+        lst_doc_ids.append(doc_ids)
+        lst_scores.append(idf * tfs * (k1 + 1) / (tfs + k1 * (1 - b + b * lengths / average_length)))
+
+    if len(lst_doc_ids) == 0:
+        return []
+    doc_ids, inverse = np.unique(np.concatenate(lst_doc_ids), return_inverse = True)
+    scores = np.bincount(inverse, weights = np.concatenate(lst_scores), minlength = len(doc_ids))
+    if conjunctive:
+        matches = np.bincount(inverse, minlength = len(doc_ids))
+        doc_ids, scores = doc_ids[matches == len(words)], scores[matches == len(words)]
+
+    return scoring.top_k(doc_ids, scores, k)
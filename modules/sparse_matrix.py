@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+# Functions shared by the engines that store the documents x vocabulary weight matrix
+# (engine_v2 and engine_v3). The matrix is always kept sparse, in CSR format
+# (one row for each document, one column for each term_id), and it is saved in binary
+# format (.npz) together with the ids of the documents of each row.
+# numpy and scipy are imported only inside the functions, so that importing the engines is fast
+
+
+def save(path: str, matrix, doc_ids) -> None:
+    """
+    This function saves a sparse matrix and the ids of its rows in a .npz file
+    Args:
+        path (str): The path of the file (it must end with .npz)
+        matrix (scipy.sparse matrix): The documents x vocabulary matrix
+        doc_ids (list): The id of the document of each row
+    Returns:
+        None
+    """
+    import numpy as np
+
+    matrix = matrix.tocsr()
+    with open(path, "wb") as f:
+        np.savez(f, data = matrix.data, indices = matrix.indices, indptr = matrix.indptr,
+                 shape = np.array(matrix.shape), doc_ids = np.asarray(doc_ids))
+
+
+def load(f) -> tuple:
+    """
+    This function reads a sparse matrix saved by save() from an opened binary file
+    Args:
+        f (file): The opened .npz file
+    Returns:
+        tuple: The CSR matrix and the array with the id of the document of each row
+    """
+    import numpy as np
+    from scipy.sparse import csr_matrix
+
+    with np.load(f) as npz:
+        matrix = csr_matrix((npz['data'], npz['indices'], npz['indptr']), shape = tuple(npz['shape']))
+        doc_ids = npz['doc_ids']
+    return matrix, doc_ids
+
+
+def row_norms(matrix):
+    """
+    This function computes the l2 norm of each row of a sparse matrix,
+    using only the non zero elements
+    Args:
+        matrix (scipy.sparse matrix): The documents x vocabulary matrix
+    Returns:
+        np.ndarray: The norm of each row
+    """
+    import numpy as np
+
+    return np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis = 1)).ravel())
+
+
+def inverted_index(matrix, doc_ids, vocabulary: dict) -> dict:
+    """
+    This function derives the weighted inverted index from the sparse matrix in a single pass
+    over its non zero elements: in CSC format the non zero elements of each column (i.e. term)
+    are stored contiguously, so each posting list is just a slice of the matrix
+    Args:
+        matrix (scipy.sparse matrix): The documents x vocabulary matrix
+        doc_ids (list): The id of the document of each row
+        vocabulary (dict): The vocabulary, i.e. the mapping from words to term_id (column)
+    Returns:
+        dict: The inverted index {term_id: [(document1, weight1), (document2, weight2), ...]}
+            with the documents in the same order of the rows
+    """
+    import numpy as np
+
+    csc = matrix.tocsc()
+    csc.sort_indices()
+    doc_ids = np.asarray(doc_ids)
+
+    inverted_index = {}
+    for term_id in vocabulary.values():
+        start, end = csc.indptr[term_id], csc.indptr[term_id + 1]
+        weights = csc.data[start:end]
+        rows = csc.indices[start:end]
+
+        # Keeping only the positive weights (as the explicit zeros are not meaningful)
+        mask = weights > 0
+        inverted_index[term_id] = list(zip(doc_ids[rows[mask]].tolist(), weights[mask].tolist()))
+
+    return inverted_index
+
+
+def save_norms(path: str, norms, index) -> None:
+    """
+    This function saves the norm of each document in a csv file with the columns 'index' and 'norm'
+    Args:
+        path (str): The path of the csv file
+        norms (np.ndarray): The norm of each document
+        index (pd.Index): The ids of the documents
+    Returns:
+        None
+    """
+    import pandas as pd
+
+    norms = pd.Series(norms, index = index, name = 'norm')
+    norms.index.name = 'index'
+    with open(path, "w") as f:
+        norms.to_csv(f)
+
+
+def max_impacts(matrix, norms, vocabulary: dict) -> dict:
+    """
+    This function computes, for each term, the maximum impact that it can have on the cosine
+    similarity of a document, i.e. the maximum over the documents of weight / norm of the document.
+    These upper bounds are used by the dynamic pruning of the ranked OR queries (see scoring.max_score_top_k())
+    Args:
+        matrix (scipy.sparse matrix): The documents x vocabulary matrix
+        norms (np.ndarray): The norm of each document (row)
+        vocabulary (dict): The vocabulary, i.e. the mapping from words to term_id (column)
+    Returns:
+        dict: The maximum impact of each term_id
+    """
+    import numpy as np
+    from scipy.sparse import diags
+
+    with np.errstate(divide = 'ignore'):
+        inverse_norms = np.where(norms > 0, 1 / norms, 0)
+    maxima = (diags(inverse_norms) @ matrix).tocsc().max(axis = 0).toarray().ravel()
+
+    return {term_id: float(maxima[term_id]) for term_id in vocabulary.values()}
+
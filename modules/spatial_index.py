@@ -0,0 +1,318 @@
+from __future__ import annotations
+
+import os
+import io
+import math
+
+from . import file_cache
+
+# Spatial index of the coordinates of the courses (see the geocoding module), used to find the courses
+# within a distance from a point ('near') or inside a bounding box ('bbox').
+# The surface of the Earth is divided into a grid of cells of cell_size x cell_size degrees, and the
+# courses are sorted by cell: the courses of consecutive cells of the same row of the grid are a
+# contiguous slice of the sorted arrays, found with two binary searches. A query reads only the
+# rows of cells that overlap the bounding box of the area, and then checks the exact distance
+# (or the exact box) only on the courses of those cells, so its cost depends on the number of
+# nearby courses and not on the size of the dataset.
+# The index is saved in the file spatial_index.npz
+# numpy is imported only inside the functions, so that importing the module is fast
+
+path_spatial_index = 'data/spatial_index.npz'
+
+# The filters supported by the index (see facets.filter_bitmap())
+spatial_fields = ['near', 'bbox']
+
+# The size of the cells in degrees (0.25 degrees of latitude are about 28 km)
+cell_size = 0.25
+
+# The mean radius of the Earth
+earth_radius_km = 6371.0088
+
+
+def grid_shape(size: float) -> tuple:
+    """
+    This function returns the number of rows (latitude) and columns (longitude) of the grid
+    Args:
+        size (float): The size of the cells in degrees
+    Returns:
+        tuple: The number of rows and of columns
+    """
+    return int(math.ceil(180 / size)), int(math.ceil(360 / size))
+
+
+def cell_rows(latitudes, size: float):
+    """
+    This function returns the row of the grid of some latitudes
+    """
+    import numpy as np
+
+    n_rows, _ = grid_shape(size)
+    return np.clip(np.floor((np.asarray(latitudes, dtype = np.float64) + 90) / size), 0, n_rows - 1).astype(np.int64)
+
+
+def cell_columns(longitudes, size: float):
+    """
+    This function returns the column of the grid of some longitudes (in [-180, 180])
+    """
+    import numpy as np
+
+    _, n_cols = grid_shape(size)
+    return np.clip(np.floor((np.asarray(longitudes, dtype = np.float64) + 180) / size), 0, n_cols - 1).astype(np.int64)
+
+
+def normalize_longitude(longitude: float) -> float:
+    """
+    This function moves a longitude in the interval [-180, 180)
+    """
+    return (longitude + 180) % 360 - 180
+
+
+def build(df: pd.DataFrame, provider = None, level: str = 'address') -> dict:
+    """
+    This function creates the spatial index of the courses and saves it in the file spatial_index.npz.
+    The coordinates are read from the columns 'latitude' and 'longitude' if they exist
+    (see geocoding.geocode_courses()), otherwise the courses are geocoded (see geocoding.geocode(),
+    with provider None only the local cache is used). The courses without coordinates are not indexed
+    Args:
+        df (pd.DataFrame): The courses, indexed by document id
+        provider: The geocoding provider for the addresses that are not in the cache
+        level (str): The level of the geocoding ('address' or 'city')
+    Returns:
+        dict: The spatial index, as returned by get_spatial_index()
+    """
+    import numpy as np
+    import pandas as pd
+
+    if 'latitude' in df.columns and 'longitude' in df.columns:
+        points = df[['latitude', 'longitude']]
+    else:
+        from . import geocoding
+        points = geocoding.geocode(geocoding.make_addresses(df), provider, level)
+
+    latitudes = pd.to_numeric(points['latitude'], errors = 'coerce').to_numpy(dtype = np.float64)
+    longitudes = pd.to_numeric(points['longitude'], errors = 'coerce').to_numpy(dtype = np.float64)
+    doc_ids = np.asarray(df.index, dtype = np.int64)
+    present = np.isfinite(latitudes) & np.isfinite(longitudes)
+    latitudes, longitudes, doc_ids = latitudes[present], normalize_longitude(longitudes[present]), doc_ids[present]
+
+    # Sorting the courses by cell (and by document id in the same cell)
+    _, n_cols = grid_shape(cell_size)
+    cells = cell_rows(latitudes, cell_size) * n_cols + cell_columns(longitudes, cell_size)
+    order = np.lexsort((doc_ids, cells))
+    spatial_index = {
+        'cell_size': float(cell_size),
+        'cells': cells[order],
+        'latitudes': latitudes[order],
+        'longitudes': longitudes[order],
+        'doc_ids': doc_ids[order],
+    }
+
+    os.makedirs(os.path.dirname(path_spatial_index), exist_ok = True)
+    with open(path_spatial_index + '.tmp', "wb") as f:
+        np.savez(f, **spatial_index)
+    os.replace(path_spatial_index + '.tmp', path_spatial_index)
+
+    # Keeping the index in memory, so that it is not read again from the file
+    file_cache.store(path_spatial_index, spatial_index)
+    return spatial_index
+
+
+def load(f) -> dict:
+    """
+    This function reads the spatial index from the opened spatial_index.npz file (the loader for the file_cache)
+    Args:
+        f (file): The opened binary file
+    Returns:
+        dict: The spatial index
+    """
+    import numpy as np
+
+    with np.load(io.BytesIO(f.read())) as arrays:
+        spatial_index = {name: arrays[name] for name in arrays.files}
+    spatial_index['cell_size'] = float(spatial_index['cell_size'])
+    return spatial_index
+
+
+def get_spatial_index() -> dict:
+    """
+    This function loads the spatial index from the spatial_index.npz file
+    The file is read only the first time (or when it changes on disk)
+    If the file does not exists it returns None
+    Returns:
+        dict: The size of the cells and the courses sorted by cell
+            (arrays 'cells', 'latitudes', 'longitudes' and 'doc_ids')
+    """
+    try:
+        return file_cache.load(path_spatial_index, load, mode = "rb")
+    except Exception as e:
+        return None
+
+
+def generation() -> tuple:
+    """
+    This function returns the generation of the spatial index, used in the keys of the result caches
+    Returns:
+        tuple: The signature of the spatial_index.npz file
+    """
+    return (file_cache.file_signature(path_spatial_index),)
+
+
+def box_positions(spatial_index: dict, south: float, west: float, north: float, east: float):
+    """
+    This function returns the positions (in the sorted arrays) of the courses in the cells
+    that overlap a bounding box. If west > east the box crosses the antimeridian
+    Args:
+        spatial_index (dict): The spatial index
+        south, west, north, east (float): The bounds of the box in degrees
+    Returns:
+        np.ndarray: The positions of the courses
+    """
+    import numpy as np
+
+    size = spatial_index['cell_size']
+    _, n_cols = grid_shape(size)
+    cells = spatial_index['cells']
+
+    first_column, last_column = cell_columns([west, east], size)
+    column_ranges = [(first_column, last_column)] if west <= east else [(first_column, n_cols - 1), (0, last_column)]
+    first_row, last_row = cell_rows([south, north], size)
+
+    # For each row of the grid the cells of a range of columns are contiguous in the sorted arrays
+    lst_positions = []
+    for row in range(first_row, last_row + 1):
+        for column_start, column_end in column_ranges:
+            start = np.searchsorted(cells, row * n_cols + column_start, side = 'left')
+            end = np.searchsorted(cells, row * n_cols + column_end, side = 'right')
+            if end > start:
+                lst_positions.append(np.arange(start, end))
+    if len(lst_positions) == 0:
+        return np.zeros(0, dtype = np.int64)
+    return np.concatenate(lst_positions)
+
+
+def bbox_ids(south: float, west: float, north: float, east: float):
+    """
+    This function returns the courses inside a bounding box
+    Args:
+        south, west, north, east (float): The bounds of the box in degrees (west > east if the box crosses the antimeridian)
+    Returns:
+        np.ndarray: The sorted ids of the courses (None if the spatial index has not been computed yet)
+    """
+    import numpy as np
+
+    spatial_index = get_spatial_index()
+    if spatial_index is None:
+        return None
+
+    south, north = max(south, -90.0), min(north, 90.0)
+    if east - west >= 360:
+        west, east = -180.0, 180.0
+    else:
+        west, east = normalize_longitude(west), normalize_longitude(east)
+    positions = box_positions(spatial_index, south, west, north, east)
+
+    # The exact check on the courses of the cells at the border of the box
+    latitudes, longitudes = spatial_index['latitudes'][positions], spatial_index['longitudes'][positions]
+    inside = (latitudes >= south) & (latitudes <= north)
+    if west <= east:
+        inside &= (longitudes >= west) & (longitudes <= east)
+    else:
+        inside &= (longitudes >= west) | (longitudes <= east)
+    return np.sort(spatial_index['doc_ids'][positions[inside]])
+
+
+def distances_km(latitude: float, longitude: float, latitudes, longitudes):
+    """
+    This function computes the great circle distances (haversine formula) between a point and some points
+    Args:
+        latitude, longitude (float): The point in degrees
+        latitudes, longitudes (np.ndarray): The other points in degrees
+    Returns:
+        np.ndarray: The distances in km
+    """
+    import numpy as np
+
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2, lon2 = np.radians(latitudes), np.radians(longitudes)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * earth_radius_km * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def radius_ids(latitude: float, longitude: float, radius_km: float):
+    """
+    This function returns the courses within a distance from a point
+    Args:
+        latitude, longitude (float): The point in degrees
+        radius_km (float): The distance in km
+    Returns:
+        np.ndarray: The sorted ids of the courses (None if the spatial index has not been computed yet)
+    """
+    import numpy as np
+
+    spatial_index = get_spatial_index()
+    if spatial_index is None:
+        return None
+
+    # The bounding box of the circle: the longitudes are wider far from the equator,
+    # and near the poles the circle covers all the longitudes
+    angle = radius_km / earth_radius_km
+    south, north = latitude - math.degrees(angle), latitude + math.degrees(angle)
+    if south <= -90 or north >= 90 or math.sin(angle) >= math.cos(math.radians(latitude)):
+        west, east = -180.0, 180.0
+    else:
+        delta = math.degrees(math.asin(math.sin(angle) / math.cos(math.radians(latitude))))
+        west, east = normalize_longitude(longitude - delta), normalize_longitude(longitude + delta)
+    positions = box_positions(spatial_index, max(south, -90.0), west, min(north, 90.0), east)
+
+    # The exact check of the distance only on the courses of the cells of the box
+    distances = distances_km(latitude, longitude, spatial_index['latitudes'][positions], spatial_index['longitudes'][positions])
+    return np.sort(spatial_index['doc_ids'][positions[distances <= radius_km]])
+
+
+def as_area(field: str, value) -> tuple:
+    """
+    This function returns the parameters of a spatial filter, given as a tuple or as text:
+        'near': (latitude, longitude, radius_km), '45.46,9.19,50' or 'Milan,Italy;50'
+            (the place is resolved with the geocoding cache, without requests to a provider)
+        'bbox': (south, west, north, east) or '45,9,46,10'
+    Args:
+        field (str): 'near' or 'bbox'
+        value: The filter
+    Returns:
+        tuple: The parameters of the filter as floats
+    Raises:
+        ValueError: If the filter is not valid
+    """
+    if isinstance(value, (list, tuple)) and len(value) == 1:
+        value = value[0]
+    if isinstance(value, str):
+        if field == 'near' and ';' in value:
+            place, radius = value.rsplit(';', 1)
+            from . import geocoding
+            point = geocoding.geocode([place]).iloc[0]
+            if point['source'] is None:
+                raise ValueError(f"Unknown place {place}")
+            value = (point['latitude'], point['longitude'], radius)
+        else:
+            value = value.split(',')
+    try:
+        value = tuple(float(part) for part in value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {field} filter {value}")
+    if len(value) != (3 if field == 'near' else 4):
+        raise ValueError(f"Invalid {field} filter {value}")
+    return value
+
+
+def filter_ids(field: str, area: tuple):
+    """
+    This function returns the courses that satisfy a spatial filter
+    Args:
+        field (str): 'near' or 'bbox'
+        area (tuple): The parameters of the filter (see as_area())
+    Returns:
+        np.ndarray: The sorted ids of the courses (None if the spatial index has not been computed yet)
+    """
+    if field == 'near':
+        return radius_ids(*area)
+    return bbox_ids(*area)
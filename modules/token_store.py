@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import hashlib
+
+from . import engine_v1
+
+path_token_store = 'data/tokens.sqlite'
+
+# SQLite limits the number of parameters of a query, so the lookups are done in batches
+batch_size = 500
+
+
+def connect() -> sqlite3.Connection:
+    """
+    This function opens the token store (a SQLite database), creating its tables if needed:
+    - tokens: the words produced by the analyzer, for each key (see text_key())
+    - documents: the key of the text of each field of each document
+    Returns:
+        sqlite3.Connection: The connection to the database
+    """
+    conn = sqlite3.connect(path_token_store)
+    conn.execute("CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, words TEXT NOT NULL)")
+    conn.execute("CREATE TABLE IF NOT EXISTS documents (doc_id INTEGER NOT NULL, field TEXT NOT NULL, key TEXT NOT NULL, "
+                 "PRIMARY KEY (doc_id, field))")
+    return conn
+
+
+def analyzer_hash() -> str:
+    """
+    This function returns a hash of the configuration of the analyzer (see engine_v1.analyzer_config())
+    Returns:
+        str: The hash of the configuration
+    """
+    config = json.dumps(engine_v1.analyzer_config(), sort_keys = True)
+    return hashlib.sha1(config.encode('utf-8')).hexdigest()
+
+
+def text_key(text: str, config_hash: str) -> str:
+    """
+    This function returns the key of a text in the token store, i.e. the hash of the text
+    and of the analyzer configuration. If the text or the analyzer changes also the key changes
+    Args:
+        text (str): The text
+        config_hash (str): The hash of the analyzer configuration
+    Returns:
+        str: The key of the text
+    """
+    return hashlib.sha1((config_hash + '\0' + text).encode('utf-8')).hexdigest()
+
+
+def analyze(texts: pd.Series, field: str, n_jobs: int = 1) -> pd.Series:
+    """
+    This function returns the preprocessed words of each text of a column, as engine_v1.preprocess()
+    would do. The words are read from the token store when the same text has already been
+    analyzed with the same analyzer, so only the new or changed texts are preprocessed
+    (with engine_v1.preprocess_batch()) and then saved in the store
+    Args:
+        texts (pd.Series): The texts, indexed by document id (e.g. the 'description' column)
+        field (str): The name of the field (e.g. 'description')
+        n_jobs (int): The number of processes used to preprocess the new texts
+    Returns:
+        pd.Series: The lists of words, with the same index of texts
+    """
+    import pandas as pd
+
+    config_hash = analyzer_hash()
+    index = texts.index
+    texts = [text if isinstance(text, str) else '' for text in texts.values]
+    keys = [text_key(text, config_hash) for text in texts]
+
+    conn = connect()
+    try:
+        with conn:
+            # Looking for the texts already analyzed
+            unique_keys = list(set(keys))
+            words = {}
+            for i in range(0, len(unique_keys), batch_size):
+                batch = unique_keys[i:i + batch_size]
+                rows = conn.execute(f"SELECT key, words FROM tokens WHERE key IN ({','.join('?' * len(batch))})", batch)
+                for key, value in rows:
+                    words[key] = json.loads(value)
+
+            # Analyzing only the new texts (each distinct text once)
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in words and key not in missing:
+                    missing[key] = text
+            if len(missing) > 0:
+                analyzed = engine_v1.preprocess_batch(list(missing.values()), n_jobs = n_jobs)
+                words.update(zip(missing.keys(), analyzed))
+                conn.executemany("INSERT OR REPLACE INTO tokens (key, words) VALUES (?, ?)",
+                                 [(key, json.dumps(words[key])) for key in missing])
+
+            # Saving which text is associated to each document
+            conn.executemany("INSERT OR REPLACE INTO documents (doc_id, field, key) VALUES (?, ?, ?)",
+                             [(int(doc_id), field, key) for doc_id, key in zip(index, keys)])
+    finally:
+        conn.close()
+
+    return pd.Series([list(words[key]) for key in keys], index = index, dtype = object)
+
+
+def get_tokens(doc_id: int, field: str) -> list:
+    """
+    This function returns the words of a field of a document, as saved
+    in the token store by the last call of analyze() on that field
+    Args:
+        doc_id (int): The id of the document
+        field (str): The name of the field
+    Returns:
+        list: The preprocessed words (None if the document is not in the store)
+    """
+    conn = connect()
+    try:
+        row = conn.execute("SELECT words FROM documents JOIN tokens ON documents.key = tokens.key "
+                           "WHERE doc_id = ? AND field = ?", (int(doc_id), field)).fetchone()
+    finally:
+        conn.close()
+
+    if row is None:
+        return None
+    return json.loads(row[0])
@@ -0,0 +1,97 @@
+import random
+
+import pandas as pd
+import pytest
+
+from modules import engine_v1
+from modules import boolean_query
+from modules import postings
+
+pool = ['data', 'science', 'engineering', 'business', 'management', 'design']
+
+# The queries and the same condition on the (not preprocessed) words of a document
+queries = [
+    ('data', lambda w: 'data' in w),
+    ('data science', lambda w: 'data' in w and 'science' in w),
+    ('data AND science AND design', lambda w: 'data' in w and 'science' in w and 'design' in w),
+    ('data OR business', lambda w: 'data' in w or 'business' in w),
+    ('data AND (science OR engineering) NOT business',
+     lambda w: 'data' in w and ('science' in w or 'engineering' in w) and 'business' not in w),
+    ('(data OR design) AND NOT (science OR management)',
+     lambda w: ('data' in w or 'design' in w) and not ('science' in w or 'management' in w)),
+    ('NOT business', lambda w: 'business' not in w),
+    ('NOT NOT business', lambda w: 'business' in w),
+    ('NOT data OR NOT science', lambda w: 'data' not in w or 'science' not in w),
+    ('NOT (data AND science) management', lambda w: not ('data' in w and 'science' in w) and 'management' in w),
+    ('data OR (NOT science AND NOT design)', lambda w: 'data' in w or ('science' not in w and 'design' not in w)),
+    ('missing OR data', lambda w: 'data' in w),
+    ('missing AND data', lambda w: False),
+    ('the AND of', lambda w: False),
+    ('data AND the', lambda w: 'data' in w),
+]
+
+
+@pytest.fixture
+def corpus(monkeypatch):
+    rng = random.Random(0)
+    # Not contiguous document ids, as the ones of the dataset
+    documents = {doc_id: set(rng.sample(pool, rng.randint(0, 4))) for doc_id in sorted(rng.sample(range(1000), 200))}
+
+    vocabulary = {}
+    inverted_index = {}
+    for doc_id, words in documents.items():
+        for word in words:
+            term_id = vocabulary.setdefault(engine_v1.preprocess(word)[0], len(vocabulary))
+            inverted_index.setdefault(term_id, []).append(doc_id)
+    inverted_index = {term_id: postings.to_array(doc_ids) for term_id, doc_ids in inverted_index.items()}
+
+    # The negations without a positive condition need all the documents of the dataset
+    monkeypatch.setattr(engine_v1, 'df_original', pd.DataFrame({'description': [''] * len(documents)}, index = list(documents)))
+    return documents, inverted_index, vocabulary
+
+
+def test_parse():
+    assert boolean_query.parse('data AND (science OR engineering) NOT business') == \
+        ('and', (('term', 'data'), ('or', (('term', 'scienc'), ('term', 'engin'))), ('not', ('term', 'busi'))))
+    # Two words without operator are in AND, the lower case operators are normal words (here stopwords)
+    assert boolean_query.parse('data science') == boolean_query.parse('data AND science')
+    assert boolean_query.parse('data and science') == boolean_query.parse('data science')
+    assert boolean_query.parse('NOT business') == ('not', ('term', 'busi'))
+    # A query made only of stopwords has no words
+    assert boolean_query.parse('the AND of') is None
+    assert boolean_query.parse('NOT the') is None
+
+
+@pytest.mark.parametrize('query', ['data AND', 'OR data', '(data', 'data)', 'NOT', '()', 'data AND OR science'])
+def test_parse_errors(query):
+    with pytest.raises(ValueError):
+        boolean_query.parse(query)
+
+
+@pytest.mark.parametrize('query, condition', queries)
+def test_get_document_ids(corpus, query, condition):
+    documents, inverted_index, vocabulary = corpus
+
+    document_ids = boolean_query.get_document_ids(boolean_query.parse(query), inverted_index, vocabulary)
+
+    assert list(document_ids) == [doc_id for doc_id, words in documents.items() if condition(words)]
+
+
+def test_cursors_skip_forward(corpus):
+    documents, inverted_index, vocabulary = corpus
+    cursor = boolean_query.build_cursor(boolean_query.parse('data science'), inverted_index, vocabulary)
+    expected = [doc_id for doc_id, words in documents.items() if 'data' in words and 'science' in words]
+
+    # Seeking a target before the current document does not move the cursor
+    assert cursor.seek(expected[2]) == expected[2]
+    assert cursor.seek(expected[0]) == expected[2]
+    assert cursor.seek(expected[2] + 1) == expected[3]
+    assert cursor.seek(expected[-1] + 1) is None
+
+
+def test_gallop():
+    lst = postings.to_array([2, 3, 5, 8, 13, 21, 34, 55, 89])
+    for target in range(0, 100):
+        for lo in range(len(lst)):
+            expected = next((i for i in range(lo, len(lst)) if lst[i] >= target), len(lst))
+            assert postings.gallop(lst, target, lo) == expected
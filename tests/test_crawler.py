@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from modules import crawler
+from modules.frontier import Frontier
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the website: /list/?PG=n are the listing pages with 3 courses each (the page n
+    also links the first course of the page n - 1), /c/... are the course pages.
+    /c/1-1 answers 429 with Retry-After: 1 the first time, /c/2-1 redirects to itself.
+    The first listing page is slow, so the page 2 (and its link to /c/1-0) is fetched before it
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.hits.append((self.path, time.monotonic()))
+            n = sum(1 for path, _ in server.hits if path == self.path)
+        if self.path == '/c/1-1' and n == 1:
+            return self.answer(429, b'Too Many Requests', {'Retry-After': '1'})
+        if self.path == '/c/2-1':
+            return self.answer(302, b'', {'Location': '/c/2-1'})
+        if self.path == '/list/':
+            time.sleep(0.3)
+        if self.path.startswith('/list'):
+            page_num = int(self.path.split('PG=')[1]) if 'PG=' in self.path else 1
+            links = [f'/c/{page_num}-{i}' for i in range(3)] + ([f'/c/{page_num - 1}-0'] if page_num > 1 else [])
+            return self.answer(200, ''.join(f'<a class="courseLink" href="{link}">Course</a>' for link in links).encode())
+        self.answer(200, f'<html>{self.path}</html>'.encode())
+
+    def answer(self, status, body, headers = {}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.hits = []
+    server.lock = threading.Lock()
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_port}'
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_crawler():
+    return crawler.Crawler(requests_per_second = 100, burst = 10, workers = 4, max_retries = 3, backoff = 0.05)
+
+
+def requests_of(server, path):
+    return [moment for hit, moment in server.hits if hit == path]
+
+
+def test_token_bucket_rate():
+    bucket = crawler.TokenBucket(20, 1)
+    start = time.monotonic()
+    for _ in range(11):
+        bucket.acquire()
+    assert time.monotonic() - start >= 0.45
+
+
+def test_retry_after():
+    assert crawler.retry_after('3') == 3.0
+    assert crawler.retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert crawler.retry_after('soon') is None
+    assert crawler.retry_after(None) is None
+
+
+def test_crawl(server, tmp_path):
+    urls = crawler.crawl(server.url + '/list', 2, str(tmp_path / 'html'), 'page_', 3, page_size = 3, crawler = make_crawler(),
+                         frontier = str(tmp_path / 'frontier.sqlite'))
+
+    # The duplicate link of the page 2 is not added again, and it keeps the position of the page 1
+    assert urls == [server.url + path for path in ['/c/1-0', '/c/1-1', '/c/1-2', '/c/2-0', '/c/2-1', '/c/2-2']]
+
+    # The 429 answer is retried after the time of the Retry-After header
+    first, second = requests_of(server, '/c/1-1')
+    assert second - first >= 0.9
+
+    # The redirect loop is a failure of its page, the other pages are saved
+    assert crawler.last_stats['failures'] == 1
+    assert crawler.last_stats['courses'] == 5
+    # /c/1-0 has been saved in the subfolder of the page 2 and then moved to the one of the page 1
+    assert len(os.listdir(tmp_path / 'html' / 'page_1')) == 3
+    assert len(os.listdir(tmp_path / 'html' / 'page_2')) == 2
+
+    frontier = Frontier(str(tmp_path / 'frontier.sqlite'))
+    assert frontier.counts()['courses'] == {'pending': 0, 'fetched': 5, 'failed': 1}
+    frontier.close()
+
+
+def test_resume(server, tmp_path):
+    path = str(tmp_path / 'frontier.sqlite')
+    folder = str(tmp_path / 'html')
+    crawler.crawl(server.url + '/list', 2, folder, 'page_', 3, page_size = 3, crawler = make_crawler(), frontier = path)
+    n_requests = len(server.hits)
+
+    # A crawl interrupted after the listing pages: a page saved but not marked, and a page not saved yet
+    frontier = Frontier(path)
+    with frontier.conn:
+        frontier.conn.execute("UPDATE courses SET state = 'pending' WHERE url IN (?, ?)", (server.url + '/c/1-0', server.url + '/c/1-2'))
+    frontier.close()
+    os.remove(os.path.join(folder, 'page_1', crawler.quote(server.url + '/c/1-2', safe = '') + '.html'))
+
+    urls = crawler.crawl(server.url + '/list', 3, folder, 'page_', 3, page_size = 3, crawler = make_crawler(), frontier = path)
+
+    # Only the new listing page, its courses, the page not saved and the failed page (the redirect loop) are requested,
+    # each one once (the redirect loop is followed by requests up to its limit of redirects)
+    new_requests = [hit for hit, _ in server.hits[n_requests:]]
+    assert set(new_requests) == {'/list/?PG=3', '/c/3-0', '/c/3-1', '/c/3-2', '/c/1-2', '/c/2-1'}
+    assert all(new_requests.count(hit) == 1 for hit in set(new_requests) - {'/c/2-1'})
+    assert len(urls) == 9
+    assert crawler.last_stats['skipped'] == 1
+
+    # The failed page is not retried after max_attempts attempts
+    crawler.crawl(server.url + '/list', 3, folder, 'page_', 3, page_size = 3, crawler = make_crawler(), frontier = path, max_attempts = 2)
+    n_requests = len(server.hits)
+    crawler.crawl(server.url + '/list', 3, folder, 'page_', 3, page_size = 3, crawler = make_crawler(), frontier = path, max_attempts = 2)
+    assert len(server.hits) == n_requests
@@ -0,0 +1,187 @@
+import os
+import random
+
+import pandas as pd
+import pytest
+
+from modules import file_cache
+from modules import index_store
+from modules import engine_v1
+from modules import engine_v2
+from modules import engine_v3
+from modules import boolean_query
+from modules import search_service
+
+pool = 'data science machine learning computer engineering business management finance physics design history'.split()
+
+
+def make_df(n = 60, seed = 0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(n):
+        rows.append({'courseName': 'MSc ' + ' '.join(rng.sample(pool, 2)), 'universityName': rng.choice(['Sapienza', 'Polimi']),
+                     'facultyName': 'Faculty', 'isItFullTime': 'Full time',
+                     'description': ' '.join(rng.choice(pool + ['the', 'of']) for _ in range(rng.randint(3, 15))),
+                     'startDate': 'September', 'fees': rng.choice(['', '€12,000', '£9,500']), 'modality': 'MSc',
+                     'duration': rng.choice(['1 year', '2 years']), 'city': rng.choice(['Rome', 'Milan']), 'country': 'Italy',
+                     'administration': 'On Campus', 'url': f'https://example.com/{i}', 'index': 2 * i + 1})
+    return pd.DataFrame(rows).set_index('index')
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # Each test has its own data folder, and starts as a new process: nothing in memory
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'data').mkdir()
+    for module in (engine_v1, engine_v2, engine_v3):
+        monkeypatch.setattr(module, 'df_original', None)
+        module.result_cache.clear()
+    monkeypatch.setattr(index_store, 'seen_versions', {})
+    file_cache.invalidate()
+    yield tmp_path
+    file_cache.invalidate()
+
+
+def test_v1_without_dataset(workdir):
+    engine_v1.create_vocabulary(make_df())
+    engine_v1.create_inverted_index(positional = True)
+
+    # A new process finds the indexes on disk, but the dataset has not been loaded
+    engine_v1.df_original = None
+    assert engine_v1.get_document_ids(['data']) is not None
+    assert engine_v1.search('data') is None
+    assert engine_v1.phrase_search('machine learning') is None
+    assert engine_v1.get_positions([1, 3]) is None
+    assert engine_v1.create_inverted_index() is None
+    assert boolean_query.search('data OR science') is None
+    # The negations without a positive condition need all the documents
+    assert boolean_query.get_document_ids(boolean_query.parse('NOT data')) is None
+    assert boolean_query.get_document_ids(boolean_query.parse('data NOT science')) is not None
+
+
+def test_v2_v3_without_dataset(workdir):
+    df = make_df()
+    engine_v2.create_inverted_index(df)
+    engine_v3.create_inverted_index(df)
+
+    for engine in (engine_v2, engine_v3):
+        engine.df_original = None
+        assert engine.search('data science') is None
+        assert engine.search('data science', disjunctive = True) is None
+        assert engine.search_many(['data science']) is None
+
+
+def test_warm_up_without_v1_index(workdir):
+    df = make_df()
+    search_service.warm_up(df)
+    expected = search_service.run_query('v1', 'data science')
+    assert len(expected) > 0
+
+    # A new process, where only the index of the engine_v1 module is missing
+    (workdir / 'data' / 'inverted_index.json').unlink()
+    for module in (engine_v1, engine_v2, engine_v3):
+        module.df_original = None
+        module.result_cache.clear()
+    file_cache.invalidate()
+
+    search_service.warm_up(df)
+    assert engine_v1.get_inverted_index() is not None
+    assert search_service.run_query('v1', 'data science') == expected
+    for engine in ('v2', 'v3'):
+        assert len(search_service.run_query(engine, 'data science')) > 0
+
+
+def brute_force_and(df, words):
+    words = set(engine_v1.analyze_query(words))
+    return sorted(doc_id for doc_id, description in df['description'].items() if words <= set(engine_v1.preprocess(description)))
+
+
+def test_v2_v3_builds_do_not_touch_v1(workdir):
+    engine_v2.create_inverted_index(make_df())
+    engine_v3.create_inverted_index(make_df())
+    assert not (workdir / 'data' / 'vocabulary.json').exists()
+    assert not (workdir / 'data' / 'inverted_index.json').exists()
+    assert engine_v1.df_original is None
+
+
+def test_v2_rebuild_on_changed_dataset(workdir):
+    # The shared files of the engine_v1 module are built on a first dataset...
+    old = make_df(seed = 0)
+    engine_v1.create_vocabulary(old)
+    engine_v1.create_inverted_index()
+    engine_v2.create_inverted_index(old)
+    version = index_store.current_version('v2')
+
+    # ...and the vocabulary of the engine_v1 module is rebuilt on a new one, without its index
+    new = make_df(n = 80, seed = 1)
+    engine_v1.create_vocabulary(new)
+    engine_v2.create_inverted_index(new)
+    engine_v3.create_inverted_index(new)
+
+    for query in ['data science', 'machine learning design', 'history', 'physics finance']:
+        expected = brute_force_and(new, query)
+        assert sorted(item[1][0] for item in engine_v2.search(query, k = 1000)) == expected
+        assert engine_v2.get_document_ids(engine_v1.analyze_query(query)).tolist() == expected
+        # The previous version, still readable by the queries that are using it, keeps its own results
+        assert engine_v2.get_document_ids(engine_v1.analyze_query(query), version).tolist() == brute_force_and(old, query)
+
+    # The negations are evaluated on the documents of the version
+    tree = boolean_query.parse('NOT data')
+    assert engine_v2.get_boolean_document_ids(tree).tolist() == sorted(set(new.index) - set(brute_force_and(new, 'data')))
+    assert engine_v3.get_boolean_document_ids(tree).tolist() == sorted(set(new.index) - set(engine_v3.get_document_ids(['data'])))
+    assert engine_v2.get_boolean_document_ids(tree, version).tolist() == sorted(set(old.index) - set(brute_force_and(old, 'data')))
+
+
+def test_search_many_matches_search(workdir):
+    df = make_df(n = 80)
+    engine_v2.create_inverted_index(df)
+    engine_v3.create_inverted_index(df)
+    queries = ['data science', 'machine learning design', 'history', 'physics OR', 'unknownword', 'Sapienza data']
+
+    for engine in (engine_v2, engine_v3):
+        for disjunctive in (False, True):
+            lst_heaps = engine.search_many(queries, k = 5, disjunctive = disjunctive)
+            for query, heap in zip(queries, lst_heaps):
+                expected = engine.search(query, k = 5, disjunctive = disjunctive)
+                if expected is None:
+                    assert heap is None
+                    continue
+                assert [item[1][0] for item in sorted(heap)] == [item[1][0] for item in sorted(expected)]
+                assert [item[0] for item in sorted(heap)] == pytest.approx([item[0] for item in sorted(expected)], rel = 1e-9)
+
+
+def test_manifest_covers_the_files_read(workdir, monkeypatch):
+    df = make_df()
+    engine_v1.create_vocabulary(df)
+    engine_v1.create_inverted_index()
+    engine_v2.create_inverted_index(df)
+    engine_v3.create_inverted_index(df)
+
+    # Recording the files read by the queries, from a new process
+    read = []
+    load = file_cache.load
+    def recording_load(path, *args, **kwargs):
+        read.append(path)
+        return load(path, *args, **kwargs)
+    monkeypatch.setattr(file_cache, 'load', recording_load)
+    file_cache.invalidate()
+    engine_v1.analyze_query.cache_clear()
+
+    for engine in (engine_v2, engine_v3):
+        read.clear()
+        engine.result_cache.clear()
+        engine.search('data science')
+        engine.search('data science', disjunctive = True)
+        engine.search('data AND NOT (science OR design)', boolean = True)
+        engine.search('NOT data', boolean = True)
+        engine.search_many(['data science', 'history'])
+        engine.search_many(['data science', 'history'], disjunctive = True)
+
+        manifest = index_store.get_manifest(engine.engine_name)
+        directory = index_store.version_directory(engine.engine_name, manifest['version'])
+        files = {os.path.join(directory, name) for name in list(manifest['files']) + [index_store.name_manifest]}
+        # Apart from the pointer to the version in use, all the files read are in the manifest
+        current = os.path.join(index_store.engine_directory(engine.engine_name), index_store.name_current)
+        assert len(read) > 0
+        assert set(read) - {current} <= files
+        assert index_store.verify(engine.engine_name)
@@ -0,0 +1,116 @@
+import pytest
+
+from modules import geocoding
+
+
+@pytest.fixture(autouse = True)
+def cache(tmp_path, monkeypatch):
+    # Each test uses its own geocoding cache
+    monkeypatch.setattr(geocoding, 'path_geocoding_cache', str(tmp_path / 'geocoding.sqlite'))
+
+
+table = {
+    'Sapienza University of Rome,Rome,Italy': (41.90, 12.51),
+    'Roma Tre University,Rome,Italy': (41.86, 12.48),
+    'University of Milan,Milan,Italy': (45.46, 9.19),
+    'Imperial College London,London,United Kingdom': (51.50, -0.17),
+}
+
+
+def test_normalize():
+    assert geocoding.normalize(' Sapienza  University of Rome , ROME,Italy ') == 'sapienza university of rome,rome,italy'
+    assert geocoding.fallback_keys('sapienza,rome,italy') == ['rome,italy', 'italy']
+
+
+def test_cache_hits():
+    addresses = list(table) + ['sapienza university of rome, rome, italy']
+    provider = geocoding.StubProvider(table)
+    points = geocoding.geocode(addresses, provider)
+
+    # The same address written in two ways is sent only once
+    assert provider.requests == 4
+    assert list(points['source']) == ['stub'] * 5
+    assert points['latitude'].iloc[4] == 41.90
+
+    # The second time all the addresses are read from the cache
+    points = geocoding.geocode(addresses, provider)
+    assert provider.requests == 4
+    assert list(points['source']) == ['cache'] * 5
+    assert geocoding.last_stats['cache_hits'] == 4
+
+    # Offline (without provider) the cache is still used
+    points = geocoding.geocode(addresses)
+    assert list(points['source']) == ['cache'] * 5
+
+
+def test_miss_and_fallback():
+    addresses = list(table) + ['Unknown University,Rome,Italy', 'Unknown Institute,Paris,France']
+    provider = geocoding.StubProvider(table)
+    points = geocoding.geocode(addresses, provider)
+
+    # The address not found takes the mean of the addresses of its city, the other one is not resolved
+    assert points['source'].iloc[4] == 'city'
+    assert points['latitude'].iloc[4] == pytest.approx((41.90 + 41.86) / 2)
+    assert points['source'].iloc[5] is None
+    assert geocoding.last_stats['unresolved'] == 1
+
+    # The misses are not sent again, unless retry_misses is True
+    geocoding.geocode(addresses, provider)
+    assert provider.requests == 6
+    geocoding.geocode(addresses, provider, retry_misses = True)
+    assert provider.requests == 8
+
+
+def test_running_mean_counts_each_address_once():
+    provider = geocoding.StubProvider({'Sapienza University of Rome,Rome,Italy': None, 'Roma Tre University,Rome,Italy': (41.86, 12.48)})
+    geocoding.geocode(['Sapienza University of Rome,Rome,Italy', 'Roma Tre University,Rome,Italy'], provider)
+
+    # The address found later (with retry_misses) enters the mean once, the one already found is not counted again
+    provider = geocoding.StubProvider(table)
+    geocoding.geocode(['Sapienza University of Rome,Rome,Italy', 'Roma Tre University,Rome,Italy'], provider, retry_misses = True)
+    conn = geocoding.connect()
+    latitude, n = conn.execute("SELECT latitude, n FROM places WHERE key = 'rome,italy'").fetchone()
+    conn.close()
+    assert n == 2
+    assert latitude == pytest.approx((41.90 + 41.86) / 2)
+
+
+def test_failed_request():
+    provider = geocoding.StubProvider(table, failing = ['University of Milan,Milan,Italy'])
+    points = geocoding.geocode(list(table), provider, batch_size = 1)
+
+    # The failure does not stop the other batches: the address is a miss (resolved with the mean of its
+    # country) and it is not saved in the cache
+    assert list(points['source']) == ['stub', 'stub', 'country', 'stub']
+    assert geocoding.last_stats['provider_failures'] == 1
+
+    # So it is sent again by the next call
+    provider = geocoding.StubProvider(table)
+    points = geocoding.geocode(list(table), provider)
+    assert provider.requests == 1
+    assert points['source'].iloc[2] == 'stub'
+
+
+def test_quota_exceeded():
+    provider = geocoding.StubProvider(table, max_requests = 3)
+    points = geocoding.geocode(list(table), provider, batch_size = 2)
+
+    # The results obtained before the end of the quota are saved, the remaining addresses are not sent
+    assert provider.requests == 3
+    assert list(points['source'].iloc[:3]) == ['stub'] * 3
+    assert points['source'].iloc[3] is None
+
+    provider = geocoding.StubProvider(table)
+    points = geocoding.geocode(list(table), provider)
+    assert provider.requests == 1
+    assert list(points['source']) == ['cache'] * 3 + ['stub']
+
+
+def test_geocode_courses():
+    import pandas as pd
+
+    df = pd.DataFrame({'universityName': ['Sapienza University of Rome', 'University of Milan'],
+                       'city': ['Rome', 'Milan'], 'country': ['Italy', 'Italy']}, index = [10, 20])
+    df = geocoding.geocode_courses(df, geocoding.StubProvider(table))
+    assert list(df['latitude']) == [41.90, 45.46]
+    assert list(df['geocoding_source']) == ['stub', 'stub']
@@ -0,0 +1,43 @@
+import json
+import random
+
+import pytest
+
+from modules import index_builder
+
+
+def make_documents(shuffled):
+    rng = random.Random(1)
+    documents = [(doc_id, [f'w{rng.randint(0, 30)}' for _ in range(rng.randint(0, 8))]) for doc_id in range(300)]
+    if shuffled:
+        rng.shuffle(documents)
+    return documents
+
+
+@pytest.mark.parametrize('shuffled', [False, True])
+@pytest.mark.parametrize('max_postings', [5, 17, None])
+def test_build_inverted_index(tmp_path, shuffled, max_postings):
+    documents = make_documents(shuffled)
+    vocabulary = {f'w{i}': i for i in range(31)}
+    path = str(tmp_path / 'inverted_index.json')
+
+    n_terms = index_builder.build_inverted_index(iter(documents), vocabulary, path, max_postings, str(tmp_path))
+
+    expected = {}
+    for doc_id, lst_words in documents:
+        for word in lst_words:
+            expected.setdefault(str(vocabulary[word]), set()).add(doc_id)
+    with open(path) as f:
+        assert json.load(f) == {term_id: sorted(doc_ids) for term_id, doc_ids in expected.items()}
+    assert n_terms == len(expected)
+    # The runs are removed at the end
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['inverted_index.json']
+
+
+def test_merge_runs_duplicate_at_the_boundary(tmp_path):
+    block_1 = {0: [1, 2, 5], 1: [3]}
+    block_2 = {0: [5, 8], 2: [9]}
+    block_3 = {0: [3, 9]}
+    runs = [index_builder.write_run(block, str(tmp_path)) for block in (block_1, block_2, block_3)]
+
+    assert list(index_builder.merge_runs(runs)) == [(0, [1, 2, 3, 5, 8, 9]), (1, [3]), (2, [9])]
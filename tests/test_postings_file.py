@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from modules import postings_file
+
+
+def write_and_load(tmp_path, inverted_index):
+    path = str(tmp_path / 'postings.bin')
+    size = postings_file.write(path, inverted_index)
+    assert size == (tmp_path / 'postings.bin').stat().st_size
+    with open(path, 'rb') as f:
+        return postings_file.load(f)
+
+
+@pytest.mark.parametrize('values', [[], [0], [127], [128], [0, 1, 127, 128, 255, 16383, 16384, 2 ** 35, 2 ** 62]])
+def test_varint_round_trip(values):
+    encoded = postings_file.encode_varint(values)
+    decoded = postings_file.decode_varint(np.frombuffer(encoded, dtype = np.uint8))
+    assert decoded.tolist() == values
+
+
+def test_varint_sizes():
+    # 7 bits in each byte
+    assert len(postings_file.encode_varint([127])) == 1
+    assert len(postings_file.encode_varint([128])) == 2
+    assert len(postings_file.encode_varint([2 ** 14 - 1, 2 ** 14])) == 5
+    assert postings_file.encode_varint([300]) == bytes([0b10101100, 0b00000010])
+
+
+def test_varint_random():
+    rng = np.random.default_rng(0)
+    values = (rng.pareto(1.0, 10000) * 10).astype(np.int64)
+    decoded = postings_file.decode_varint(np.frombuffer(postings_file.encode_varint(values), dtype = np.uint8))
+    assert np.array_equal(decoded, values)
+
+
+def test_quantization_error_bound():
+    rng = np.random.default_rng(1)
+    weights = np.concatenate([rng.uniform(0, 3, 5000), [3.0, 1e-6, 2e-3]])
+    impacts, scale = postings_file.quantize(weights)
+    maximum = weights.max()
+    assert scale == pytest.approx(maximum / 255)
+    assert impacts.dtype == np.uint8 and impacts.min() >= 1 and impacts.max() == 255
+
+    errors = np.abs(impacts * scale - weights)
+    # At most half a step, apart from the weights below half a step, raised to the smallest code
+    small = weights < scale / 2
+    assert small.any()
+    assert np.all(errors[~small] <= maximum / 510 * (1 + 1e-9))
+    assert np.all(errors[small] <= maximum / 255)
+    assert np.all(impacts[small] == 1)
+
+
+def test_quantize_empty_and_zero():
+    impacts, scale = postings_file.quantize([])
+    assert len(impacts) == 0 and scale == 0.0
+    impacts, scale = postings_file.quantize([0.0, 0.0])
+    assert impacts.tolist() == [1, 1] and scale == 0.0
+
+
+def test_round_trip(tmp_path):
+    rng = np.random.default_rng(2)
+    inverted_index = {}
+    for term_id in [0, 3, 4, 10, 1000]:
+        doc_ids = np.sort(rng.choice(10 ** 6, size = rng.integers(1, 500), replace = False))
+        inverted_index[term_id] = (doc_ids, rng.uniform(0.01, 2, len(doc_ids)))
+    # A term without documents
+    inverted_index[7] = (np.zeros(0, dtype = np.int64), np.zeros(0))
+
+    postings = write_and_load(tmp_path, inverted_index)
+
+    assert len(postings) == 6
+    assert list(postings) == [0, 3, 4, 7, 10, 1000]
+    for term_id, (doc_ids, weights) in inverted_index.items():
+        read_ids, read_weights = postings[term_id]
+        assert read_ids.tolist() == doc_ids.tolist()
+        assert len(read_weights) == len(weights)
+        if len(weights) > 0:
+            assert np.all(np.abs(read_weights - weights) <= weights.max() / 255)
+        # The weights are the ones of dequantized()
+        impacts, scale = postings_file.quantize(weights)
+        assert np.array_equal(read_weights, impacts * scale)
+    assert [term_id for term_id, _ in postings.items()] == [0, 3, 4, 7, 10, 1000]
+
+
+def test_lookups(tmp_path):
+    postings = write_and_load(tmp_path, {2: ([5, 9], [1.0, 0.5]), 8: ([1], [2.0])})
+
+    assert 2 in postings and np.int64(8) in postings
+    assert 3 not in postings and -1 not in postings and 100 not in postings
+    # Only the integer term ids are looked up
+    assert '2' not in postings and None not in postings
+    assert postings.get(3) is None
+    assert postings.get(3, 'default') == 'default'
+    assert postings.get(8)[0].tolist() == [1]
+    with pytest.raises(KeyError):
+        postings[3]
+    # The same decoded list is returned from the cache
+    assert postings[2] is postings[2]
+
+
+def test_empty_index(tmp_path):
+    postings = write_and_load(tmp_path, {})
+    assert len(postings) == 0
+    assert list(postings) == []
+    assert postings.get(0) is None
+
+
+def test_not_a_postings_file(tmp_path):
+    path = tmp_path / 'postings.bin'
+    path.write_bytes(b'{"0": [[1, 0.5]]}')
+    with open(path, 'rb') as f:
+        with pytest.raises(ValueError):
+            postings_file.load(f)
+
+
+def test_dequantized(tmp_path):
+    from scipy.sparse import random as sparse_random
+    from modules import scoring
+    from modules import sparse_matrix
+
+    matrix = sparse_random(50, 20, density = 0.2, random_state = 3).tocsr()
+    vocabulary = {f'w{i}': i for i in range(20)}
+    inverted_index = scoring.to_arrays(sparse_matrix.inverted_index(matrix, np.arange(50), vocabulary))
+    postings = write_and_load(tmp_path, inverted_index)
+
+    # The matrix of dequantized() has the same weights of the postings file
+    quantized = postings_file.dequantized(matrix).tocsc()
+    for term_id in range(20):
+        start, end = quantized.indptr[term_id], quantized.indptr[term_id + 1]
+        doc_ids, weights = postings[term_id]
+        assert quantized.indices[start:end].tolist() == doc_ids.tolist()
+        assert np.array_equal(quantized.data[start:end], weights)
@@ -0,0 +1,93 @@
+import pytest
+
+from modules import range_index
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('£9,250.00 per year', (9250.0, '£')),
+    ('£24,000.50', (24000.0, '£')),
+    ('€12.500,00', (12500.0, '€')),
+    ('$1,000,000 total', (1000000.0, '$')),
+    ("Fees: 12'000 € per year", (12000.0, '€')),
+    ('UK: £9,250, International: £21,500', (21500.0, '£')),
+    ('€ 9.5', (9.0, '€')),
+    ('¥5000', (None, None)),
+    ('Please see the website', (None, None)),
+    (None, (None, None)),
+])
+def test_parse_fees(text, expected):
+    assert range_index.parse_fees(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('9,250', 9250.0),
+    ('9,250.00', 9250.0),
+    ('24,000.50', 24000.5),
+    ('12.500,50', 12500.5),
+    ('9,25', 9.25),
+    ('7.5k', 7500.0),
+    ('10 000', 10000.0),
+])
+def test_parse_amount(text, expected):
+    assert range_index.parse_amount(text) == expected
+
+
+@pytest.mark.parametrize('text', ['1,2,3', '1.000,000.00', '12,5000'])
+def test_parse_amount_invalid(text):
+    with pytest.raises(ValueError):
+        range_index.parse_amount(text)
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('1 year', 12.0),
+    ('18 months', 18.0),
+    ('18months', 18.0),
+    ('eighteen months', 18.0),
+    ('Two years part time', 24.0),
+    ('1 year full time, 2 years part time', 12.0),
+    ('1-2 years', 12.0),
+    ('1.5 years', 18.0),
+    ('See the website', None),
+    (None, None),
+])
+def test_parse_duration(text, expected):
+    assert range_index.parse_duration(text) == expected
+
+
+@pytest.mark.parametrize('field, text, expected', [
+    ('feesEUR', '5,000-10,000 €', (5000.0, 10000.0)),
+    ('feesEUR', 'up to 7.5k', (None, 7500.0)),
+    ('feesEUR', 'at least 9,250.00', (9250.0, None)),
+    ('feesEUR', 'between 10 000 and 20 000', (10000.0, 20000.0)),
+    ('feesEUR', '15000+', (15000.0, None)),
+    ('duration', '<= 12 months', (None, 12.0)),
+    ('duration', 'at least 1 year', (12.0, None)),
+    ('duration', 'eighteen months', (18.0, 18.0)),
+    ('duration', '1-2 years', (12.0, 24.0)),
+])
+def test_parse_range(field, text, expected):
+    assert range_index.parse_range(field, text) == expected
+
+
+def test_parse_range_strict_bounds():
+    low, high = range_index.parse_range('feesEUR', 'under 5000 €')
+    assert low is None and high < 5000
+    low, high = range_index.parse_range('duration', 'more than 12 months')
+    assert low > 12 and high is None
+
+
+@pytest.mark.parametrize('field, text', [
+    ('feesEUR', 'up to 1,2,3 €'),
+    ('feesEUR', '¥5000'),
+    ('feesEUR', 'cheap'),
+    ('duration', '1.5.2 years'),
+    ('duration', 'many months'),
+])
+def test_parse_range_invalid(field, text):
+    with pytest.raises(ValueError):
+        range_index.parse_range(field, text)
+
+
+def test_parse_range_agrees_with_parse_duration():
+    for text in ['eighteen months', '2 years', 'six months', '1.5 years']:
+        assert range_index.parse_range('duration', text) == (range_index.parse_duration(text),) * 2
@@ -0,0 +1,143 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.sparse import hstack
+from scipy.sparse import random as sparse_random
+
+from modules import scoring
+from modules import sparse_matrix
+from modules import postings_file
+
+n_documents = 400
+n_terms = 40
+
+
+@pytest.fixture(scope = 'module')
+def corpus():
+    rng = np.random.default_rng(0)
+    # Some common terms (long posting lists) and many rare ones, as in the descriptions
+    densities = np.where(np.arange(n_terms) < 5, 0.5, 0.03)
+    columns = [sparse_random(n_documents, 1, density = density, random_state = rng, data_rvs = lambda n: rng.uniform(0.01, 1, n))
+               for density in densities]
+    # A term of all the documents, never in the queries: the documents that contain only one word
+    # of a query would otherwise have exactly the same similarity (up to the rounding errors)
+    columns.append(sparse_random(n_documents, 1, density = 1, random_state = rng, data_rvs = lambda n: rng.uniform(0.01, 1, n)))
+    matrix = hstack(columns).tocsr()
+    doc_ids = np.arange(n_documents) * 3 + 7
+    vocabulary = {f'w{i}': i for i in range(n_terms + 1)}
+    return matrix, doc_ids, vocabulary
+
+
+def make_index(matrix, doc_ids, vocabulary):
+    inverted_index = scoring.to_arrays(sparse_matrix.inverted_index(matrix, doc_ids, vocabulary))
+    norms = sparse_matrix.row_norms(matrix)
+    norms_df = pd.DataFrame({'norm': norms}, index = pd.Index(doc_ids, name = 'index'))
+    return inverted_index, norms_df, sparse_matrix.max_impacts(matrix, norms, vocabulary)
+
+
+def exhaustive_top_k(words, matrix, doc_ids, inverted_index, vocabulary, k, norms = None):
+    """
+    The cosine similarity of the query with every document, computed on the dense matrix
+    """
+    weights = scoring.query_weights(words, inverted_index, len(doc_ids), vocabulary)
+    query = np.zeros(matrix.shape[1])
+    for term_id, weight in weights.items():
+        query[term_id] = weight
+    dense = matrix.toarray()
+    if norms is None:
+        norms = np.linalg.norm(dense, axis = 1)
+    similarities = dense @ query / (norms * np.linalg.norm(query))
+    order = sorted((i for i in range(len(doc_ids)) if similarities[i] > 0), key = lambda i: (-similarities[i], doc_ids[i]))
+    return [(int(doc_ids[i]), float(similarities[i])) for i in order[:k]]
+
+
+def queries(seed = 1, n = 60):
+    rng = np.random.default_rng(seed)
+    lst_words = []
+    for _ in range(n):
+        # Mostly rare terms with some common ones, sometimes repeated or not in the vocabulary
+        words = [f'w{rng.integers(0, 5) if rng.random() < 0.3 else rng.integers(5, n_terms)}' for _ in range(rng.integers(1, 6))]
+        if rng.random() < 0.2:
+            words.append('missing')
+        lst_words.append(words)
+    return lst_words
+
+
+def assert_same_results(results, expected):
+    assert [doc_id for doc_id, _ in results] == [doc_id for doc_id, _ in expected]
+    assert [similarity for _, similarity in results] == pytest.approx([similarity for _, similarity in expected], rel = 1e-9)
+
+
+@pytest.mark.parametrize('k', [1, 3, 10, 50])
+def test_max_score_top_k(corpus, k, monkeypatch):
+    matrix, doc_ids, vocabulary = corpus
+    inverted_index, norms, max_impacts = make_index(matrix, doc_ids, vocabulary)
+
+    # Recording the candidates scored by max_score_top_k()
+    lst_candidates = []
+    cosine_top_k = scoring.cosine_top_k
+    def recording_top_k(words, inverted_index, norms, k, candidates, vocabulary):
+        lst_candidates.append(len(candidates))
+        return cosine_top_k(words, inverted_index, norms, k, candidates, vocabulary)
+
+    n_pruned = 0
+    for words in queries():
+        expected = exhaustive_top_k(words, matrix, doc_ids, inverted_index, vocabulary, k)
+        assert_same_results(cosine_top_k(words, inverted_index, norms, k, None, vocabulary), expected)
+
+        lst_candidates.clear()
+        with monkeypatch.context() as m:
+            m.setattr(scoring, 'cosine_top_k', recording_top_k)
+            assert_same_results(scoring.max_score_top_k(words, inverted_index, norms, max_impacts, k, vocabulary), expected)
+        union = {doc_id for word in set(words) if word in vocabulary for doc_id in inverted_index[vocabulary[word]][0]}
+        n_pruned += lst_candidates[-1] < len(union)
+
+    # The pruning skips documents in some of the queries
+    if k <= 10:
+        assert n_pruned > 0
+
+
+def test_max_score_top_k_quantized(corpus, tmp_path):
+    # The engines read the quantized weights of the postings file, with the bounds of both the weights
+    matrix, doc_ids, vocabulary = corpus
+    inverted_index, norms, max_impacts = make_index(matrix, doc_ids, vocabulary)
+    path = str(tmp_path / 'postings.bin')
+    postings_file.write(path, inverted_index)
+    with open(path, 'rb') as f:
+        quantized_index = postings_file.load(f)
+    quantized = postings_file.dequantized(matrix)
+    max_impacts_quantized = sparse_matrix.max_impacts(quantized, sparse_matrix.row_norms(matrix), vocabulary)
+    max_impacts = {term_id: max(value, max_impacts_quantized[term_id]) for term_id, value in max_impacts.items()}
+
+    for words in queries(seed = 2):
+        # The documents are divided by the norms of the exact weights, as in the engines
+        expected = exhaustive_top_k(words, quantized, doc_ids, quantized_index, vocabulary, 10, norms['norm'].values)
+        assert_same_results(scoring.max_score_top_k(words, quantized_index, norms, max_impacts, 10, vocabulary), expected)
+
+
+def test_max_score_top_k_without_words(corpus):
+    matrix, doc_ids, vocabulary = corpus
+    inverted_index, norms, max_impacts = make_index(matrix, doc_ids, vocabulary)
+
+    assert scoring.max_score_top_k(['missing'], inverted_index, norms, max_impacts, 10, vocabulary) is None
+    assert scoring.max_score_top_k([], inverted_index, norms, max_impacts, 10, vocabulary) is None
+
+
+def test_batch_top_k(corpus):
+    matrix, doc_ids, vocabulary = corpus
+    inverted_index, norms, max_impacts = make_index(matrix, doc_ids, vocabulary)
+    lst_words = queries(seed = 3)
+    query_matrix = scoring.query_matrix(lst_words, inverted_index, n_terms + 1, n_documents, vocabulary)
+
+    for results, words in zip(scoring.batch_top_k(query_matrix, matrix, doc_ids, 10, block_size = 7), lst_words):
+        assert_same_results(results, exhaustive_top_k(words, matrix, doc_ids, inverted_index, vocabulary, 10))
+
+
+def test_top_k_ties():
+    # The ties at the k-th similarity are broken by document id
+    doc_ids = np.array([9, 4, 7, 1, 8, 3])
+    similarities = np.array([0.5, 0.2, 0.5, 0.9, 0.5, 0.0])
+    assert scoring.top_k(doc_ids, similarities, 2) == [(1, 0.9), (7, 0.5)]
+    assert scoring.top_k(doc_ids, similarities, 3) == [(1, 0.9), (7, 0.5), (8, 0.5)]
+    # The documents with similarity 0 are never returned
+    assert scoring.top_k(doc_ids, similarities, 10) == [(1, 0.9), (7, 0.5), (8, 0.5), (9, 0.5), (4, 0.2)]